@@ -1,10 +1,34 @@
-from flask import Flask, jsonify, request, render_template, send_file
+from flask import Flask, Response, jsonify, request, render_template, send_file
 import os
 import json
 import logging
 from werkzeug.utils import secure_filename
 import uuid
-import requests # נדרש לשליחת Webhooks
+import threading
+import time
+from datetime import datetime
+import fcntl
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+from catalog import BATCH_FILENAME, GENERATION_FILENAME, MANIFEST_FILENAME, QUARANTINE_FOLDER, get_catalog
+from changelog import ChangeLog
+from audio_cache import file_sha256
+from content_store import (UUID_FILENAME_RE, GarbageCollector, adopt_file, content_filename, folder_usage,
+                           is_generated_filename, quarantined_references, reference_counts, store_file,
+                           temp_path)
+from renditions import RENDITION_FIELDS, rendition_key, update_song_rendition
+from webhooks import WebhookDispatcher, WebhookOutbox
+from distribution import DISTRIBUTED_TYPES, P2P_FANOUT, distribution_tree
+from bell_schedule import (MAX_SCHEDULE_DAYS, SCHEDULE_DAYS, compile_schedule, schedule_until,
+                      validate_calendar_entry, validate_event_rule)
+from leader import LeaderLock
+from uploads import (MAX_PANIC_BYTES, MAX_SONG_BYTES, SNIFF_BYTES, UploadError, UploadStore,
+                     check_audio_file)
+from metrics import (METRICS_CONTENT_TYPE, Registry, histogram_mean, parse_families, parse_metrics,
+                     render_fleet, sample_value)
 
 # --- הגדרות ---
 app = Flask(__name__, template_folder='templates', static_folder='static')
@@ -14,6 +38,8 @@ app.config['UPLOAD_FOLDER'] = 'storage'
 EVENTS_FOLDER = os.path.join(app.config['UPLOAD_FOLDER'], 'events')
 SONGS_FOLDER = os.path.join(app.config['UPLOAD_FOLDER'], 'songs')
 PANIC_FOLDER = os.path.join(app.config['UPLOAD_FOLDER'], 'panic')
+# לוח השנה: איזו מערכת שעות (פרופיל) פעילה בכל תאריך (ראה bell_schedule.py)
+CALENDAR_FOLDER = os.path.join(app.config['UPLOAD_FOLDER'], 'calendar')
 
 # --- הגדרות Webhook ---
 # רשימת כתובות הרסיברים המקומיים שלך (כל Raspberry Pi)
@@ -22,126 +48,711 @@ RECEIVER_URLS = [
     "http://192.168.1.227:5000/api/webhook_receive", # רסיבר 1
     "http://192.168.1.102:5000/api/webhook_receive"  # רסיבר 2
 ]
+# אפשר גם להגדיר דרך הסביבה (מופרד בפסיקים), למשל בהרצת ה-benchmarks
+if os.environ.get('RINGER_RECEIVER_URLS'):
+    RECEIVER_URLS = [url.strip() for url in os.environ['RINGER_RECEIVER_URLS'].split(',') if url.strip()]
 
 os.makedirs(EVENTS_FOLDER, exist_ok=True)
 os.makedirs(SONGS_FOLDER, exist_ok=True)
 os.makedirs(PANIC_FOLDER, exist_ok=True)
+os.makedirs(CALENDAR_FOLDER, exist_ok=True)
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - (Server) - %(message)s')
 
+# --- קטלוג בזיכרון (נטען פעם אחת בעלייה) ---
+get_catalog(SONGS_FOLDER)
+get_catalog(EVENTS_FOLDER)
+get_catalog(CALENDAR_FOLDER)
+
+# --- יומן שינויים לסנכרון חלקי (rev עולה לכל שינוי) ---
+CHANGELOG_FILE = os.path.join(app.config['UPLOAD_FOLDER'], 'changes.jsonl')
+CHANGELOG_KINDS = {'songs': SONGS_FOLDER, 'events': EVENTS_FOLDER, 'calendar': CALENDAR_FOLDER}
+changelog = ChangeLog(CHANGELOG_FILE)
+for _kind, _folder in CHANGELOG_KINDS.items():
+    changelog.reconcile(_kind, get_catalog(_folder))
+    get_catalog(_folder).add_listener(changelog.listener(_kind))
+
 # --- פונקציות עזר כלליות ---
 def get_item_by_id(folder, item_id):
-    """מחפש ומחזיר פריט JSON לפי מזהה"""
-    filepath = os.path.join(folder, f"{item_id}.json")
-    if os.path.exists(filepath):
-        try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception:
-            return None
-    return None
+    """מחפש ומחזיר פריט JSON לפי מזהה (מהקטלוג בזיכרון)"""
+    return get_catalog(folder).get(item_id)
 
 def list_json_files(folder):
-    """רשימה של כל קבצי ה-JSON בתיקייה נתונה"""
-    items = []
-    for filename in os.listdir(folder):
-        if filename.endswith('.json'):
-            try:
-                filepath = os.path.join(folder, filename)
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    items.append(data)
-            except Exception as e:
-                logging.warning(f"שגיאה בקריאת קובץ {filename}: {e}")
-    return items
+    """רשימה של כל פריטי ה-JSON בתיקייה נתונה (מהקטלוג בזיכרון)"""
+    return get_catalog(folder).list()
 
 def save_json_file(folder, data, file_id=None):
-    """שמירת נתונים לקובץ JSON"""
+    """שמירת נתונים לקובץ JSON ועדכון הקטלוג"""
     if not file_id:
         file_id = str(uuid.uuid4())
         data['id'] = file_id
     
     data['id'] = str(data['id'])
-    filepath = os.path.join(folder, f"{data['id']}.json")
-    
-    with open(filepath, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-    return data
+    return get_catalog(folder).put(data)
+
+def save_json_files(folder, items):
+    """שמירת רשומות רבות ב-group commit אחד (fsync אחד לתיקייה)"""
+    return get_catalog(folder).put_many(items)
+
+def apply_json_files(folder, items, deleted_ids):
+    """שמירות ומחיקות כאצווה אחת: נכנסות לתוקף כולן או אף אחת"""
+    return get_catalog(folder).apply(items, deleted_ids)
 
 def upload_and_save_file(file, folder, original_filename):
-    """שמירה מאובטחת של קובץ והחזרת השם הייחודי שנוצר."""
+    """שמירה מאובטחת של קובץ (פאניק) והחזרת השם הייחודי שנוצר."""
     filename_secured = secure_filename(original_filename)
     extension = os.path.splitext(filename_secured)[1]
     unique_filename = str(uuid.uuid4()) + (extension if extension else '.mp3')
     file_path = os.path.join(folder, unique_filename)
     file.save(file_path)
+    register_media_file(folder, unique_filename)
     return unique_filename
 
+def save_song_file(file, original_filename):
+    """שומר קובץ שיר לפי התוכן (content_store). מחזיר (שם הקובץ, sha256)."""
+    extension = os.path.splitext(secure_filename(original_filename))[1] or '.mp3'
+    tmp_path = temp_path(SONGS_FOLDER, extension)
+    try:
+        file.save(tmp_path)
+        content_hash = file_sha256(tmp_path)
+        filename, _ = store_file(tmp_path, SONGS_FOLDER, extension, content_hash)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    register_media_file(SONGS_FOLDER, filename)
+    return filename, content_hash
+
+# תוספת הגודל של עטיפת ה-multipart (גבולות, כותרות, metadata) מעל הקובץ עצמו
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+def check_multipart_upload(file, max_bytes):
+    """בדיקות גודל וסוג להעלאה הישנה (multipart). זורק UploadError."""
+    head = file.stream.read(SNIFF_BYTES)
+    file.stream.seek(0)
+    check_audio_file(file.filename, head, request.content_length, max_bytes + MULTIPART_OVERHEAD_BYTES)
+
+def prepare_song_rendition(song):
+    """מפיק (או מעדכן) את גרסת הניגון המנורמלת והחתוכה של שיר. הגרסה הקודמת נאספת ב-media_gc."""
+    update_song_rendition(song, SONGS_FOLDER)
+    if song.get('renditionFilename'):
+        register_media_file(SONGS_FOLDER, song['renditionFilename'])
+    return song
+
 def delete_json_file(folder, file_id):
-    """מחיקת קובץ JSON"""
-    filepath = os.path.join(folder, f"{file_id}.json")
-    if os.path.exists(filepath):
-        os.remove(filepath)
-        return True
-    return False
+    """מחיקת קובץ JSON ועדכון הקטלוג"""
+    return get_catalog(folder).delete(file_id)
+
+# --- אינדקס קבצי מדיה (שם קובץ -> תיקייה) ---
+# שמות הקבצים נגזרים מהתוכן (שירים) או ייחודיים (uuid, פאניק), ולכן תוכן של שם נתון לא משתנה לעולם
+MEDIA_FOLDERS = (SONGS_FOLDER, PANIC_FOLDER)
+MEDIA_MAX_AGE_SECONDS = 365 * 24 * 60 * 60
+# בפריסה מאחורי nginx/Apache אפשר להעביר את שליחת הקבצים לשרת הקדמי
+app.config['USE_X_SENDFILE'] = os.environ.get('RINGER_X_SENDFILE') == '1'
+
+_media_index = {}    # שם קובץ -> תיקייה
+_media_hashes = {}   # נתיב -> ((mtime_ns, size), sha256)
+_media_lock = threading.Lock()
+
+def build_media_index():
+    """סורק פעם אחת את תיקיות המדיה."""
+    with _media_lock:
+        _media_index.clear()
+        for folder in MEDIA_FOLDERS:
+            for entry in os.scandir(folder):
+                if entry.is_file() and not entry.name.endswith(('.json', '.tmp', '.part', '.lock')) \
+                        and entry.name not in (MANIFEST_FILENAME, GENERATION_FILENAME, BATCH_FILENAME):
+                    _media_index.setdefault(entry.name, folder)
+
+def register_media_file(folder, filename):
+    with _media_lock:
+        _media_index[filename] = folder
+
+def find_media_file(filename):
+    """הנתיב של קובץ מדיה לפי שם, מהאינדקס. רק בהחטאה בודקים את הדיסק (קובץ שנוסף מבחוץ)."""
+    filename = secure_filename(filename)
+    if filename.endswith(('.part', '.tmp', '.lock')):
+        # העלאה או הורדה שעוד לא הסתיימה
+        return None
+    with _media_lock:
+        folder = _media_index.get(filename)
+    if folder and os.path.isfile(os.path.join(folder, filename)):
+        return os.path.join(folder, filename)
+    if folder:
+        # נמחק ע"י worker אחר
+        with _media_lock:
+            _media_index.pop(filename, None)
+    for folder in MEDIA_FOLDERS:
+        if os.path.isfile(os.path.join(folder, filename)):
+            register_media_file(folder, filename)
+            return os.path.join(folder, filename)
+    return None
+
+def media_etag(file_path):
+    """ETag חזק לפי sha256 של התוכן; מחושב פעם אחת לכל גרסה של הקובץ."""
+    st = os.stat(file_path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    with _media_lock:
+        cached = _media_hashes.get(file_path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    digest = file_sha256(file_path)
+    with _media_lock:
+        _media_hashes[file_path] = (stamp, digest)
+    return digest
+
+build_media_index()
+
+def validate_event(data):
+    """בודק אירוע לפני שמירה. מחזיר הודעת שגיאה או None."""
+    if not data or not data.get('name') or not data.get('time') or not data.get('songId'):
+        return 'Missing required fields'
+    error = validate_event_rule(data)
+    if error:
+        return error
+    if not get_item_by_id(SONGS_FOLDER, data['songId']):
+        logging.error(f"אירוע '{data['name']}' מפנה לשיר שלא קיים: {data['songId']}")
+        return f"Unknown songId: {data['songId']}"
+    return None
+
+def backfill_song_hashes():
+    """
+    משלים contentHash לשירים ישנים שנשמרו לפני שהשדה נוסף (הרסיברים מזהים קבצים לפיו).
+    רץ פעם אחת אצל המוביל (start_leader_services), לא בכל worker שעולה.
+    """
+    for song in list_json_files(SONGS_FOLDER):
+        file_path = os.path.join(SONGS_FOLDER, song.get('filename') or '')
+        if not song.get('contentHash') and song.get('filename') and os.path.exists(file_path):
+            song['contentHash'] = file_sha256(file_path)
+            save_json_file(SONGS_FOLDER, song, song['id'])
+
+def migrate_song_files():
+    """
+    מעביר קבצי שירים וגרסאות ניגון בשמות הישנים (uuid) לשמות לפי התוכן ומעדכן את
+    הרשומות. הקבצים הישנים נשארים עד שאוסף הקבצים מוחק אותם, כך שנפילה באמצע לא
+    משאירה רשומה בלי קובץ. הרסיברים מזהים קבצים לפי ה-hash ולא מורידים אותם שוב.
+    """
+    migrated = []
+    for song in list_json_files(SONGS_FOLDER):
+        song = dict(song)
+        changed = False
+        for field, hash_field, url_field in (('filename', 'contentHash', 'url'),
+                                             ('renditionFilename', 'renditionHash', 'renditionUrl')):
+            filename, content_hash = song.get(field), song.get(hash_field)
+            if not filename or not content_hash:
+                continue
+            extension = os.path.splitext(filename)[1]
+            file_path = os.path.join(SONGS_FOLDER, filename)
+            if filename == content_filename(content_hash, extension) or not os.path.isfile(file_path):
+                continue
+            new_filename, _ = adopt_file(file_path, SONGS_FOLDER, extension, content_hash)
+            register_media_file(SONGS_FOLDER, new_filename)
+            song[field] = new_filename
+            song[url_field] = f'/api/song_file/{new_filename}'
+            changed = True
+        if changed:
+            migrated.append(song)
+    if migrated:
+        save_json_files(SONGS_FOLDER, migrated)
+        logging.info(f"קבצי {len(migrated)} שירים הועברו לאחסון לפי תוכן.")
+        notify_receivers('songs_update', {'songIds': [song['id'] for song in migrated]})
+
+# --- הפקת גרסאות ניגון ברקע (רק בתהליך המוביל) ---
+# שמירת שיר לא מחכה ל-ffmpeg: הרשומה נשמרת מיד בלי גרסת ניגון (הרסיברים מנגנים
+# את המקור), והמוביל מזהה שירים שהגרסה שלהם חסרה או לא מתאימה, מפיק אותה
+# ושומר רק את שדות הגרסה ברשומה העדכנית. שינוי מ-worker אחר נראה בקטלוג
+# המשותף תוך RENDITION_POLL_SECONDS.
+RENDITION_POLL_SECONDS = 2
+_rendition_wakeup = threading.Event()
+# (מזהה שיר, renditionKey) שההפקה שלהם נכשלה; לא מנסים שוב עד שהשיר משתנה
+_failed_renditions = set()
+
+def clear_stale_rendition(song):
+    """מסיר משיר גרסת ניגון שכבר לא מתאימה למקור/לחיתוך (לפני שמירה)."""
+    if song.get('renditionKey') != rendition_key(song):
+        for field in RENDITION_FIELDS:
+            song.pop(field, None)
+    return song
+
+def backfill_song_renditions():
+    """מפיק גרסאות ניגון לשירים שאין להם (או שהפרמטרים השתנו מאז), ומעדכן את הרסיברים."""
+    updated = []
+    for song in list_json_files(SONGS_FOLDER):
+        attempt = (str(song['id']), rendition_key(song))
+        if attempt in _failed_renditions:
+            continue
+        before = {field: song.get(field) for field in RENDITION_FIELDS}
+        prepare_song_rendition(song)
+        if not song.get('renditionFilename') and song.get('filename'):
+            _failed_renditions.add(attempt)
+        if all(song.get(field) == value for field, value in before.items()):
+            continue
+        # השיר אולי נערך בזמן ההפקה: שומרים רק את שדות הגרסה, ורק אם היא עדיין מתאימה
+        current = get_item_by_id(SONGS_FOLDER, song['id'])
+        if not current or rendition_key(current) != attempt[1]:
+            continue
+        current = dict(current)
+        for field in RENDITION_FIELDS:
+            if field in song:
+                current[field] = song[field]
+            else:
+                current.pop(field, None)
+        save_json_file(SONGS_FOLDER, current, current['id'])
+        updated.append(current['id'])
+    if updated:
+        logging.info(f"גרסאות ניגון עודכנו ל-{len(updated)} שירים.")
+        notify_receivers('songs_update', {'songIds': updated})
+
+def run_rendition_worker():
+    """לולאת המוביל: מעביר קבצים ישנים לאחסון לפי תוכן, ואז מפיק גרסאות לכל שינוי בקטלוג."""
+    migrate_song_files()
+    songs_catalog = get_catalog(SONGS_FOLDER)
+    seen_version = None
+    while True:
+        songs_catalog.refresh()
+        if songs_catalog.version != seen_version:
+            seen_version = songs_catalog.version
+            try:
+                backfill_song_renditions()
+            except Exception as e:
+                logging.error(f"שגיאה בהפקת גרסאות ניגון: {e}")
+        _rendition_wakeup.wait(RENDITION_POLL_SECONDS)
+        _rendition_wakeup.clear()
 
 # --- מנגנון התראות Webhook ---
+# כל הודעה נרשמת בתור עמיד תחת storage/outbox ונשלחת במקביל ברקע (ראה webhooks.py)
+OUTBOX_FOLDER = os.path.join(app.config['UPLOAD_FOLDER'], 'outbox')
+
+def current_distribution_tree():
+    """עץ ההפצה בין הרסיברים (distribution.py), בלי רסיברים שלא ענו ל-Webhook האחרון."""
+    statuses = webhook_dispatcher.status()
+    live = [url for url in RECEIVER_URLS if statuses.get(url, {}).get('last_ok') is not False]
+    return distribution_tree(live, P2P_FANOUT)
+
+def add_distribution_sources(url, payload):
+    """מוסיף להודעה את מקורות ההורדה של הרסיבר הזה (שכנים לפני השרת)."""
+    if not P2P_FANOUT or payload.get('type') not in DISTRIBUTED_TYPES:
+        return payload
+    return dict(payload, sources=current_distribution_tree().get(url, []))
+
+webhook_dispatcher = WebhookDispatcher(RECEIVER_URLS, personalize=add_distribution_sources)
+webhook_outbox = WebhookOutbox(OUTBOX_FOLDER, webhook_dispatcher)
+
 def notify_receivers(event_type, payload=None):
-    """שולח הודעת Webhook לכל הרסיברים."""
+    """רושם הודעת Webhook בתור השליחה לכל הרסיברים וחוזר מיד."""
     if payload is None:
         payload = {}
         
     payload['type'] = event_type
-    
-    for url in RECEIVER_URLS:
-        try:
-            logging.info(f"שולח Webhook ל-{url} על אירוע {event_type}...")
-            # משתמש ב-timeout כדי לא להיתקע אם רסיבר אחד לא זמין
-            response = requests.post(url, json=payload, timeout=5) 
-            response.raise_for_status() 
-            logging.info(f"Webhook נשלח בהצלחה ל-{url}. תגובה: {response.status_code}")
-        except requests.exceptions.RequestException as e:
-            logging.error(f"שגיאה בשליחת Webhook ל-{url} ({event_type}): {e}")
+    return webhook_outbox.enqueue(event_type, payload)
 
 # --- API קוד Flask ---
 @app.route('/api/data', methods=['GET'])
 def api_get_all_data():
-    """נקודת קצה למשיכת כל נתוני השירים והאירועים (משמש את הרסיברים)."""
-    songs = list_json_files(SONGS_FOLDER)
-    events = list_json_files(EVENTS_FOLDER)
-    return jsonify({'songs': songs, 'events': events}), 200
+    """נקודת קצה למשיכת כל נתוני השירים, האירועים ולוח השנה (משמש את לוח הבקרה).
+    תומך ב-If-None-Match: אם לא היה שינוי מאז ה-ETag הקודם מוחזר 304."""
+    for folder in CHANGELOG_KINDS.values():
+        get_catalog(folder).refresh()
+    rev = changelog.refresh()
+    etag = f"catalog-{rev}"
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        data = {kind: list_json_files(folder) for kind, folder in CHANGELOG_KINDS.items()}
+        response = jsonify(dict(data, rev=rev))
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def collect_changes(since):
+    """השירים/האירועים/רשומות לוח השנה שנוספו, עודכנו או נמחקו אחרי rev נתון (כרשומות מלאות)."""
+    for folder in CHANGELOG_KINDS.values():
+        get_catalog(folder).refresh()
+    rev, changes = changelog.changes_since(since)
+
+    # rev גדול מהנוכחי = היומן בשרת אותחל; הלקוח צריך תמונה מלאה
+    if since > rev:
+        result = {'rev': rev, 'full': True, 'deleted': {kind: [] for kind in CHANGELOG_KINDS}}
+        for kind, folder in CHANGELOG_KINDS.items():
+            result[kind] = list_json_files(folder)
+        return result
+
+    result = {'rev': rev, 'full': False, 'deleted': {}}
+    for kind, folder in CHANGELOG_KINDS.items():
+        kind_changes = changes.get(kind, {'put': [], 'delete': []})
+        items, deleted = [], list(kind_changes['delete'])
+        for item_id in kind_changes['put']:
+            item = get_item_by_id(folder, item_id)
+            if item is None:
+                deleted.append(item_id)
+            else:
+                items.append(item)
+        result[kind] = items
+        result['deleted'][kind] = deleted
+    return result
+
+@app.route('/api/changes', methods=['GET'])
+def api_get_changes():
+    """מחזיר רק את השירים/האירועים/רשומות לוח השנה שנוספו, עודכנו או נמחקו אחרי ?since=<rev>."""
+    since = request.args.get('since', default=0, type=int)
+    return jsonify(collect_changes(since)), 200
+
+# --- לוח צלצולים מקומפל (ראה bell_schedule.py) ---
+# הכללים (אירועים + לוח שנה) מקומפלים פעם אחת לכל rev ותאריך, וכל הרסיברים
+# מקבלים את אותה רשימה ממוינת; רסיבר מושך אותה בכל סנכרון (Webhook של
+# events_update או הסנכרון התקופתי) ומקבל 304 כשלא השתנה דבר.
+_schedule_cache = {'key': None, 'body': None}
+_schedule_lock = threading.Lock()
+
+def compiled_schedule(start_date, days):
+    """(rev, גוף התשובה) ללוח הצלצולים מ-start_date ל-days ימים."""
+    for folder in CHANGELOG_KINDS.values():
+        get_catalog(folder).refresh()
+    rev = changelog.refresh()
+    key = (rev, start_date.isoformat(), days)
+    with _schedule_lock:
+        if _schedule_cache['key'] != key:
+            # אירועים לא תקינים מדולגים ונרשמים ביומן בתוך compile_schedule
+            entries, _ = compile_schedule(list_json_files(EVENTS_FOLDER), list_json_files(CALENDAR_FOLDER),
+                                          start_date, days)
+            _schedule_cache['body'] = {
+                'rev': rev,
+                'from': start_date.isoformat(),
+                'days': days,
+                'until': schedule_until(start_date, days),
+                'entries': entries,
+            }
+            _schedule_cache['key'] = key
+        return rev, _schedule_cache['body']
+
+@app.route('/api/schedule', methods=['GET'])
+def api_get_schedule():
+    """
+    רשימת הצלצולים השטוחה והממוינת מהיום ל-?days= ימים (ברירת מחדל SCHEDULE_DAYS).
+    תומך ב-If-None-Match: ה-ETag משתנה רק כשהקטלוג או התאריך משתנים.
+    """
+    days = request.args.get('days', default=SCHEDULE_DAYS, type=int)
+    if not 1 <= days <= MAX_SCHEDULE_DAYS:
+        return jsonify({'error': f'days must be between 1 and {MAX_SCHEDULE_DAYS}'}), 400
+    start_date = datetime.now().date()
+    rev, body = compiled_schedule(start_date, days)
+    etag = f"schedule-{rev}-{start_date.isoformat()}-{days}"
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(body)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+# --- זרמים ארוכים (SSE, שידור פאניק) ---
+# כל זרם פתוח תופס thread של ה-worker (gthread) לכל אורכו. כדי שתמיד יישארו
+# threads לבקשות רגילות, לכל סוג זרם יש מכסה לכל worker: רבע מה-threads לכל
+# סוג, כך שלפחות חצי נשארים פנויים (ראה gunicorn.conf.py). מעבר למכסה - 503.
+WORKER_THREADS = int(os.environ.get('RINGER_THREADS', '8'))
+MAX_LIVE_STREAMS = int(os.environ.get('RINGER_MAX_LIVE_STREAMS', max(1, WORKER_THREADS // 4)))
+MAX_PANIC_PULLS = int(os.environ.get('RINGER_MAX_PANIC_PULLS', max(1, WORKER_THREADS // 4)))
+STREAM_RETRY_AFTER_SECONDS = 2
+_live_slots = threading.BoundedSemaphore(MAX_LIVE_STREAMS)
+_panic_pull_slots = threading.BoundedSemaphore(MAX_PANIC_PULLS)
+
+def streaming_response(slots, generate, **kwargs):
+    """Response לזרם שתופס מקום ב-slots עד שהחיבור נסגר, או 503 אם אין מקום."""
+    if not slots.acquire(blocking=False):
+        response = jsonify({'error': 'Too many open streams, retry later'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(STREAM_RETRY_AFTER_SECONDS)
+        return response
+    try:
+        response = Response(generate, **kwargs)
+    except Exception:
+        slots.release()
+        raise
+    response.call_on_close(slots.release)
+    return response
+
+# --- עדכונים חיים ללוח הבקרה (Server-Sent Events) ---
+# כל דפדפן פתוח מקבל את אותם שינויים שהרסיברים מקבלים, כרשומות מלאות, ומחיל
+# אותם על הרשימות שבזיכרון. שינוי באותו worker מעיר את הזרם מיד; שינוי
+# מ-worker אחר נראה ביומן השינויים המשותף תוך LIVE_POLL_SECONDS.
+LIVE_POLL_SECONDS = 0.5
+LIVE_HEARTBEAT_SECONDS = 15
+LIVE_RETRY_MS = 3000
+# חיבור נסגר אחרי הזמן הזה כדי לפנות את ה-thread; הדפדפן מתחבר מחדש עם Last-Event-ID
+LIVE_MAX_SECONDS = int(os.environ.get('RINGER_LIVE_MAX_SECONDS', '300'))
+_live_activity = threading.Condition()
+
+def wake_live_clients(catalog, op, item_id):
+    with _live_activity:
+        _live_activity.notify_all()
+
+for _folder in CHANGELOG_KINDS.values():
+    get_catalog(_folder).add_listener(wake_live_clients)
+
+@app.route('/api/live', methods=['GET'])
+def api_live_updates():
+    """
+    זרם SSE של שינויים בקטלוג. ?since=<rev> (או Last-Event-ID בהתחברות מחדש)
+    קובע מאיפה להתחיל; כל הודעה היא מבנה זהה לתשובה של /api/changes.
+    החיבור נסגר אחרי LIVE_MAX_SECONDS, ו-id בתחילת הזרם מבטיח שהדפדפן ימשיך
+    מאותו rev גם אם לא הגיע אף שינוי.
+    """
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('since', default=changelog.refresh(), type=int)
+
+    def generate(since):
+        yield f"retry: {LIVE_RETRY_MS}\nid: {since}\n\n"
+        last_sent = time.monotonic()
+        deadline = last_sent + LIVE_MAX_SECONDS
+        while time.monotonic() < deadline:
+            for folder in CHANGELOG_KINDS.values():
+                get_catalog(folder).refresh()
+            if changelog.refresh() != since:
+                changes = collect_changes(since)
+                since = changes['rev']
+                last_sent = time.monotonic()
+                yield f"id: {since}\nevent: changes\ndata: {json.dumps(changes, ensure_ascii=False)}\n\n"
+            elif time.monotonic() - last_sent > LIVE_HEARTBEAT_SECONDS:
+                last_sent = time.monotonic()
+                yield ": keepalive\n\n"
+            with _live_activity:
+                _live_activity.wait(LIVE_POLL_SECONDS)
+
+    return streaming_response(_live_slots, generate(since), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
+@app.route('/api/receivers', methods=['GET'])
+def api_receivers_status():
+    """סטטוס לכל רסיבר: השליחה האחרונה (תוצאה, קוד תגובה וזמנים) ומצב התור."""
+    return jsonify(webhook_outbox.status()), 200
+
+@app.route('/api/time', methods=['GET'])
+def api_time():
+    """השעה בשרת (epoch), לרסיברים שמודדים את הפרש השעון שלהם."""
+    return jsonify({'time': time.time()}), 200
+
+# --- מדדים ותצוגת צי ---
+# /api/metrics של השרת מחזיר את מצב התור והשליחה לכל רסיבר. מספרי השליחה
+# (sent/failed/זמנים) נספרים בתהליך המוביל בלבד, שהוא זה ששולח; ב-worker אחר
+# מופיעים רק מצב התור וה-rev. /api/fleet אוסף את /api/metrics של כל הרסיברים.
+FLEET_SCRAPE_TIMEOUT = 3
+FLEET_CACHE_SECONDS = 10
+# מעבר לסף הזה הרסיבר מסומן בתצוגת הצי
+FLEET_CLOCK_SKEW_WARN_SECONDS = 0.5
+FLEET_BELL_LATENESS_WARN_SECONDS = 0.25
+FLEET_SYNC_AGE_WARN_SECONDS = 3 * 300
+_fleet_cache = {'at': 0.0, 'scrapes': None}
+_fleet_lock = threading.Lock()
+
+metrics = Registry()
+SERVER_LEADER = metrics.gauge('ringer_leader', '1 if this worker sends webhooks and renders songs')
+CATALOG_REV = metrics.gauge('ringer_catalog_rev', 'Current changelog rev')
+CATALOG_ITEMS = metrics.gauge('ringer_catalog_items', 'Records in the catalog')
+WEBHOOK_PENDING = metrics.gauge('ringer_webhook_pending', 'Outbox messages not yet acknowledged by the receiver')
+WEBHOOK_ATTEMPTS = metrics.gauge('ringer_webhook_attempts', 'Consecutive failed delivery attempts')
+WEBHOOK_SENT = metrics.counter('ringer_webhook_sent_total', 'Webhooks delivered (leader worker only)')
+WEBHOOK_FAILED = metrics.counter('ringer_webhook_failed_total', 'Webhook delivery failures (leader worker only)')
+WEBHOOK_LAST_OK = metrics.gauge('ringer_webhook_last_ok', '1 if the last delivery succeeded')
+WEBHOOK_LAST_LATENCY = metrics.gauge('ringer_webhook_last_latency_seconds', 'Round trip of the last delivery')
+WEBHOOK_LAST_DELIVERED_AFTER = metrics.gauge(
+    'ringer_webhook_last_delivered_after_seconds', 'Time from enqueue to delivery of the last webhook')
+RECEIVER_UP = metrics.gauge('ringer_receiver_up', '1 if the last /api/metrics scrape of the receiver succeeded')
+MEDIA_FILES = metrics.gauge('ringer_song_files', 'Stored song and rendition files')
+MEDIA_BYTES = metrics.gauge('ringer_song_files_bytes', 'Disk used by stored song and rendition files')
+MEDIA_REFERENCES = metrics.gauge('ringer_song_file_references', 'References from song records to stored files')
+MEDIA_GC_REMOVED = metrics.counter('ringer_song_files_collected_total', 'Unreferenced files removed (leader worker only)')
+MEDIA_GC_FREED = metrics.counter('ringer_song_files_collected_bytes_total', 'Bytes freed by the collector (leader worker only)')
+
+def receiver_metrics_url(webhook_url):
+    return webhook_url.replace('/api/webhook_receive', '/api/metrics')
+
+def collect_server_metrics():
+    SERVER_LEADER.set(1 if leader.is_leader else 0)
+    CATALOG_REV.set(changelog.refresh())
+    for kind, folder in CHANGELOG_KINDS.items():
+        CATALOG_ITEMS.set(len(list_json_files(folder)), kind=kind)
+    for url, status in webhook_outbox.status().items():
+        WEBHOOK_PENDING.set(status.get('pending'), receiver=url)
+        WEBHOOK_ATTEMPTS.set(status.get('attempts'), receiver=url)
+        if leader.is_leader:
+            WEBHOOK_SENT.set_total(status['sent'], receiver=url)
+            WEBHOOK_FAILED.set_total(status['failed'], receiver=url)
+        if status.get('last_ok') is not None:
+            WEBHOOK_LAST_OK.set(1 if status['last_ok'] else 0, receiver=url)
+        if status.get('last_latency_ms') is not None:
+            WEBHOOK_LAST_LATENCY.set(status['last_latency_ms'] / 1000, receiver=url)
+        if status.get('last_delivered_after_ms') is not None:
+            WEBHOOK_LAST_DELIVERED_AFTER.set(status['last_delivered_after_ms'] / 1000, receiver=url)
+    files, size = folder_usage(SONGS_FOLDER)
+    MEDIA_FILES.set(files)
+    MEDIA_BYTES.set(size)
+    MEDIA_REFERENCES.set(sum(reference_counts(list_json_files(SONGS_FOLDER)).values()))
+    scrapes = _fleet_cache['scrapes'] or {}
+    for url in RECEIVER_URLS:
+        if url in scrapes:
+            RECEIVER_UP.set(1 if scrapes[url]['up'] else 0, receiver=url)
+
+metrics.add_collector(collect_server_metrics)
+
+def scrape_receiver(url):
+    """מושך את /api/metrics של רסיבר. מחזיר {'up', 'samples', 'families', 'error', 'scraped_at'}."""
+    scraped_at = time.time()
+    try:
+        response = requests.get(receiver_metrics_url(url), timeout=FLEET_SCRAPE_TIMEOUT)
+        response.raise_for_status()
+        return {'up': True, 'samples': parse_metrics(response.text), 'families': parse_families(response.text),
+                'error': None, 'scraped_at': scraped_at}
+    except Exception as e:
+        return {'up': False, 'samples': [], 'families': {}, 'error': str(e), 'scraped_at': scraped_at}
+
+def scrape_fleet(max_age=FLEET_CACHE_SECONDS):
+    """מדדי כל הרסיברים (במקביל), ממטמון של עד max_age שניות."""
+    with _fleet_lock:
+        if _fleet_cache['scrapes'] is not None and time.monotonic() - _fleet_cache['at'] < max_age:
+            return _fleet_cache['scrapes']
+        with ThreadPoolExecutor(max_workers=max(1, len(RECEIVER_URLS))) as pool:
+            scrapes = dict(zip(RECEIVER_URLS, pool.map(scrape_receiver, RECEIVER_URLS)))
+        _fleet_cache.update(at=time.monotonic(), scrapes=scrapes)
+        return scrapes
+
+def summarize_receiver(scrape):
+    """סיכום קריא של מדדי רסיבר אחד, עם אזהרות על איחור, הפרש שעון וסנכרון ישן."""
+    samples = scrape['samples']
+    summary = {'up': scrape['up'], 'error': scrape['error']}
+    if not scrape['up']:
+        summary['warnings'] = ['unreachable']
+        return summary
+
+    def ms(value):
+        return round(value * 1000, 1) if value is not None else None
+
+    server_offset = sample_value(samples, 'ringer_clock_offset_seconds', source='server')
+    last_sync = sample_value(samples, 'ringer_last_sync_timestamp_seconds')
+    sync_age = None
+    if last_sync is not None:
+        # זמן הסנכרון נמדד בשעון הרסיבר; מתקנים להפרש מול השרת
+        sync_age = round(scrape['scraped_at'] - (last_sync - (server_offset or 0.0)), 1)
+    summary.update({
+        'leader': sample_value(samples, 'ringer_leader') == 1,
+        'bells_fired': sample_value(samples, 'ringer_bells_fired_total') or 0,
+        'bells_skipped': sample_value(samples, 'ringer_bells_skipped_total') or 0,
+        'avg_bell_lateness_ms': ms(histogram_mean(samples, 'ringer_bell_lateness_seconds')),
+        'last_bell_lateness_ms': ms(sample_value(samples, 'ringer_bell_last_lateness_seconds')),
+        'avg_bell_start_latency_ms': ms(histogram_mean(samples, 'ringer_player_start_latency_seconds', channel='bells')),
+        'avg_announcement_start_latency_ms': ms(
+            histogram_mean(samples, 'ringer_player_start_latency_seconds', channel='announcements')),
+        'last_panic_end_to_end_ms': {
+            kind: ms(sample_value(samples, 'ringer_panic_last_end_to_end_seconds', kind=kind))
+            for kind in ('file', 'stream')},
+        'clock_offset_server_ms': ms(server_offset),
+        'clock_offset_ntp_ms': ms(sample_value(samples, 'ringer_clock_offset_seconds', source='ntp')),
+        'sync_rev': sample_value(samples, 'ringer_sync_rev'),
+        'sync_age_seconds': sync_age,
+        'panic_queue_depth': sample_value(samples, 'ringer_panic_queue_depth'),
+        'player_failures': sum(v for name, _, v in samples if name == 'ringer_player_failures_total'),
+    })
+
+    warnings = []
+    offsets = [o for o in (summary['clock_offset_server_ms'], summary['clock_offset_ntp_ms']) if o is not None]
+    if any(abs(o) > FLEET_CLOCK_SKEW_WARN_SECONDS * 1000 for o in offsets):
+        warnings.append('clock_skew')
+    if (summary['avg_bell_lateness_ms'] or 0) > FLEET_BELL_LATENESS_WARN_SECONDS * 1000:
+        warnings.append('late_bells')
+    if summary['bells_skipped']:
+        warnings.append('skipped_bells')
+    if sync_age is None or sync_age > FLEET_SYNC_AGE_WARN_SECONDS:
+        warnings.append('stale_sync')
+    if not summary['leader']:
+        warnings.append('no_playback_process')
+    summary['warnings'] = warnings
+    return summary
+
+@app.route('/api/metrics', methods=['GET'])
+def api_metrics():
+    """מדדי השרת בפורמט Prometheus. עם ?fleet=1 מצורפים גם מדדי הרסיברים, בשמות ringer_fleet_* ועם התווית receiver."""
+    fleet = request.args.get('fleet') in ('1', 'true')
+    body = metrics.render()
+    if fleet:
+        body += render_fleet({url: (scrape['samples'], scrape['families']) for url, scrape in scrape_fleet().items()})
+    return Response(body, content_type=METRICS_CONTENT_TYPE)
+
+@app.route('/api/distribution', methods=['GET'])
+def api_distribution():
+    """עץ ההפצה הנוכחי: לכל רסיבר, המקורות שמהם הוא מוריד קבצים (השרת תמיד אחרון)."""
+    return jsonify({'fanout': P2P_FANOUT, 'enabled': P2P_FANOUT > 0,
+                    'tree': current_distribution_tree() if P2P_FANOUT else {}}), 200
+
+@app.route('/api/fleet', methods=['GET'])
+def api_fleet():
+    """סיכום לכל רסיבר (איחור צלצולים, הפרשי שעון, זמני ניגון ופאניק, גיל הסנכרון)."""
+    max_age = 0 if request.args.get('refresh') in ('1', 'true') else FLEET_CACHE_SECONDS
+    scrapes = scrape_fleet(max_age)
+    receivers = {url: summarize_receiver(scrape) for url, scrape in scrapes.items()}
+    return jsonify({
+        'receivers': receivers,
+        'up': sum(1 for r in receivers.values() if r['up']),
+        'total': len(receivers),
+        'warnings': sum(1 for r in receivers.values() if r['warnings']),
+    }), 200
 
 @app.route('/api/songs', methods=['POST'])
 def api_save_song():
     try:
-        metadata_str = request.form.get('metadata')
-        if not metadata_str: return jsonify({'error': 'Missing song metadata'}), 400
-        metadata = json.loads(metadata_str)
-        file = request.files.get('file')
+        if (request.content_length or 0) > MAX_SONG_BYTES + MULTIPART_OVERHEAD_BYTES:
+            # נדחה לפני שהגוף נקרא
+            return jsonify({'error': f'File too large (limit {MAX_SONG_BYTES} bytes)'}), 413
+        # JSON: הקובץ כבר הועלה בחלקים (uploadId); טופס: העלאה ישנה ב-multipart
+        if request.is_json:
+            metadata = request.get_json(silent=True) or {}
+            file = None
+        else:
+            metadata_str = request.form.get('metadata')
+            if not metadata_str: return jsonify({'error': 'Missing song metadata'}), 400
+            metadata = json.loads(metadata_str)
+            file = request.files.get('file')
+        upload_id = metadata.pop('uploadId', None)
         is_edit_mode = 'id' in metadata
         existing_song = get_item_by_id(SONGS_FOLDER, metadata['id']) if is_edit_mode else None
 
-        if file and file.filename and file.filename != 'no_change.txt':
-            if is_edit_mode and existing_song and existing_song.get('filename'):
-                 old_file_path = os.path.join(SONGS_FOLDER, existing_song['filename'])
-                 if os.path.exists(old_file_path): os.remove(old_file_path)
-                     
-            unique_filename = upload_and_save_file(file, SONGS_FOLDER, file.filename)
-            metadata['filename'] = unique_filename
-            metadata['url'] = f'/api/song_file/{unique_filename}'
+        # קובץ קודם שהוחלף לא נמחק כאן: הוא עשוי להיות משותף, ו-media_gc אוסף אותו כשאין אליו הפניה
+        if upload_id:
+            upload = upload_store.consume(upload_id, 'song')
+            metadata['filename'] = upload['filename']
+            metadata['url'] = f"/api/song_file/{upload['filename']}"
+            metadata['contentHash'] = upload['contentHash']
+        elif file and file.filename and file.filename != 'no_change.txt':
+            check_multipart_upload(file, MAX_SONG_BYTES)
+            song_filename, content_hash = save_song_file(file, file.filename)
+            metadata['filename'] = song_filename
+            metadata['url'] = f'/api/song_file/{song_filename}'
+            metadata['contentHash'] = content_hash
         elif is_edit_mode and existing_song:
             metadata['filename'] = existing_song.get('filename')
             metadata['url'] = existing_song.get('url')
+            metadata['contentHash'] = existing_song.get('contentHash')
         elif not is_edit_mode and not file:
              return jsonify({'error': 'New song requires a file'}), 400
 
+        # גרסת ניגון מנורמלת וחתוכה לפי clipStart/clipEnd: נשמרת אם עדיין מתאימה,
+        # ואחרת המוביל מפיק חדשה ברקע (ראה run_rendition_worker)
+        if existing_song:
+            for field in RENDITION_FIELDS:
+                if field in existing_song:
+                    metadata.setdefault(field, existing_song[field])
+        clear_stale_rendition(metadata)
+
         song_data = save_json_file(SONGS_FOLDER, metadata, metadata.get('id'))
+        _rendition_wakeup.set()
         
         # 🔔 שליחת התראת Webhook על עדכון שירים
         notify_receivers('songs_update', {'songId': song_data['id']}) 
         
         return jsonify(song_data), 200
-        
+
+    except UploadError as e:
+        return jsonify({'error': e.message}), e.status
     except Exception as e:
         logging.error(f"שגיאה בשמירת שיר: {e}")
         return jsonify({'error': f'Server error: {str(e)}'}), 500
@@ -150,12 +761,14 @@ def api_save_song():
 def api_delete_song(song_id):
     song_to_delete = get_item_by_id(SONGS_FOLDER, song_id)
     if song_to_delete:
+        orphaned = get_catalog(EVENTS_FOLDER).find(songId=song_id)
+        if orphaned:
+            logging.warning(f"{len(orphaned)} אירועים מפנים לשיר שנמחק ({song_id}) ולא יצלצלו: "
+                            f"{', '.join(e.get('name', str(e.get('id'))) for e in orphaned)}")
         delete_json_file(SONGS_FOLDER, song_id)
-        audio_filename = song_to_delete.get('filename')
-        if audio_filename:
-            audio_filepath = os.path.join(SONGS_FOLDER, audio_filename)
-            if os.path.exists(audio_filepath): os.remove(audio_filepath)
-            
+        # הקבצים עשויים להיות משותפים לשירים אחרים; media_gc מוחק אותם כשאין אליהם הפניה
+        media_gc.wake()
+
         # 🔔 שליחת התראת Webhook על מחיקת שיר
         notify_receivers('songs_update', {'deletedSongId': song_id})
         
@@ -164,41 +777,307 @@ def api_delete_song(song_id):
     
 @app.route('/api/song_file/<filename>', methods=['GET'])
 def api_get_song_file(filename):
-    """מאפשר לרסיברים למשוך קבצי אודיו (שירים או קריאות פאניק)."""
-    # בדיקה בתיקיית השירים ובתיקיית הפאניק
-    filepath = os.path.join(SONGS_FOLDER, filename)
-    if os.path.exists(filepath): return send_file(filepath)
-    
-    filepath = os.path.join(PANIC_FOLDER, filename)
-    if os.path.exists(filepath): return send_file(filepath)
-    
-    return jsonify({'error': 'File not found'}), 404
+    """
+    מאפשר לרסיברים למשוך קבצי אודיו (שירים או קריאות פאניק).
+    תומך ב-Range, ב-ETag חזק לפי תוכן וב-If-None-Match; קבצים בשם לפי hash
+    או uuid לא משתנים לעולם ולכן נשמרים במטמון הלקוח לזמן ארוך.
+    """
+    filepath = find_media_file(filename)
+    if not filepath:
+        return jsonify({'error': 'File not found'}), 404
+
+    # נתיב מוחלט: send_file מפרש נתיב יחסי לפי תיקיית הקוד, וה-storage יחסי לתיקיית העבודה
+    response = send_file(os.path.abspath(filepath), conditional=True, etag=media_etag(filepath), max_age=0)
+    if is_generated_filename(filename):
+        response.headers['Cache-Control'] = f'public, max-age={MEDIA_MAX_AGE_SECONDS}, immutable'
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def broadcast_panic_file(filename, content_hash, created_at=None):
+    # 🚨 שליחת התראת Webhook מיידית - הרסיברים ימשכו (מהשרת או משכן) וינגנו את הקובץ
+    notify_receivers('panic_alert', {'filename': filename, 'contentHash': content_hash,
+                                     'createdAt': created_at or time.time()})
 
 @app.route('/api/panic', methods=['POST'])
 def api_handle_panic():
     try:
+        if (request.content_length or 0) > MAX_PANIC_BYTES + MULTIPART_OVERHEAD_BYTES:
+            return jsonify({'error': f'File too large (limit {MAX_PANIC_BYTES} bytes)'}), 413
         file = request.files.get('file')
         if not file or not file.filename: return jsonify({'error': 'No audio file provided'}), 400
-        
+        check_multipart_upload(file, MAX_PANIC_BYTES)
+
         unique_filename = upload_and_save_file(file, PANIC_FOLDER, file.filename)
-        
-        # 🚨 שליחת התראת Webhook מיידית - הרסיברים ימשכו וינגנו את הקובץ
-        notify_receivers('panic_alert', {'filename': unique_filename})
-        
+        broadcast_panic_file(unique_filename, file_sha256(os.path.join(PANIC_FOLDER, unique_filename)))
+
         return jsonify({
             'message': 'Panic recording saved and broadcasted',
             'filename': unique_filename
         }), 200
 
+    except UploadError as e:
+        return jsonify({'error': e.message}), e.status
     except Exception as e:
         logging.error(f"שגיאה בטיפול בקריאת פאניקה: {e}")
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
+# --- העלאות בחלקים שאפשר לחדש (ראה uploads.py) ---
+# הדפדפן פותח העלאה, שולח חלקים לפי ההיסט ש-HEAD מחזיר, וממשיך מאותו
+# מקום אחרי ניתוק. שיר שהועלה כך נשמר ב-/api/songs עם uploadId; הקלטת
+# פאניק משודרת לרסיברים ברגע שהחלק האחרון הגיע.
+UPLOADS_STATE_FOLDER = os.path.join(app.config['UPLOAD_FOLDER'], 'uploads')
+upload_store = UploadStore(UPLOADS_STATE_FOLDER, {
+    'song': (SONGS_FOLDER, MAX_SONG_BYTES),
+    'panic': (PANIC_FOLDER, MAX_PANIC_BYTES),
+}, content_kinds=('song',))
+
+def upload_response(state, status_code=200):
+    status = upload_store.status(state)
+    response = jsonify(status)
+    response.status_code = status_code
+    response.headers['Upload-Offset'] = str(status['offset'])
+    response.headers['Upload-Length'] = str(state['size'])
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/api/uploads', methods=['POST'])
+def api_create_upload():
+    """פותח העלאה: {"kind": "song"|"panic", "filename", "size"}. גודל וסוג נבדקים כאן."""
+    data = request.get_json(silent=True) or {}
+    try:
+        state = upload_store.create(data.get('kind'), data.get('filename'), data.get('size'))
+    except UploadError as e:
+        return jsonify({'error': e.message}), e.status
+    response = upload_response(state, 201)
+    response.headers['Location'] = f"/api/uploads/{state['id']}"
+    return response
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def api_get_upload(upload_id):
+    """מצב ההעלאה (גם ב-HEAD): Upload-Offset הוא הבית הבא שהשרת מצפה לו."""
+    try:
+        return upload_response(upload_store.get(upload_id))
+    except UploadError as e:
+        return jsonify({'error': e.message}), e.status
+
+@app.route('/api/uploads/<upload_id>', methods=['PATCH'])
+def api_append_upload(upload_id):
+    """כותב חלק בהיסט Upload-Offset ישר לקובץ היעד; החלק האחרון מסיים את ההעלאה."""
+    offset = request.headers.get('Upload-Offset', type=int)
+    if offset is None:
+        return jsonify({'error': 'Upload-Offset header is required'}), 400
+    try:
+        state = upload_store.append(upload_id, offset, request.stream, request.content_length)
+        if state.get('complete'):
+            register_media_file(upload_store.targets[state['kind']][0], state['filename'])
+            if state['kind'] == 'panic':
+                upload_store.consume(upload_id, 'panic')
+                broadcast_panic_file(state['filename'], state['contentHash'], state['completedAt'])
+                logging.warning(f"קריאת פאניק הועלתה בחלקים ושודרה: {state['filename']}")
+    except UploadError as e:
+        return jsonify({'error': e.message}), e.status
+    return upload_response(state)
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def api_cancel_upload(upload_id):
+    try:
+        upload_store.cancel(upload_id)
+    except UploadError as e:
+        return jsonify({'error': e.message}), e.status
+    return jsonify({'message': 'Upload cancelled'}), 200
+
+# --- איסוף קבצי שירים שאין אליהם הפניה (ראה content_store.py) ---
+# רץ בתהליך המוביל בלבד. שמור: כל קובץ שרשומת שיר (גם בהסגר) מפנה אליו, והעלאות שהושלמו ועוד לא שויכו.
+def referenced_song_files():
+    get_catalog(SONGS_FOLDER).refresh()
+    return (set(reference_counts(list_json_files(SONGS_FOLDER)))
+            | quarantined_references(os.path.join(SONGS_FOLDER, QUARANTINE_FOLDER))
+            | upload_store.pending_files('song'))
+
+def forget_collected_files(removed, freed):
+    with _media_lock:
+        for filename in removed:
+            _media_index.pop(filename, None)
+            _media_hashes.pop(os.path.join(SONGS_FOLDER, filename), None)
+    MEDIA_GC_REMOVED.inc(len(removed))
+    MEDIA_GC_FREED.inc(freed)
+
+media_gc = GarbageCollector(SONGS_FOLDER, referenced_song_files, on_collect=forget_collected_files)
+
+# --- שידור פאניק חי ---
+# הדפדפן שולח את ההקלטה בחלקים תוך כדי הקלטה, והרסיברים מושכים אותה
+# כזרם (chunked) ומנגנים תוך כדי הגעה. הקובץ נכתב ל-<id>.webm.live.part
+# ומקבל את שמו הסופי בסיום, כך שגם תהליך אחר יודע מתי הזרם הסתיים.
+# זרם מוגבל ל-MAX_PANIC_BYTES כמו הקלטה רגילה, מספר הזרמים הפתוחים מוגבל,
+# וזרם שהדפדפן לא סגר נסגר אצל המוביל אחרי PANIC_STREAM_IDLE_TIMEOUT
+# (sweep_panic_streams): מה שהוקלט נשמר כקריאת פאניק, וזרם ריק נמחק.
+PANIC_STREAM_IDLE_TIMEOUT = 30   # זרם שלא גדל זמן כזה נחשב נטוש
+PANIC_STREAM_POLL_SECONDS = 0.05
+PANIC_STREAM_SUFFIX = '.live.part'
+MAX_OPEN_PANIC_STREAMS = 4
+_panic_stream_activity = threading.Condition()
+
+def panic_stream_paths(stream_id):
+    """(נתיב זמני בזמן השידור, נתיב סופי) של זרם פאניק."""
+    final_path = os.path.join(PANIC_FOLDER, f"{stream_id}.webm")
+    return final_path + PANIC_STREAM_SUFFIX, final_path
+
+def open_panic_streams():
+    """הנתיבים הזמניים של הזרמים הפתוחים (בכל ה-workers, לפי הדיסק)."""
+    return [entry.path for entry in os.scandir(PANIC_FOLDER) if entry.name.endswith(PANIC_STREAM_SUFFIX)]
+
+def finish_panic_stream(part_path):
+    """נותן לזרם את שמו הסופי (תחת הנעילה של כתיבת החלקים). מחזיר את הנתיב הסופי."""
+    final_path = part_path[:-len(PANIC_STREAM_SUFFIX)]
+    with open(part_path, 'r+b') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        os.replace(part_path, final_path)
+    register_media_file(PANIC_FOLDER, os.path.basename(final_path))
+    with _panic_stream_activity:
+        _panic_stream_activity.notify_all()
+    return final_path
+
+def sweep_panic_streams():
+    """סוגר זרמים שלא גדלו PANIC_STREAM_IDLE_TIMEOUT: הקלטה חלקית נשמרת, זרם ריק נמחק."""
+    now = time.time()
+    for part_path in open_panic_streams():
+        try:
+            st = os.stat(part_path)
+            if now - st.st_mtime <= PANIC_STREAM_IDLE_TIMEOUT:
+                continue
+            if st.st_size:
+                finish_panic_stream(part_path)
+                logging.warning(f"שידור פאניק נטוש נסגר ונשמר: {os.path.basename(part_path)} ({st.st_size} בתים)")
+            else:
+                os.remove(part_path)
+                logging.info(f"שידור פאניק ריק ונטוש נמחק: {os.path.basename(part_path)}")
+        except FileNotFoundError:
+            continue   # נסגר בינתיים
+
+def run_panic_stream_sweeper():
+    while True:
+        time.sleep(PANIC_STREAM_IDLE_TIMEOUT)
+        try:
+            sweep_panic_streams()
+        except Exception as e:
+            logging.error(f"שגיאה בסגירת שידורי פאניק נטושים: {e}")
+
+def valid_stream_id(stream_id):
+    return UUID_FILENAME_RE.match(f"{stream_id}.webm") is not None
+
+@app.route('/api/panic/stream', methods=['POST'])
+def api_start_panic_stream():
+    """פותח שידור חי ומודיע מיד לרסיברים להתחיל למשוך אותו."""
+    sweep_panic_streams()
+    if len(open_panic_streams()) >= MAX_OPEN_PANIC_STREAMS:
+        return jsonify({'error': 'Too many open panic streams'}), 429
+    stream_id = str(uuid.uuid4())
+    part_path, _ = panic_stream_paths(stream_id)
+    open(part_path, 'wb').close()
+
+    url = f'/api/panic/stream/{stream_id}'
+    # 🚨 הרסיברים מתחילים למשוך ולנגן עוד לפני שההקלטה הסתיימה
+    notify_receivers('panic_stream', {'streamId': stream_id, 'url': url, 'createdAt': time.time()})
+    logging.warning(f"שידור פאניק חי נפתח: {stream_id}")
+    return jsonify({'streamId': stream_id, 'url': url}), 201
+
+@app.route('/api/panic/stream/<stream_id>/chunk', methods=['POST'])
+def api_append_panic_stream(stream_id):
+    """
+    מוסיף חלק להקלטה. offset הוא מיקום החלק בקובץ: שליחה חוזרת של חלק
+    שכבר נכתב מתקבלת בשקט, וחלק שמגיע לפני קודמו נדחה עם 409.
+    """
+    if not valid_stream_id(stream_id):
+        return jsonify({'error': 'Invalid stream id'}), 400
+    part_path, _ = panic_stream_paths(stream_id)
+    offset = request.args.get('offset', type=int)
+    if offset is None:
+        return jsonify({'error': 'Missing offset'}), 400
+    if offset + (request.content_length or 0) > MAX_PANIC_BYTES:
+        return jsonify({'error': f'Stream too large (limit {MAX_PANIC_BYTES} bytes)'}), 413
+    data = request.get_data()
+    if offset + len(data) > MAX_PANIC_BYTES:
+        return jsonify({'error': f'Stream too large (limit {MAX_PANIC_BYTES} bytes)'}), 413
+
+    try:
+        with open(part_path, 'r+b') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            size = os.fstat(f.fileno()).st_size
+            if offset + len(data) <= size:
+                return jsonify({'size': size, 'duplicate': True}), 200
+            if offset != size:
+                return jsonify({'error': 'Out of order chunk', 'expectedOffset': size}), 409
+            f.seek(size)
+            f.write(data)
+            size += len(data)
+    except FileNotFoundError:
+        return jsonify({'error': 'Stream not found or already ended'}), 404
+
+    with _panic_stream_activity:
+        _panic_stream_activity.notify_all()
+    return jsonify({'size': size}), 200
+
+@app.route('/api/panic/stream/<stream_id>/end', methods=['POST'])
+def api_end_panic_stream(stream_id):
+    """סוגר את השידור: הקובץ מקבל את שמו הסופי ונשמר כמו קריאת פאניק רגילה."""
+    if not valid_stream_id(stream_id):
+        return jsonify({'error': 'Invalid stream id'}), 400
+    part_path, _ = panic_stream_paths(stream_id)
+    try:
+        final_path = finish_panic_stream(part_path)
+    except FileNotFoundError:
+        return jsonify({'error': 'Stream not found or already ended'}), 404
+    logging.info(f"שידור פאניק חי הסתיים: {stream_id} ({os.path.getsize(final_path)} בתים)")
+    return jsonify({'message': 'Stream ended', 'filename': os.path.basename(final_path)}), 200
+
+@app.route('/api/panic/stream/<stream_id>', methods=['GET'])
+def api_get_panic_stream(stream_id):
+    """מזרים את ההקלטה מתחילתה, וממשיך להזרים חלקים חדשים עד סיום השידור."""
+    if not valid_stream_id(stream_id):
+        return jsonify({'error': 'Invalid stream id'}), 400
+    part_path, final_path = panic_stream_paths(stream_id)
+    path = part_path if os.path.exists(part_path) else final_path
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return jsonify({'error': 'Stream not found'}), 404
+
+    def generate():
+        with f:
+            last_data = time.monotonic()
+            while True:
+                chunk = f.read(64 * 1024)
+                if chunk:
+                    last_data = time.monotonic()
+                    yield chunk
+                    continue
+                if not os.path.exists(part_path):
+                    # השידור הסתיים (הקובץ שונה שם) - שולחים את מה שנשאר ומסיימים
+                    rest = f.read()
+                    if rest:
+                        yield rest
+                    return
+                if time.monotonic() - last_data > PANIC_STREAM_IDLE_TIMEOUT:
+                    logging.warning(f"שידור פאניק {stream_id} נקטע: לא התקבלו נתונים.")
+                    return
+                with _panic_stream_activity:
+                    _panic_stream_activity.wait(PANIC_STREAM_POLL_SECONDS)
+
+    response = streaming_response(_panic_pull_slots, generate(), mimetype='audio/webm', headers={
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no',
+    })
+    if response.status_code == 503:
+        f.close()
+    return response
+
 @app.route('/api/event', methods=['POST'])
 def api_create_event():
     data = request.json
-    if not data.get('name') or not data.get('time') or not data.get('songId'):
-        return jsonify({'error': 'Missing required fields'}), 400
+    error = validate_event(data)
+    if error:
+        return jsonify({'error': error}), 400
     event = save_json_file(EVENTS_FOLDER, data)
     
     # 🔔 שליחת התראת Webhook על עדכון אירועים
@@ -209,8 +1088,9 @@ def api_create_event():
 @app.route('/api/event/<event_id>', methods=['PUT'])
 def api_update_event(event_id):
     data = request.json
-    if not data.get('name') or not data.get('time') or not data.get('songId'):
-        return jsonify({'error': 'Missing required fields'}), 400
+    error = validate_event(data)
+    if error:
+        return jsonify({'error': error}), 400
         
     data['id'] = event_id
     event = save_json_file(EVENTS_FOLDER, data, event_id)
@@ -230,11 +1110,242 @@ def api_delete_event(event_id):
         return jsonify({'message': 'Event deleted'}), 200
     return jsonify({'error': 'Event not found'}), 404
 
+# --- לוח שנה (פרופיל פעיל לפי תאריך: חגים, ימי מבחנים, שישי קצר) ---
+# שינוי בלוח השנה משנה את לוח הצלצולים, ולכן נשלח כ-events_update (מתמזג בתור)
+@app.route('/api/calendar', methods=['GET'])
+def api_list_calendar():
+    return jsonify(list_json_files(CALENDAR_FOLDER)), 200
+
+@app.route('/api/calendar', methods=['POST'])
+def api_create_calendar_entry():
+    data = request.json
+    error = validate_calendar_entry(data)
+    if error:
+        return jsonify({'error': error}), 400
+    entry = save_json_file(CALENDAR_FOLDER, data)
+    notify_receivers('events_update', {'calendarId': entry['id']})
+    return jsonify(entry), 201
+
+@app.route('/api/calendar/<entry_id>', methods=['PUT'])
+def api_update_calendar_entry(entry_id):
+    data = request.json
+    error = validate_calendar_entry(data)
+    if error:
+        return jsonify({'error': error}), 400
+    data['id'] = entry_id
+    entry = save_json_file(CALENDAR_FOLDER, data, entry_id)
+    notify_receivers('events_update', {'calendarId': entry['id']})
+    return jsonify(entry), 200
+
+@app.route('/api/calendar/<entry_id>', methods=['DELETE'])
+def api_delete_calendar_entry(entry_id):
+    if delete_json_file(CALENDAR_FOLDER, entry_id):
+        notify_receivers('events_update', {'deletedCalendarId': entry_id})
+        return jsonify({'message': 'Calendar entry deleted'}), 200
+    return jsonify({'error': 'Calendar entry not found'}), 404
+
+# --- ייבוא/ייצוא בכמות ---
+# לוח זמנים שלם (JSON lines) או ספריית שירים (zip עם songs.jsonl ותיקיית audio/)
+# בבקשה אחת: הכל נבדק לפני הכתיבה, נשמר כאצווה אחת (rev אחד ביומן השינויים),
+# ונשלחת התראה אחת.
+EXPORT_SONGS_MANIFEST = 'songs.jsonl'
+EXPORT_AUDIO_PREFIX = 'audio/'
+# גודל מקסימלי לארכיון ייבוא השירים, גם בהעלאה וגם אחרי פריסה (מול zip bomb)
+MAX_IMPORT_BYTES = int(os.environ.get('RINGER_MAX_IMPORT_MB', '1024')) * 1024 * 1024
+
+def parse_records(body):
+    """רשומות מגוף הבקשה: מערך JSON או JSON lines. מחזיר (רשומות, שגיאות)."""
+    text = body.decode('utf-8-sig').strip()
+    if text.startswith('['):
+        try:
+            records = json.loads(text)
+        except ValueError as e:
+            return [], [{'line': None, 'error': f'Invalid JSON: {e}'}]
+        if not all(isinstance(record, dict) for record in records):
+            return [], [{'line': None, 'error': 'Every record must be an object'}]
+        return records, []
+
+    records, errors = [], []
+    for number, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            errors.append({'line': number, 'error': f'Invalid JSON: {e}'})
+            continue
+        if not isinstance(record, dict):
+            errors.append({'line': number, 'error': 'Record must be an object'})
+            continue
+        records.append(record)
+    return records, errors
+
+def jsonl_response(items, filename):
+    body = ''.join(json.dumps(item, ensure_ascii=False) + '\n' for item in items)
+    response = Response(body, mimetype='application/x-ndjson')
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
+
+@app.route('/api/export/events', methods=['GET'])
+def api_export_events():
+    """כל האירועים כ-JSON lines (שורה לכל אירוע)."""
+    return jsonl_response(list_json_files(EVENTS_FOLDER), 'events.jsonl')
+
+@app.route('/api/import/events', methods=['POST'])
+def api_import_events():
+    """
+    ייבוא לוח זמנים שלם. ?mode=merge (ברירת מחדל) מוסיף/מעדכן לפי id;
+    ?mode=replace גם מוחק אירועים שלא מופיעים בקובץ. אם אירוע אחד לא תקין
+    שום דבר לא נשמר, והתשובה מפרטת את כל השגיאות. הכתיבות והמחיקות מוחלות
+    כאצווה אחת ונרשמות ביומן השינויים ב-rev אחד. ייבוא ריק ב-replace (שמוחק
+    את כל האירועים) דורש ?confirm=1.
+    """
+    mode = request.args.get('mode', 'merge')
+    if mode not in ('merge', 'replace'):
+        return jsonify({'error': 'mode must be merge or replace'}), 400
+    records, errors = parse_records(request.get_data())
+    for number, record in enumerate(records, start=1):
+        error = validate_event(record)
+        if error:
+            errors.append({'line': number, 'id': record.get('id'), 'error': error})
+    if errors:
+        return jsonify({'error': 'Validation failed', 'details': errors}), 400
+    if mode == 'replace' and not records and request.args.get('confirm') != '1':
+        return jsonify({'error': 'Empty import in replace mode would delete every event; pass confirm=1'}), 400
+
+    for record in records:
+        record['id'] = str(record.get('id') or uuid.uuid4())
+    imported_ids = {record['id'] for record in records}
+    removed = []
+    if mode == 'replace':
+        removed = [e['id'] for e in list_json_files(EVENTS_FOLDER) if str(e['id']) not in imported_ids]
+    with changelog.batch():
+        apply_json_files(EVENTS_FOLDER, records, removed)
+
+    notify_receivers('events_update', {'bulk': True, 'imported': len(records), 'deleted': len(removed)})
+    logging.info(f"ייבוא אירועים: {len(records)} נשמרו, {len(removed)} נמחקו.")
+    return jsonify({'imported': len(records), 'deleted': len(removed), 'rev': changelog.rev}), 200
+
+@app.route('/api/export/songs', methods=['GET'])
+def api_export_songs():
+    """ספריית השירים כ-zip: songs.jsonl ותיקיית audio/ עם הקבצים המקוריים."""
+    archive = tempfile.TemporaryFile()
+    with zipfile.ZipFile(archive, 'w', compression=zipfile.ZIP_STORED) as zf:
+        songs = list_json_files(SONGS_FOLDER)
+        exported = set()
+        for song in songs:
+            file_path = os.path.join(SONGS_FOLDER, song.get('filename') or '')
+            if song.get('filename') and song['filename'] not in exported and os.path.exists(file_path):
+                # קובץ משותף לכמה שירים נכתב לארכיון פעם אחת
+                zf.write(file_path, EXPORT_AUDIO_PREFIX + song['filename'])
+                exported.add(song['filename'])
+        zf.writestr(EXPORT_SONGS_MANIFEST,
+                    ''.join(json.dumps(song, ensure_ascii=False) + '\n' for song in songs))
+    archive.seek(0)
+    return send_file(archive, mimetype='application/zip', as_attachment=True, download_name='songs.zip')
+
+@app.route('/api/import/songs', methods=['POST'])
+def api_import_songs():
+    """
+    ייבוא ספריית שירים מ-zip בפורמט של /api/export/songs. שירים נשמרים לפי id
+    (כך שאירועים שמפנים אליהם ממשיכים לעבוד); גרסאות הניגון מופקות ברקע.
+    הארכיון מוגבל ל-MAX_IMPORT_BYTES וכל קובץ אודיו ל-MAX_SONG_BYTES.
+    """
+    if (request.content_length or 0) > MAX_IMPORT_BYTES + MULTIPART_OVERHEAD_BYTES:
+        return jsonify({'error': f'Archive too large (limit {MAX_IMPORT_BYTES} bytes)'}), 413
+    file = request.files.get('file')
+    if not file:
+        return jsonify({'error': 'Missing zip file'}), 400
+    try:
+        zf = zipfile.ZipFile(file.stream)
+    except zipfile.BadZipFile:
+        return jsonify({'error': 'File is not a zip archive'}), 400
+
+    with zf:
+        sizes = {info.filename: info.file_size for info in zf.infolist()}
+        names = set(sizes)
+        if sum(sizes.values()) > MAX_IMPORT_BYTES:
+            return jsonify({'error': f'Archive too large (limit {MAX_IMPORT_BYTES} bytes)'}), 413
+        if EXPORT_SONGS_MANIFEST not in names:
+            return jsonify({'error': f'Missing {EXPORT_SONGS_MANIFEST} in archive'}), 400
+        records, errors = parse_records(zf.read(EXPORT_SONGS_MANIFEST))
+        for number, record in enumerate(records, start=1):
+            if not record.get('name'):
+                errors.append({'line': number, 'id': record.get('id'), 'error': 'Missing name'})
+            elif EXPORT_AUDIO_PREFIX + str(record.get('filename')) not in names:
+                errors.append({'line': number, 'id': record.get('id'), 'error': f"Missing audio file: {record.get('filename')}"})
+            elif sizes[EXPORT_AUDIO_PREFIX + str(record.get('filename'))] > MAX_SONG_BYTES:
+                errors.append({'line': number, 'id': record.get('id'),
+                               'error': f"Audio file too large (limit {MAX_SONG_BYTES} bytes): {record.get('filename')}"})
+        if errors:
+            return jsonify({'error': 'Validation failed', 'details': errors}), 400
+
+        # קבצי האודיו נשמרים לפי תוכן (קובץ שכבר קיים לא נכתב שוב); הרשומות נשמרות רק
+        # אחרי שכולם נשמרו. קבצים שנכתבו לפני כשל, והקבצים שהוחלפו, נאספים ב-media_gc.
+        stored = {}   # שם בארכיון -> (שם קובץ, sha256)
+        for record in records:
+            if record['filename'] not in stored:
+                extension = os.path.splitext(secure_filename(record['filename']))[1] or '.mp3'
+                tmp_path = temp_path(SONGS_FOLDER, extension)
+                try:
+                    with zf.open(EXPORT_AUDIO_PREFIX + record['filename']) as src, open(tmp_path, 'wb') as dst:
+                        for chunk in iter(lambda: src.read(64 * 1024), b''):
+                            dst.write(chunk)
+                    content_hash = file_sha256(tmp_path)
+                    stored[record['filename']] = (store_file(tmp_path, SONGS_FOLDER, extension, content_hash)[0],
+                                                  content_hash)
+                finally:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+            song_filename, content_hash = stored[record['filename']]
+
+            record['id'] = str(record.get('id') or uuid.uuid4())
+            for field in RENDITION_FIELDS:
+                record.pop(field, None)
+            record['filename'] = song_filename
+            record['url'] = f'/api/song_file/{song_filename}'
+            record['contentHash'] = content_hash
+
+    for song_filename, _ in stored.values():
+        register_media_file(SONGS_FOLDER, song_filename)
+    with changelog.batch():
+        apply_json_files(SONGS_FOLDER, records, [])
+
+    notify_receivers('songs_update', {'bulk': True, 'imported': len(records)})
+    _rendition_wakeup.set()
+    logging.info(f"ייבוא שירים: {len(records)} נשמרו.")
+    return jsonify({'imported': len(records), 'rev': changelog.rev}), 200
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
 
+# --- הפעלה ---
+# שליחת ה-Webhooks והפקת גרסאות הניגון רצות בתהליך אחד בלבד, גם תחת gunicorn
+# עם כמה workers: התהליך שמחזיק ב-storage/leader.lock מפעיל אותן (ראה leader.py).
+# שאר ה-workers רק רושמים הודעות ליומן המשותף, והמוביל שולח אותן.
+leader = LeaderLock(os.path.join(app.config['UPLOAD_FOLDER'], 'leader.lock'))
+
+def start_leader_services():
+    try:
+        backfill_song_hashes()
+    except Exception as e:
+        logging.error(f"שגיאה בהשלמת contentHash לשירים: {e}")
+    webhook_outbox.start()
+    threading.Thread(target=run_rendition_worker, name='song-renditions', daemon=True).start()
+    media_gc.start()
+    threading.Thread(target=run_panic_stream_sweeper, name='panic-stream-sweeper', daemon=True).start()
+
+def create_app():
+    """נקודת הכניסה ל-gunicorn: gunicorn -c gunicorn.conf.py 'app:create_app()'"""
+    leader.start(start_leader_services)
+    return app
+
+
 if __name__ == '__main__':
     port = int(os.environ.get("PORT", 8000))
-   socketio.run(host='0.0.0.0', port=port, debug=True, use_reloader=True)
+    # עם ה-reloader השירותים עולים רק בתהליך שמריץ את האפליקציה, לא בתהליך המשגיח
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        create_app()
+    app.run(host='0.0.0.0', port=port, debug=True, use_reloader=True)
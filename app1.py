@@ -1,14 +1,30 @@
-from flask import Flask, jsonify, request, render_template, send_file
+from flask import Flask, Response, jsonify, request, render_template, send_file
 import os
 import json
 import logging
 from werkzeug.utils import secure_filename
 import uuid
 from datetime import datetime
+import bisect
 import threading
 import time
 import subprocess # לביצוע ניגון קבצים (mpg123)
-import schedule   # לניהול לוח הזמנים
+import queue
+import re
+import requests   # למשיכת עדכונים וקבצים מהשרת
+
+from catalog import QUARANTINE_FOLDER, get_catalog
+from audio_cache import FETCH_WAIT_SECONDS, AudioCache, download, file_sha256
+from content_store import (GarbageCollector, content_filename, quarantined_references, reference_counts,
+                           store_file, temp_path)
+from distribution import DISTRIBUTED_TYPES, PEER_TIMEOUT
+from player import PlaybackEngine
+from bell_schedule import SCHEDULE_DAYS, compile_schedule, localize_schedule, schedule_until, validate_event_rule
+from leader import LeaderLock
+from metrics import METRICS_CONTENT_TYPE, Registry
+from uploads import (MAX_PANIC_BYTES, MAX_SONG_BYTES, SNIFF_BYTES, UploadError, UploadStore,
+                     check_audio_file)
+from renditions import RENDITION_FIELDS, rendition_key, update_song_rendition, warm_file
 
 # --- הגדרות ---
 app = Flask(__name__, template_folder='templates', static_folder='static')
@@ -18,6 +34,20 @@ app.config['UPLOAD_FOLDER'] = 'storage'
 EVENTS_FOLDER = os.path.join(app.config['UPLOAD_FOLDER'], 'events')
 SONGS_FOLDER = os.path.join(app.config['UPLOAD_FOLDER'], 'songs')
 PANIC_FOLDER = os.path.join(app.config['UPLOAD_FOLDER'], 'panic')
+CALENDAR_FOLDER = os.path.join(app.config['UPLOAD_FOLDER'], 'calendar')
+
+# --- הגדרות סנכרון מול השרת ---
+# **חובה לעדכן:** כתובת השרת המרכזי (app.py) ברשת שלך
+SERVER_URL = os.environ.get('RINGER_SERVER_URL', 'http://192.168.1.100:8000')
+# קובץ מעקב: ה-rev האחרון של יומן השינויים בשרת שהרסיבר כבר החיל
+SYNC_STATE_FILE = os.path.join(app.config['UPLOAD_FOLDER'], 'sync_state.json')
+# סנכרון גיבוי גם בלי Webhook (למשל אם הודעה אבדה)
+SYNC_INTERVAL_SECONDS = 300
+# לוח הצלצולים המקומפל האחרון שהתקבל מהשרת (ראה bell_schedule.py)
+SCHEDULE_FILE = os.path.join(app.config['UPLOAD_FOLDER'], 'schedule.json')
+
+# מטמון האודיו המקומי (קבצים לפי sha256 של התוכן)
+AUDIO_CACHE_FOLDER = os.path.join(app.config['UPLOAD_FOLDER'], 'cache')
 
 # קובץ מעקב: מאחסן את קובצי הפאניק שכבר נוגנו
 PLAYED_PANIC_FILE = os.path.join(app.config['UPLOAD_FOLDER'], 'played_panic.txt')
@@ -25,6 +55,9 @@ PLAYED_PANIC_FILE = os.path.join(app.config['UPLOAD_FOLDER'], 'played_panic.txt'
 os.makedirs(EVENTS_FOLDER, exist_ok=True)
 os.makedirs(SONGS_FOLDER, exist_ok=True)
 os.makedirs(PANIC_FOLDER, exist_ok=True)
+os.makedirs(CALENDAR_FOLDER, exist_ok=True)
+
+audio_cache = AudioCache(AUDIO_CACHE_FOLDER)
 
 # אם קובץ המעקב לא קיים, ניצור אותו
 if not os.path.exists(PLAYED_PANIC_FILE):
@@ -33,47 +66,66 @@ if not os.path.exists(PLAYED_PANIC_FILE):
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# --- קטלוג בזיכרון (נטען פעם אחת בעלייה) ---
+get_catalog(SONGS_FOLDER)
+get_catalog(EVENTS_FOLDER)
+get_catalog(CALENDAR_FOLDER)
+
+# --- מדדים (/api/metrics בפורמט Prometheus, נאספים גם בתצוגת הצי של השרת) ---
+metrics = Registry()
+BELL_LATENESS = metrics.histogram(
+    'ringer_bell_lateness_seconds', 'Actual fire time minus scheduled time of timetable bells')
+BELLS_FIRED = metrics.counter('ringer_bells_fired_total', 'Timetable bells handed to the player')
+BELLS_SKIPPED = metrics.counter('ringer_bells_skipped_total', 'Timetable bells skipped for being too late')
+BELL_LAST_LATENESS = metrics.gauge('ringer_bell_last_lateness_seconds', 'Lateness of the most recent bell')
+PLAYER_START_LATENCY = metrics.histogram(
+    'ringer_player_start_latency_seconds', 'Time from LOAD until the player started decoding',
+    buckets=(0.002, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
+PLAYER_PLAYS = metrics.counter('ringer_player_plays_total', 'Files sent to a player channel')
+PLAYER_FAILURES = metrics.counter('ringer_player_failures_total', 'Player channel errors')
+PLAYER_RESTARTS = metrics.counter('ringer_player_restarts_total', 'Player process restarts')
+PANIC_END_TO_END = metrics.histogram(
+    'ringer_panic_end_to_end_seconds', 'Panic upload (or stream start) on the server until playback started here')
+PANIC_LAST_END_TO_END = metrics.gauge(
+    'ringer_panic_last_end_to_end_seconds', 'End-to-end latency of the most recent panic')
+PANIC_QUEUE_DEPTH = metrics.gauge('ringer_panic_queue_depth', 'Panic recordings waiting to be played')
+CLOCK_OFFSET = metrics.gauge(
+    'ringer_clock_offset_seconds', 'Local clock minus reference clock (positive = this receiver is ahead)')
+LAST_SYNC = metrics.gauge('ringer_last_sync_timestamp_seconds', 'Time of the last successful sync with the server')
+SYNC_REV = metrics.gauge('ringer_sync_rev', 'Server changelog rev applied locally')
+AUDIO_CACHE_BYTES = metrics.gauge('ringer_audio_cache_bytes', 'Bytes held in the local audio cache')
+AUDIO_DOWNLOADS = metrics.counter('ringer_audio_downloads_total', 'Audio files downloaded, by source (peer or server)')
+PEER_FILES_SERVED = metrics.counter('ringer_peer_files_served_total', 'Audio files served to neighbouring receivers')
+SCHEDULED_BELLS = metrics.gauge('ringer_scheduled_bells', 'Bells left in the compiled schedule')
+SCHEDULE_UNTIL = metrics.gauge('ringer_schedule_until_timestamp_seconds', 'End of the compiled schedule window')
+SCHEDULE_FROM_SERVER = metrics.gauge(
+    'ringer_schedule_from_server', '1 if bells follow the schedule compiled by the server, 0 if compiled locally')
+IS_LEADER = metrics.gauge('ringer_leader', '1 if this process runs playback and sync')
+
 # --- פונקציות עזר כלליות ---
 def get_item_by_id(folder, item_id):
-    """מחפש ומחזיר פריט JSON לפי מזהה"""
-    filepath = os.path.join(folder, f"{item_id}.json")
-    if os.path.exists(filepath):
-        try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception:
-            return None
-    return None
+    """מחפש ומחזיר פריט JSON לפי מזהה (מהקטלוג בזיכרון)"""
+    return get_catalog(folder).get(item_id)
 
 def list_json_files(folder):
-    """רשימה של כל קבצי ה-JSON בתיקייה נתונה"""
-    items = []
-    for filename in os.listdir(folder):
-        if filename.endswith('.json'):
-            try:
-                filepath = os.path.join(folder, filename)
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    items.append(data)
-            except Exception as e:
-                logging.warning(f"שגיאה בקריאת קובץ {filename}: {e}")
-    return items
+    """רשימה של כל פריטי ה-JSON בתיקייה נתונה (מהקטלוג בזיכרון)"""
+    return get_catalog(folder).list()
 
 def save_json_file(folder, data, file_id=None):
-    """שמירת נתונים לקובץ JSON"""
+    """שמירת נתונים לקובץ JSON ועדכון הקטלוג"""
     if not file_id:
         file_id = str(uuid.uuid4())
         data['id'] = file_id
     
     data['id'] = str(data['id'])
-    filepath = os.path.join(folder, f"{data['id']}.json")
-    
-    with open(filepath, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-    return data
+    return get_catalog(folder).put(data)
+
+def save_json_files(folder, items):
+    """שמירת רשומות רבות ב-group commit אחד (fsync אחד לתיקייה)"""
+    return get_catalog(folder).put_many(items)
 
 def upload_and_save_file(file, folder, original_filename):
-    """שמירה מאובטחת של קובץ והחזרת השם הייחודי שנוצר."""
+    """שמירה מאובטחת של קובץ (פאניק) והחזרת השם הייחודי שנוצר."""
     filename_secured = secure_filename(original_filename)
     extension = os.path.splitext(filename_secured)[1]
     unique_filename = str(uuid.uuid4()) + (extension if extension else '.mp3')
@@ -81,181 +133,906 @@ def upload_and_save_file(file, folder, original_filename):
     file.save(file_path)
     return unique_filename
 
+def save_song_file(file, original_filename):
+    """שומר קובץ שיר לפי התוכן (content_store). מחזיר (שם הקובץ, sha256)."""
+    extension = os.path.splitext(secure_filename(original_filename))[1] or '.mp3'
+    tmp_path = temp_path(SONGS_FOLDER, extension)
+    try:
+        file.save(tmp_path)
+        content_hash = file_sha256(tmp_path)
+        filename, _ = store_file(tmp_path, SONGS_FOLDER, extension, content_hash)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return filename, content_hash
+
+# תוספת הגודל של עטיפת ה-multipart (גבולות, כותרות, metadata) מעל הקובץ עצמו
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+def check_multipart_upload(file, max_bytes):
+    """בדיקות גודל וסוג להעלאה הישנה (multipart). זורק UploadError."""
+    head = file.stream.read(SNIFF_BYTES)
+    file.stream.seek(0)
+    check_audio_file(file.filename, head, request.content_length, max_bytes + MULTIPART_OVERHEAD_BYTES)
+
 def delete_json_file(folder, file_id):
-    """מחיקת קובץ JSON"""
-    filepath = os.path.join(folder, f"{file_id}.json")
-    if os.path.exists(filepath):
-        os.remove(filepath)
-        return True
-    return False
+    """מחיקת קובץ JSON ועדכון הקטלוג"""
+    return get_catalog(folder).delete(file_id)
+
+def validate_event(data):
+    """בודק אירוע לפני שמירה. מחזיר הודעת שגיאה או None."""
+    if not data or not data.get('name') or not data.get('time') or not data.get('songId'):
+        return 'Missing required fields'
+    error = validate_event_rule(data)
+    if error:
+        return error
+    if not get_item_by_id(SONGS_FOLDER, data['songId']):
+        logging.error(f"אירוע '{data['name']}' מפנה לשיר שלא קיים: {data['songId']}")
+        return f"Unknown songId: {data['songId']}"
+    return None
 
 # --- מנגנון הניגון הפיזי (על ה-Raspberry Pi) ---
-def play_audio(file_path, start_time=None, end_time=None):
+# תהליכי mpg123 קבועים לצלצולים ולהכרזות (ראה player.py)
+playback = PlaybackEngine()
+playback.add_start_listener(lambda channel, latency: PLAYER_START_LATENCY.observe(latency, channel=channel))
+
+def play_audio(file_paths):
     """
-    מנגן קובץ אודיו באמצעות mpg123.
+    מנגן צלצולים בערוץ הצלצולים (לא חוסם): הראשון מיד, והשאר אחד אחרי השני.
+    החיתוך (clipStart/clipEnd) כבר מוחל בגרסת הניגון שהשרת מפיק (ראה renditions.py).
     """
-    if not os.path.exists(file_path):
-        logging.error(f"קובץ ניגון לא נמצא: {file_path}")
+    existing = []
+    for file_path in file_paths:
+        if os.path.exists(file_path):
+            existing.append(file_path)
+        else:
+            logging.error(f"קובץ ניגון לא נמצא: {file_path}")
+    if not existing:
         return False
 
-    cmd = ['mpg123', file_path]
-    
-    logging.info(f"מנגן קובץ: {file_path} (פקודה: {' '.join(cmd)})")
-    
+    logging.info(f"מנגן קבצים: {', '.join(existing)}")
+    return playback.play_bells(existing)
+
+# --- קריאה מיידית (פאניק): תור בתוך התהליך ---
+# כל קובץ פאניק חדש (העלאה מקומית או הורדה בעקבות Webhook) נכנס ישר לתור
+# ומנוגן מיד; סריקת התיקייה נעשית רק פעם אחת בעלייה, לשחזור קבצים שלא נוגנו.
+# שידור חי נכנס לאותו תור ומנוגן תוך כדי הורדה.
+panic_queue = queue.Queue()
+_queued_panic_files = set()
+_played_panic_streams = set()
+_panic_lock = threading.Lock()
+# קובץ/שידור -> מתי נוצר בשרת (לפי השעון המקומי), למדידת זמן מקצה לקצה
+_panic_origins = {}
+
+def note_panic_origin(key, server_ts):
+    """זוכר מתי קריאת הפאניק נוצרה בשרת, מתוקן להפרש השעונים מול השרת."""
     try:
-        # הפעלה לא חוסמת, אלא אם נרצה לחכות לסיום הניגון
-        subprocess.Popen(cmd)
-        return True
+        _panic_origins[key] = float(server_ts) + (_server_clock_offset or 0.0)
+    except (TypeError, ValueError):
+        pass
+
+def observe_panic_start(kind, key, started_at):
+    """רושם את הזמן מהעלאה בשרת ועד שהניגון התחיל כאן."""
+    origin = _panic_origins.pop(key, None)
+    if origin is None or started_at is None:
+        return
+    end_to_end = max(0.0, started_at - origin)
+    PANIC_END_TO_END.observe(end_to_end, kind=kind)
+    PANIC_LAST_END_TO_END.set(end_to_end, kind=kind)
+    logging.warning(f"פאניק {key}: {end_to_end * 1000:.0f} ms מההעלאה ועד תחילת הניגון.")
+
+# נגן לשידור חי: קורא את הזרם (webm/opus מהדפדפן) מ-stdin ומנגן תוך כדי הגעה
+STREAM_PLAYER_CMD = os.environ.get(
+    'RINGER_STREAM_PLAYER', 'ffplay -nodisp -autoexit -loglevel error -i pipe:0').split()
+# השרת מחזיר 503 כשכל המקומות לזרמים ב-worker תפוסים; ניסיון חוזר מגיע לרוב ל-worker אחר
+PANIC_STREAM_ATTEMPTS = 10
+
+def enqueue_panic_file(filename):
+    """מכניס קובץ פאניק לתור הניגון (פעם אחת לכל קובץ)."""
+    with _panic_lock:
+        if filename in _queued_panic_files:
+            return False
+        _queued_panic_files.add(filename)
+    panic_queue.put(('file', filename))
+    logging.warning(f"קריאת פאניק חדשה נכנסה לתור: {filename}")
+    return True
+
+def enqueue_panic_stream(stream_id, url):
+    """מכניס שידור פאניק חי לתור הניגון (פעם אחת לכל שידור, גם אם ה-Webhook נשלח שוב)."""
+    with _panic_lock:
+        if stream_id in _played_panic_streams:
+            return False
+        _played_panic_streams.add(stream_id)
+    panic_queue.put(('stream', stream_id, url))
+    logging.warning(f"שידור פאניק חי נכנס לתור: {stream_id}")
+    return True
+
+def play_panic_stream(stream_id, url):
+    """מושך את השידור מהשרת ומזרים אותו ישירות לנגן, בלי לחכות לסוף ההקלטה."""
+    logging.info(f"**מפעיל שידור פאניק חי:** {stream_id}")
+    with playback.announcement():
+        _stream_to_player(stream_id, url)
+
+def _stream_to_player(stream_id, url):
+    try:
+        player = subprocess.Popen(STREAM_PLAYER_CMD, stdin=subprocess.PIPE)
     except FileNotFoundError:
-        logging.critical("פקודת mpg123 לא נמצאה. ודא שהיא מותקנת.")
-        return False
+        logging.critical(f"נגן השידור החי ({STREAM_PLAYER_CMD[0]}) לא נמצא. ודא שהוא מותקן.")
+        return
+    try:
+        for attempt in range(1, PANIC_STREAM_ATTEMPTS + 1):
+            # הזמן לקריאה ארוך מזמן ההמתנה של השרת לזרם שנתקע
+            with requests.get(f"{SERVER_URL}{url}", stream=True, timeout=(3, 35)) as response:
+                if response.status_code == 503 and attempt < PANIC_STREAM_ATTEMPTS:
+                    retry_after = response.headers.get('Retry-After', '1')
+                    logging.warning(f"השרת עמוס, שידור פאניק {stream_id} יימשך שוב בעוד {retry_after} שניות.")
+                    time.sleep(int(retry_after) if retry_after.isdigit() else 1)
+                    continue
+                response.raise_for_status()
+                # chunk_size=None: כל חלק מועבר לנגן ברגע שהגיע
+                for chunk in response.iter_content(chunk_size=None):
+                    player.stdin.write(chunk)
+                    player.stdin.flush()
+                    observe_panic_start('stream', stream_id, time.time())
+            break
     except Exception as e:
-        logging.error(f"שגיאה בהפעלת הניגון: {e}")
-        return False
+        logging.error(f"שגיאה בשידור פאניק חי {stream_id}: {e}")
+    finally:
+        try:
+            player.stdin.close()
+        except BrokenPipeError:
+            pass
+        player.wait()
+        logging.info(f"שידור פאניק חי הסתיים: {stream_id}")
 
-# --- ליסנר קריאה מיידית (פאניק) ---
-# server.py
+def play_panic_file(filename):
+    """מנגן קובץ פאניק עד סופו ומוחק אותו לאחר ניגון מוצלח."""
+    file_path = os.path.join(PANIC_FOLDER, filename)
+    logging.info(f"**מפעיל קריאת פאניק:** {filename}")
 
-# ... (שאר הקוד נשאר זהה)
+    # --- ניגון הקובץ בערוץ ההכרזות (צלצולים ממשיכים לפעול במקביל, בעוצמה מונמכת) ---
+    try:
+        started_before = playback.announcements.last_started_at
+        played = playback.play_announcement(file_path)
+        if playback.announcements.last_started_at != started_before:
+            observe_panic_start('file', filename, playback.announcements.last_started_at)
+        if not played:
+            # אם הניגון נכשל (למשל mpg123 לא נמצא), הקובץ יישאר בתיקייה וינוגן בעלייה הבאה.
+            logging.error(f"שגיאת ניגון בקריאת פאניק {filename}. הקובץ לא נמחק.")
+            return
+
+        # מחיקת הקובץ לאחר ניגון מוצלח.
+        os.remove(file_path)
+        logging.info(f"קובץ פאניק נמחק לאחר ניגון: {filename}")
+
+    except Exception as e:
+        logging.error(f"שגיאה בלתי צפויה במהלך ניגון/מחיקה: {e}")
 
-# --- ליסנר קריאה מיידית (פאניק) ---
-def panic_listener_job():
-    """בודק האם יש קבצי פאניק חדשים, מפעיל אותם, ומוחק אותם."""
+def run_panic_worker():
+    """רץ ב-thread נפרד: ממתין לקבצים בתור ומנגן אותם אחד אחרי השני."""
+    while True:
+        job = panic_queue.get()
+        try:
+            if job[0] == 'stream':
+                play_panic_stream(job[1], job[2])
+            else:
+                play_panic_file(job[1])
+        finally:
+            if job[0] == 'file':
+                with _panic_lock:
+                    _queued_panic_files.discard(job[1])
+            panic_queue.task_done()
+
+def recover_pending_panic_files():
+    """סריקת שחזור בעלייה: מכניס לתור קבצי פאניק שנשארו בתיקייה ולא נוגנו."""
     try:
-        # 1. טען את רשימת הקבצים שנוגנו
         with open(PLAYED_PANIC_FILE, 'r') as f:
             played_files = set(f.read().splitlines())
-        
-        # 2. בדוק קבצים חדשים בתיקייה
-        new_files = []
-        for filename in os.listdir(PANIC_FOLDER):
-            # מוודא שהקובץ הוא לא קובץ מעקב ושהוא עדיין לא נוגן
-            if filename not in played_files and not filename.endswith('.txt'):
-                new_files.append(filename)
-
-        if new_files:
-            logging.warning(f"נמצאו {len(new_files)} קריאות פאניק חדשות!")
-            
-            # מנגן את הקבצים (בסדר אלפביתי/זמן יצירה)
-            new_files.sort()
-            for filename in new_files:
-                file_path = os.path.join(PANIC_FOLDER, filename)
-                
-                # ניגון עם המתנה לסיום (כדי שלא יתנגנו בו זמנית)
-                logging.info(f"**מפעיל קריאת פאניק:** {filename}")
-                
-                # --- ניגון הקובץ (מחייב mpg123 להיות מותקן) ---
-                try:
-                    subprocess.run(['mpg123', file_path], check=True) # check=True יזרוק שגיאה אם mpg123 נכשל
-                    
-                    # 3. מחיקת הקובץ לאחר ניגון מוצלח
-                    os.remove(file_path)
-                    logging.info(f"קובץ פאניק נמחק לאחר ניגון: {filename}")
-                    
-                    # 4. אם נמחק, אין צורך לרשום אותו ב-played_panic.txt.
-                    # אם הניגון נכשל (כי mpg123 לא נמצא), הקובץ יישאר בתיקייה.
-                    
-                except FileNotFoundError:
-                    logging.critical("פקודת mpg123 לא נמצאה. ודא שהיא מותקנת. הקובץ לא נמחק.")
-                except subprocess.CalledProcessError as e:
-                     logging.error(f"שגיאת ניגון: {e}. הקובץ לא נמחק.")
-                except Exception as e:
-                    logging.error(f"שגיאה בלתי צפויה במהלך ניגון/מחיקה: {e}")
-
-            logging.info("סיום טיפול בקריאות פאניק.")
+
+        pending = sorted(
+            filename for filename in os.listdir(PANIC_FOLDER)
+            # מוודא שהקובץ הוא לא קובץ מעקב/חלקי ושהוא עדיין לא נוגן
+            if filename not in played_files and not filename.endswith(('.txt', '.part')))
+        if pending:
+            logging.warning(f"נמצאו {len(pending)} קריאות פאניק שלא נוגנו!")
+        for filename in pending:
+            enqueue_panic_file(filename)
+        return len(pending)
 
     except Exception as e:
-        logging.error(f"שגיאה בליסנר פאניק: {e}")
+        logging.error(f"שגיאה בסריקת קבצי פאניק: {e}")
+        return 0
+
+
+# --- לוח הצלצולים (רשימה ממוינת שהשרת מקמפל, ראה bell_schedule.py) ---
+# הרסיבר מנגן לפי הרשימה האחרונה שהשרת שלח (נשמרת ב-SCHEDULE_FILE עם ה-ETag,
+# כך שאחרי הפעלה מחדש השרת עונה 304). אם אין כזו, אם עוד לא היה סנכרון מאז
+# העלייה, אם היא לא מכסה לפחות SCHEDULE_MIN_COVERAGE_SECONDS קדימה, או אם
+# האירועים/לוח השנה נערכו כאן אחרי הסנכרון האחרון, או אם יש אירועים מקומיים
+# (origin=local, ראה SYNC_KINDS) - הרסיבר מקמפל בעצמו
+# מהקטלוג המקומי עם אותו קוד, כך שהצלצולים לא נעצרים כשהשרת לא זמין.
+# זמני הצלצול בלוח מהשרת מחושבים כאן מחדש לפי אזור הזמן המקומי (localize_schedule).
+SCHEDULE_MIN_COVERAGE_SECONDS = 24 * 60 * 60
 
+_server_schedule = {'etag': None, 'body': None, 'version': 0}
+_synced_versions = {'versions': None}   # גרסאות הקטלוג המקומי מיד אחרי הסנכרון האחרון
+_timetable = {'key': None, 'table': None}
+_timetable_lock = threading.Lock()
+
+def set_server_schedule(etag, body):
+    """שומר בזיכרון את הלוח מהשרת אחרי חישוב הזמנים לפי אזור הזמן המקומי."""
+    try:
+        body = localize_schedule(body)
+    except ValueError as e:
+        logging.error(f"הלוח מהשרת לא תקין ולא ישמש: {e}")
+        body = None
+    # בלי ETag ללוח שנדחה, כדי שהסנכרון הבא ימשוך אותו שוב ולא יקבל 304
+    _server_schedule.update(etag=etag if body else None, body=body, version=_server_schedule['version'] + 1)
+    return body
+
+def schedule_catalog_versions():
+    """גרסאות הקטלוגים שהלוח נגזר מהם (עם רענון מעריכות חיצוניות)."""
+    versions = []
+    for folder in (EVENTS_FOLDER, CALENDAR_FOLDER):
+        catalog = get_catalog(folder)
+        catalog.refresh()
+        versions.append(catalog.version)
+    return tuple(versions)
+
+def load_server_schedule():
+    """טוען בעלייה את הלוח האחרון שהתקבל מהשרת (אם יש); משמש רק אחרי הסנכרון הראשון."""
+    try:
+        with open(SCHEDULE_FILE, 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return
+    if saved.get('schedule'):
+        set_server_schedule(saved.get('etag'), saved['schedule'])
+
+def fetch_server_schedule():
+    """מושך את הלוח המקומפל מהשרת (304 אם לא השתנה). מחזיר True אם התקבל לוח חדש."""
+    headers = {'If-None-Match': _server_schedule['etag']} if _server_schedule['etag'] else {}
+    response = requests.get(f"{SERVER_URL}/api/schedule", headers=headers, timeout=(3, 30))
+    if response.status_code == 304:
+        return False
+    response.raise_for_status()
+    body = response.json()
+    etag = response.headers.get('ETag')
+    tmp_path = SCHEDULE_FILE + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'etag': etag, 'schedule': body}, f, ensure_ascii=False)
+    os.replace(tmp_path, SCHEDULE_FILE)
+    set_server_schedule(etag, body)
+    logging.info(f"לוח צלצולים התקבל מהשרת: {len(body['entries'])} צלצולים מ-{body['from']} ל-{body['days']} ימים.")
+    return True
+
+def usable_server_schedule(now):
+    """הלוח מהשרת, או None אם צריך לקמפל מקומית (ראה למעלה)."""
+    body = _server_schedule['body']
+    if not body or body.get('until', 0) - now < SCHEDULE_MIN_COVERAGE_SECONDS:
+        return None
+    if body.get('rev') != load_sync_rev() or schedule_catalog_versions() != _synced_versions['versions']:
+        return None
+    if has_local_events():
+        return None
+    return body
+
+_local_events = {'version': None, 'present': False}
+
+def has_local_events():
+    """האם יש אירועים מקומיים (origin=local); הלוח מהשרת לא כולל אותם."""
+    catalog = get_catalog(EVENTS_FOLDER)
+    if _local_events['version'] != catalog.version:
+        _local_events['present'] = any(event.get('origin') == LOCAL_ORIGIN for event in catalog.list())
+        _local_events['version'] = catalog.version
+    return _local_events['present']
+
+def song_playback_source(song):
+    """(hash, שם קובץ) של מה שמנגנים: גרסת הניגון המנורמלת אם הופקה, אחרת הקובץ המקורי."""
+    if song.get('renditionHash') and song.get('renditionFilename'):
+        return song['renditionHash'], song['renditionFilename']
+    return song.get('contentHash'), song.get('filename')
+
+def resolve_song_path(song):
+    """הנתיב המקומי לניגון שיר: גרסת הניגון (מהמטמון או מקומית) אם קיימת, אחרת הקובץ המקורי."""
+    for content_hash, filename in (song_playback_source(song), (song.get('contentHash'), song.get('filename'))):
+        cached_path = audio_cache.path_for(content_hash) if content_hash else None
+        if cached_path:
+            return cached_path
+        if filename and os.path.exists(os.path.join(SONGS_FOLDER, filename)):
+            return os.path.join(SONGS_FOLDER, filename)
+    return os.path.join(SONGS_FOLDER, song['filename'])
+
+def build_timetable(schedule):
+    """
+    ממפה את רשימת הצלצולים לנתיבי הקבצים המוכנים לניגון. מחזיר
+    {'entries': [...], 'times': [...], 'until', 'source'} ממוין לפי זמן.
+    """
+    songs_map = {str(s['id']): s for s in list_json_files(SONGS_FOLDER)}
+    entries, missing = [], set()
+
+    for entry in schedule['entries']:
+        song = songs_map.get(str(entry.get('songId')))
+        if not song or not song.get('filename'):
+            missing.add((entry['name'], entry.get('songId')))
+            continue
+        entries.append(dict(entry, file_path=resolve_song_path(song)))
+
+    for name, song_id in sorted(missing, key=str):
+        logging.error(f"שיר ({song_id}) לא נמצא עבור אירוע: {name}")
+    logging.info(f"לוח הצלצולים נבנה ({schedule['source']}): {len(entries)} צלצולים מ-{schedule['from']}.")
+    return {
+        'entries': entries,
+        'times': [entry['at'] for entry in entries],
+        'until': schedule['until'],
+        'source': schedule['source'],
+    }
+
+def compile_local_schedule(start_date):
+    """מקמפל את הלוח מהקטלוג המקומי (כשאין לוח שמיש מהשרת)."""
+    # אירועים לא תקינים מדולגים ונרשמים ביומן בתוך compile_schedule
+    entries, _ = compile_schedule(list_json_files(EVENTS_FOLDER), list_json_files(CALENDAR_FOLDER),
+                                  start_date, SCHEDULE_DAYS)
+    return {'entries': entries, 'from': start_date.isoformat(), 'days': SCHEDULE_DAYS,
+            'until': schedule_until(start_date, SCHEDULE_DAYS), 'source': 'local'}
+
+def get_timetable():
+    """מחזיר את לוח הצלצולים, ובונה אותו מחדש רק אם הלוח מהשרת, שיר, אירוע, היום או המטמון השתנו."""
+    now = time.time()
+    server_schedule = usable_server_schedule(now)
+    songs_catalog = get_catalog(SONGS_FOLDER)
+    songs_catalog.refresh()
+    if server_schedule:
+        source_key = ('server', _server_schedule['version'])
+    else:
+        source_key = ('local', schedule_catalog_versions(), datetime.fromtimestamp(now).date())
+    key = (source_key, songs_catalog.version, audio_cache.version)
+
+    with _timetable_lock:
+        if _timetable['key'] != key:
+            if server_schedule:
+                schedule = dict(server_schedule, source='server')
+            else:
+                schedule = compile_local_schedule(source_key[2])
+            _timetable['table'] = build_timetable(schedule)
+            _timetable['key'] = key
+        return _timetable['table']
 
 # --- תזמון אירועים קבוע (לוח זמנים) ---
-def events_scheduler_job():
-    """מפעיל אירועים מתוזמנים אם הגיע זמנם."""
-    
-    all_events = list_json_files(EVENTS_FOLDER)
-    all_songs = list_json_files(SONGS_FOLDER)
-    
-    songs_map = {str(s['id']): s for s in all_songs}
+# המתזמן ישן בדיוק עד הצלצול הבא, אבל מתעורר לפחות פעם בפרק זמן זה
+# כדי לזהות קפיצות שעון ועריכות חיצוניות של הקבצים
+SCHEDULER_MAX_SLEEP_SECONDS = 30
+# צלצול שאיחר יותר מזה (למשל אחרי קפיצת שעון) מדולג ולא מנוגן באיחור
+SCHEDULER_LATE_LIMIT_SECONDS = 60
+# אחרי שגיאה בלולאה (למשל לוח פגום או כשל כתיבה) ממתינים ככה לפני ניסיון חוזר
+SCHEDULER_ERROR_RETRY_SECONDS = 5
+
+class BellScheduler:
+    """
+    מנוע תזמון מבוסס דדליין: הולך על רשימת הצלצולים הממוינת לפי הסדר, ישן עד
+    הדדליין הקרוב, ומתעורר מוקדם כשלוח הזמנים משתנה. כל מופע מנוגן פעם אחת
+    בדיוק: _cursor הוא זמן המופע האחרון שטופל, ואחרי בנייה מחדש ממשיכים
+    מהמופע הראשון שאחריו (bisect). הסמן מתחיל בזמן שהלולאה עלתה (ולא בזמן
+    הייבוא), ושגיאה בסבב נרשמת ביומן בלי לעצור את ה-thread.
+    """
+
+    def __init__(self, fire_callback):
+        self.fire_callback = fire_callback
+        self.last_lateness = None
+        self._timetable = None
+        self._next = 0
+        self._cursor = time.time()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
 
-    now = datetime.now()
-    # שינוי קטן כדי לוודא התאמה לתוכנית: יום שני הוא 0, ראשון הוא 6.
-    # [0:שני, 1:שלישי, 2:רביעי, 3:חמישי, 4:שישי, 5:שבת, 6:ראשון]
-    days_map = ['שני', 'שלישי', 'רביעי', 'חמישי', 'שישי', 'שבת', 'ראשון']
-    current_day = days_map[now.weekday()]
-    current_time = now.strftime('%H:%M')
+    def wake(self, *args):
+        """מעיר את המתזמן לבנייה מחדש של הלוח (נרשם כמאזין לקטלוג)."""
+        self._wakeup.set()
 
-    logging.debug(f"בודק אירועים: {current_day} {current_time}")
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
 
-    for event in all_events:
+    def _rebuild(self):
+        self._timetable = get_timetable()
+        self._next = bisect.bisect_right(self._timetable['times'], self._cursor)
+
+    def _fire(self, occurrence_ts, entries):
+        lateness = time.time() - occurrence_ts
+        if lateness > SCHEDULER_LATE_LIMIT_SECONDS:
+            scheduled = datetime.fromtimestamp(occurrence_ts).strftime('%Y-%m-%d %H:%M')
+            logging.error(f"צלצול של {scheduled} דולג: איחור של {lateness:.1f} שניות.")
+            BELLS_SKIPPED.inc(len(entries))
+            return
+        self.last_lateness = lateness
+        BELL_LATENESS.observe(lateness)
+        BELL_LAST_LATENESS.set(lateness)
+        for entry in entries:
+            logging.warning(f"**מפעיל צלצול מתוזמן:** {entry['name']} ({entry['file_path']}) - איחור {lateness * 1000:.1f} ms")
         try:
-            if event['day'] == current_day and event['time'] == current_time:
-                
-                song = songs_map.get(str(event['songId']))
-                
-                if not song:
-                    logging.error(f"שיר ({event['songId']}) לא נמצא עבור אירוע: {event['name']}")
-                    continue
+            # כל הצלצולים של המופע עוברים יחד, כדי שהנגן ינגן אותם ברצף ולא יחליף אחד באחר
+            self.fire_callback(entries)
+            BELLS_FIRED.inc(len(entries))
+        except Exception as e:
+            logging.error(f"שגיאה בהפעלת אירועים {', '.join(entry.get('name', 'לא ידוע') for entry in entries)}: {e}")
 
-                song_filename = song.get('filename')
-                if not song_filename:
-                    logging.error(f"שם קובץ חסר עבור שיר: {song['name']}")
-                    continue
+    def run(self):
+        """לולאת המתזמן (רצה ב-thread נפרד)."""
+        self._cursor = time.time()
+        self._timetable = None
+        while not self._stop.is_set():
+            try:
+                self._step()
+            except Exception as e:
+                # ה-thread היחיד של הצלצולים: שגיאה לא עוצרת אותו
+                logging.error(f"שגיאה במתזמן הצלצולים: {e}")
+                self._wakeup.wait(SCHEDULER_ERROR_RETRY_SECONDS)
 
-                file_path = os.path.join(SONGS_FOLDER, song_filename)
-                
-                logging.warning(f"**מפעיל צלצול מתוזמן:** {event['name']} ({file_path})")
-                
-                # הפעלת הניגון (הניגון המדויק תלוי ב-mpg123)
-                play_audio(file_path)
+    def _step(self):
+        """סבב אחד: בנייה מחדש אם צריך, ואז המתנה לצלצול הבא או הפעלה שלו."""
+        # get_timetable בונה מחדש רק אם משהו השתנה (כולל עריכות חיצוניות ומעבר יום)
+        if self._timetable is None or self._wakeup.is_set() or get_timetable() is not self._timetable:
+            self._wakeup.clear()
+            self._rebuild()
 
-        except Exception as e:
-            logging.error(f"שגיאה בהפעלת אירוע {event.get('name', 'לא ידוע')}: {e}")
+        times = self._timetable['times']
+        if self._next >= len(times):
+            self._wakeup.wait(SCHEDULER_MAX_SLEEP_SECONDS)
+            return
+
+        occurrence_ts = times[self._next]
+        delay = occurrence_ts - time.time()
+        if delay > 0:
+            self._wakeup.wait(min(delay, SCHEDULER_MAX_SLEEP_SECONDS))
+            return
+
+        # כל הצלצולים של אותה דקה מנוגנים יחד
+        end = bisect.bisect_right(times, occurrence_ts, self._next)
+        entries = self._timetable['entries'][self._next:end]
+        self._next = end
+        self._cursor = occurrence_ts
+        self._fire(occurrence_ts, entries)
+
+def play_timetable_entries(entries):
+    """
+    מנגן את הצלצולים של מופע אחד ברצף (הניגון המדויק תלוי ב-mpg123). כמה אירועים
+    שמפנים לאותו קובץ באותה דקה מנוגנים פעם אחת. לעולם לא ממתין לרשת.
+    """
+    file_paths = list(dict.fromkeys(entry['file_path'] for entry in entries))
+    play_audio(file_paths)
+    for file_path in file_paths:
+        audio_cache.touch(file_path)
+
+bell_scheduler = BellScheduler(play_timetable_entries)
+for _folder in (EVENTS_FOLDER, SONGS_FOLDER, CALENDAR_FOLDER):
+    get_catalog(_folder).add_listener(bell_scheduler.wake)
+load_server_schedule()
+
+# --- שעון: הפרש מול השרת ומול NTP ---
+# הצלצולים מתוזמנים לפי השעון המקומי, כך שרסיבר ששעונו זז מצלצל בזמן הלא
+# נכון גם כשהמתזמן "בזמן". ההפרש מול השרת נמדד בכל סנכרון (אמצע זמן
+# הבקשה מול השעה שהשרת החזיר), וההפרש מול NTP נקרא מ-chrony/systemd-timesyncd.
+CLOCK_MAX_RTT_SECONDS = 1.0   # מדידה עם זמן סבב ארוך מזה לא מדויקת מספיק
+NTP_CHECK_INTERVAL_SECONDS = 60
+_server_clock_offset = None
+_ntp_offset_cache = {'checked_at': 0.0, 'offset': None}
+_TIMESYNC_OFFSET_RE = re.compile(r'Offset:\s*([+-]?[\d.]+)(us|µs|ms|s)')
+
+def measure_server_clock_offset():
+    """שעון מקומי פחות שעון השרת (שניות), או None אם המדידה לא אמינה."""
+    global _server_clock_offset
+    sent_at = time.time()
+    response = requests.get(f"{SERVER_URL}/api/time", timeout=(3, 5))
+    received_at = time.time()
+    response.raise_for_status()
+    if received_at - sent_at > CLOCK_MAX_RTT_SECONDS:
+        return None
+    _server_clock_offset = (sent_at + received_at) / 2 - float(response.json()['time'])
+    CLOCK_OFFSET.set(_server_clock_offset, source='server')
+    return _server_clock_offset
+
+def read_ntp_offset():
+    """שעון מקומי פחות שעון ה-NTP (שניות) לפי chrony או timesyncd, או None."""
+    try:
+        # -c: פלט CSV; השדה השישי הוא Last offset (חיובי = השעון המקומי מקדים)
+        output = subprocess.run(['chronyc', '-c', 'tracking'], capture_output=True, text=True, timeout=2).stdout
+        return float(output.split(',')[5])
+    except (OSError, subprocess.SubprocessError, IndexError, ValueError):
+        pass
+    try:
+        output = subprocess.run(['timedatectl', 'timesync-status'], capture_output=True, text=True, timeout=2).stdout
+        match = _TIMESYNC_OFFSET_RE.search(output)
+        if match:
+            scale = {'us': 1e-6, 'µs': 1e-6, 'ms': 1e-3, 's': 1.0}[match.group(2)]
+            return float(match.group(1)) * scale
+    except (OSError, subprocess.SubprocessError, ValueError):
+        pass
+    return None
+
+def cached_ntp_offset():
+    now = time.monotonic()
+    if now - _ntp_offset_cache['checked_at'] >= NTP_CHECK_INTERVAL_SECONDS:
+        _ntp_offset_cache.update(checked_at=now, offset=read_ntp_offset())
+    return _ntp_offset_cache['offset']
 
-# --- מנהל הרקע ---
-def run_schedule_continuously():
-    """רץ ב-thread נפרד ומנהל את כל בדיקות הליסנר והתזמון."""
+# --- סנכרון חלקי מול השרת ---
+_sync_wakeup = threading.Event()
+_sync_lock = threading.Lock()
+# לוח השנה מסונכרן כדי שאפשר יהיה לקמפל את הלוח מקומית כשהשרת לא זמין
+SYNC_KINDS = {'songs': SONGS_FOLDER, 'events': EVENTS_FOLDER, 'calendar': CALENDAR_FOLDER}
+# רשומות שנוצרו או נערכו דרך ה-API של הרסיבר עצמו מסומנות origin=local. תמונה
+# מלאה מהשרת לא מוחקת אותן (רק מחיקה מפורשת מהשרת, או עדכון מהשרת לאותו id
+# שמחזיר את הרשומה לבעלות השרת).
+LOCAL_ORIGIN = 'local'
+
+def load_sync_rev():
+    """ה-rev האחרון שהוחל מהשרת (0 אם עוד לא סונכרן)."""
+    try:
+        with open(SYNC_STATE_FILE, 'r', encoding='utf-8') as f:
+            return int(json.load(f).get('rev', 0))
+    except (FileNotFoundError, ValueError, TypeError):
+        return 0
+
+def save_sync_rev(rev):
+    tmp_path = SYNC_STATE_FILE + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'rev': rev}, f)
+    os.replace(tmp_path, SYNC_STATE_FILE)
+
+def sync_from_server():
+    """
+    מושך מהשרת רק את השינויים מאז ה-rev האחרון ומחיל אותם על הקטלוג המקומי,
+    ואחריהם את לוח הצלצולים המקומפל (304 אם לא השתנה).
+    """
+    with _sync_lock:
+        since = load_sync_rev()
+        response = requests.get(f"{SERVER_URL}/api/changes", params={'since': since}, timeout=(3, 30))
+        response.raise_for_status()
+        changes = response.json()
+
+        applied = 0
+        for kind, folder in SYNC_KINDS.items():
+            items = changes.get(kind, [])
+            deleted = list(changes.get('deleted', {}).get(kind, []))
+            if changes.get('full'):
+                # השרת החזיר תמונה מלאה: כל מה שלא מופיע בה נמחק, חוץ מרשומות מקומיות
+                remote_ids = {str(item['id']) for item in items}
+                deleted += [str(item['id']) for item in list_json_files(folder)
+                            if str(item['id']) not in remote_ids and item.get('origin') != LOCAL_ORIGIN]
+            save_json_files(folder, items)
+            applied += len(items)
+            for item_id in deleted:
+                if delete_json_file(folder, item_id):
+                    applied += 1
+
+        save_sync_rev(changes['rev'])
+        _synced_versions['versions'] = schedule_catalog_versions()
+        LAST_SYNC.set(time.time())
+        SYNC_REV.set(changes['rev'])
+        if fetch_server_schedule():
+            bell_scheduler.wake()
+        if applied:
+            logging.info(f"סנכרון מהשרת: {applied} שינויים הוחלו (rev {since} -> {changes['rev']}).")
+        return applied
+
+def run_sync_loop():
+    """רץ ב-thread נפרד: מסנכרן בעלייה, בכל Webhook, ולפחות כל SYNC_INTERVAL_SECONDS."""
     while True:
-        schedule.run_pending()
-        time.sleep(1) # בדיקה כל שנייה
+        _sync_wakeup.clear()
+        try:
+            sync_from_server()
+        except Exception as e:
+            logging.error(f"שגיאה בסנכרון מול השרת ({SERVER_URL}): {e}")
+        try:
+            offset = measure_server_clock_offset()
+            if offset is not None and abs(offset) > 1:
+                logging.warning(f"השעון המקומי שונה משעון השרת ב-{offset:+.2f} שניות.")
+        except Exception as e:
+            logging.error(f"שגיאה במדידת הפרש השעון מול השרת: {e}")
+        try:
+            prefetch_upcoming_songs()
+        except Exception as e:
+            logging.error(f"שגיאה בהורדה מוקדמת של שירים: {e}")
+        _sync_wakeup.wait(SYNC_INTERVAL_SECONDS)
+
+def prefetch_upcoming_songs():
+    """
+    מוריד מראש למטמון כל שיר שאירוע כלשהו מפנה אליו (בגרסת הניגון שלו), לפי
+    סדר הצלצולים בלוח (ואחריהם שירים של אירועים שלא מצלצלים בחלון הלוח), טוען
+    את הקבצים ל-page cache ומפנה מהמטמון רק קבצים שאף אירוע לא צריך.
+    """
+    songs_map = {str(s['id']): s for s in list_json_files(SONGS_FOLDER)}
+    timetable = get_timetable()
+    upcoming_ids = [entry['songId'] for entry in
+                    timetable['entries'][bisect.bisect_right(timetable['times'], time.time()):]]
+    upcoming_ids += [str(event.get('songId')) for event in list_json_files(EVENTS_FOLDER)]
+    upcoming = [songs_map[song_id] for song_id in dict.fromkeys(upcoming_ids) if song_id in songs_map]
+
+    needed, fetched = set(), 0
+    for song in upcoming:
+        if not song.get('contentHash') or not song.get('filename'):
+            continue
+        content_hash, filename = song_playback_source(song)
+        if content_hash in needed:
+            continue
+        needed.add(content_hash)
+        if audio_cache.has(content_hash) or os.path.exists(os.path.join(SONGS_FOLDER, filename)):
+            warm_file(resolve_song_path(song))
+            continue
+        try:
+            extension = os.path.splitext(filename)[1] or '.mp3'
+            warm_file(audio_cache.fetch(content_hash, song_sources(content_hash, filename), extension,
+                                        PEER_TIMEOUT, on_download=count_download))
+            fetched += 1
+            logging.info(f"שיר הורד מראש למטמון: {song.get('name')} ({content_hash[:12]})")
+        except Exception as e:
+            logging.error(f"שגיאה בהורדת השיר {song.get('name')} למטמון: {e}")
+
+    audio_cache.evict(protected=needed)
+    if fetched:
+        bell_scheduler.wake()
+    return fetched
+
+# --- הפצה בין רסיברים (ראה distribution.py) ---
+# המקורות שהשרת שלח ב-Webhook האחרון (שכנים בעץ ההפצה, מההורה ומעלה);
+# ריק - מורידים מהשרת בלבד. השרת תמיד המקור האחרון.
+_peer_sources = []
+_panic_downloads = {}   # שם קובץ פאניק -> Event של הורדה שרצה כרגע
 
-# הגדרת הג'ובים:
-schedule.every(5).seconds.do(panic_listener_job)
-schedule.every(1).minutes.do(events_scheduler_job)
+def update_peer_sources(sources):
+    """הודעה בלי sources (מצב P2P כבוי בשרת) מחזירה להורדה מהשרת בלבד."""
+    _peer_sources[:] = [str(source).rstrip('/') for source in sources] if isinstance(sources, list) else []
+
+def download_sources(peer_path, server_path):
+    return [f"{peer}{peer_path}" for peer in _peer_sources] + [f"{SERVER_URL}{server_path}"]
+
+def song_sources(content_hash, filename):
+    return download_sources(f"/api/peer/audio/{content_hash}?name={filename}", f"/api/song_file/{filename}")
+
+def count_download(url):
+    AUDIO_DOWNLOADS.inc(source='server' if url.startswith(SERVER_URL) else 'peer')
+
+def download_panic_file(filename, content_hash=None):
+    """
+    מוריד קובץ פאניק לתיקיית הפאניק (משכן או מהשרת, דרך קובץ .part כדי שהליסנר לא
+    יראה קובץ חלקי). הורדה אחת לכל קובץ: קריאה נוספת מחכה לה. מחזיר את הנתיב או None.
+    """
+    file_path = os.path.join(PANIC_FOLDER, filename)
+    with _panic_lock:
+        pending = _panic_downloads.get(filename)
+        if pending is None:
+            _panic_downloads[filename] = threading.Event()
+    if pending is not None:
+        pending.wait(FETCH_WAIT_SECONDS)
+        return file_path if os.path.exists(file_path) else None
+    try:
+        source = download(download_sources(f"/api/peer/panic/{filename}", f"/api/song_file/{filename}"),
+                          file_path, content_hash, PEER_TIMEOUT)
+        count_download(source)
+        return file_path
+    finally:
+        with _panic_lock:
+            _panic_downloads.pop(filename).set()
+
+def fetch_panic_file(filename, content_hash=None):
+    """מוריד קובץ פאניק שהשרת הודיע עליו ומכניס אותו לתור הניגון."""
+    filename = secure_filename(filename)
+    try:
+        if download_panic_file(filename, content_hash):
+            logging.warning(f"קובץ פאניק התקבל: {filename}")
+            enqueue_panic_file(filename)
+    except Exception as e:
+        logging.error(f"שגיאה בהורדת קובץ פאניק {filename}: {e}")
 
 # --- API קוד Flask ---
+@app.route('/api/webhook_receive', methods=['POST'])
+def api_webhook_receive():
+    """מקבל הודעות מהשרת: עדכון קטלוג מעיר את הסנכרון, קריאת פאניק מורידה את הקובץ,
+    ושידור חי נכנס לתור הניגון."""
+    if not leader.is_leader:
+        # רק המוביל מסנכרן ומנגן; השרת ינסה שוב ויגיע אליו
+        return jsonify({'error': 'Not the playback process', 'leader': leader.holder_pid()}), 503
+    payload = request.get_json(silent=True) or {}
+    event_type = payload.get('type')
+    if event_type in DISTRIBUTED_TYPES:
+        update_peer_sources(payload.get('sources'))
+
+    if event_type in ('songs_update', 'events_update'):
+        _sync_wakeup.set()
+    elif event_type == 'panic_alert' and payload.get('filename'):
+        note_panic_origin(secure_filename(payload['filename']), payload.get('createdAt'))
+        threading.Thread(target=fetch_panic_file, args=(payload['filename'], payload.get('contentHash')),
+                         daemon=True).start()
+    elif event_type == 'panic_stream' and payload.get('streamId') and payload.get('url'):
+        note_panic_origin(payload['streamId'], payload.get('createdAt'))
+        enqueue_panic_stream(payload['streamId'], payload['url'])
+    else:
+        return jsonify({'error': f'Unknown webhook type: {event_type}'}), 400
+
+    return jsonify({'message': 'Accepted', 'type': event_type}), 200
+
+@app.route('/api/peer/audio/<content_hash>', methods=['GET'])
+def api_peer_audio(content_hash):
+    """
+    קובץ שיר לפי sha256, לרסיבר שכן. אם הוא עוד לא כאן, הרסיבר מוריד אותו בעצמו
+    מהמקורות שלו (name הוא שם הקובץ בשרת) ואז מגיש אותו - כך כל תת-עץ מוריד
+    מהשרת פעם אחת. הורדה שכבר רצה לא מתחילה שוב; השכן מחכה לה.
+    """
+    if not leader.is_leader:
+        return jsonify({'error': 'Not the playback process', 'leader': leader.holder_pid()}), 503
+    if not re.fullmatch(r'[0-9a-f]{64}', content_hash):
+        return jsonify({'error': 'File not found'}), 404
+    name = secure_filename(request.args.get('name', ''))
+    extension = os.path.splitext(name)[1] or '.mp3'
+    file_path = audio_cache.path_for(content_hash)
+    if not file_path and os.path.isfile(os.path.join(SONGS_FOLDER, content_filename(content_hash, extension))):
+        file_path = os.path.join(SONGS_FOLDER, content_filename(content_hash, extension))
+    if not file_path and name:
+        try:
+            file_path = audio_cache.fetch(content_hash, song_sources(content_hash, name), extension,
+                                          PEER_TIMEOUT, on_download=count_download)
+        except Exception as e:
+            logging.error(f"שגיאה בהורדת {content_hash[:12]} עבור רסיבר שכן: {e}")
+    if not file_path:
+        return jsonify({'error': 'File not found'}), 404
+    PEER_FILES_SERVED.inc(kind='song')
+    return send_file(os.path.abspath(file_path), conditional=True, max_age=0)
+
+@app.route('/api/peer/panic/<filename>', methods=['GET'])
+def api_peer_panic_file(filename):
+    """
+    קובץ פאניק לרסיבר שכן: רק אם הוא כבר כאן או בהורדה (מחכים לה). אחרת 404 והשכן
+    עובר למקור הבא - קובץ פאניק שהורד רק בשביל שכן היה מתנגן כאן בעלייה הבאה.
+    """
+    filename = secure_filename(filename)
+    with _panic_lock:
+        pending = _panic_downloads.get(filename)
+    if pending is not None:
+        pending.wait(PEER_TIMEOUT[1])
+    file_path = os.path.join(PANIC_FOLDER, filename)
+    if filename.endswith(('.part', '.txt')) or not os.path.isfile(file_path):
+        return jsonify({'error': 'File not found'}), 404
+    PEER_FILES_SERVED.inc(kind='panic')
+    return send_file(os.path.abspath(file_path), max_age=0)
+
+@app.route('/api/player', methods=['GET'])
+def api_player_status():
+    """מצב ערוצי הניגון: מספר ניגונים, כשלונות וזמני התחלה (ms)."""
+    return jsonify(playback.stats()), 200
+
+def collect_receiver_metrics():
+    """מעדכן את המדדים שנקראים ממצב קיים (נקרא בכל /api/metrics)."""
+    IS_LEADER.set(1 if leader.is_leader else 0)
+    for channel in (playback.bells, playback.announcements):
+        PLAYER_PLAYS.set_total(channel.plays, channel=channel.name)
+        PLAYER_FAILURES.set_total(channel.failures, channel=channel.name)
+        PLAYER_RESTARTS.set_total(channel.restarts, channel=channel.name)
+    PANIC_QUEUE_DEPTH.set(panic_queue.qsize())
+    AUDIO_CACHE_BYTES.set(audio_cache.total_bytes())
+    timetable = get_timetable()
+    SCHEDULED_BELLS.set(len(timetable['times']) - bisect.bisect_right(timetable['times'], time.time()))
+    SCHEDULE_UNTIL.set(timetable['until'])
+    SCHEDULE_FROM_SERVER.set(1 if timetable['source'] == 'server' else 0)
+    CLOCK_OFFSET.set(cached_ntp_offset(), source='ntp')
+
+metrics.add_collector(collect_receiver_metrics)
+
+@app.route('/api/metrics', methods=['GET'])
+def api_metrics():
+    """מדדי הרסיבר בפורמט Prometheus: איחור צלצולים, זמני התחלה, פאניק מקצה לקצה והפרשי שעון."""
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
 @app.route('/api/data', methods=['GET'])
 def api_get_all_data():
     songs = list_json_files(SONGS_FOLDER)
     events = list_json_files(EVENTS_FOLDER)
-    return jsonify({'songs': songs, 'events': events}), 200
+    calendar = list_json_files(CALENDAR_FOLDER)
+    return jsonify({'songs': songs, 'events': events, 'calendar': calendar}), 200
+
+# --- הפקת גרסאות ניגון לשירים מקומיים ברקע (כמו בשרת) ---
+# שיר שנשמר כאן (origin=local) נשמר מיד בלי גרסת ניגון ומתנגן מהמקור; ה-thread
+# של התהליך המוביל מפיק את הגרסה (ffmpeg, שניות ארוכות על Pi) ושומר רק את שדות
+# הגרסה, ורק אם השיר לא השתנה בינתיים. לשירים מהשרת הגרסה מגיעה מהשרת.
+RENDITION_POLL_SECONDS = 2
+_rendition_wakeup = threading.Event()
+# (מזהה שיר, renditionKey) שההפקה שלהם נכשלה; לא מנסים שוב עד שהשיר משתנה
+_failed_renditions = set()
+
+def clear_stale_rendition(song):
+    """מסיר משיר גרסת ניגון שכבר לא מתאימה למקור/לחיתוך (לפני שמירה)."""
+    if song.get('renditionKey') != rendition_key(song):
+        for field in RENDITION_FIELDS:
+            song.pop(field, None)
+    return song
+
+def backfill_local_renditions():
+    """מפיק גרסאות ניגון לשירים המקומיים שאין להם גרסה מתאימה."""
+    for song in list_json_files(SONGS_FOLDER):
+        if song.get('origin') != LOCAL_ORIGIN:
+            continue
+        attempt = (str(song['id']), rendition_key(song))
+        if song.get('renditionKey') == attempt[1] or attempt in _failed_renditions:
+            continue
+        song = dict(song)
+        update_song_rendition(song, SONGS_FOLDER)
+        if song.get('renditionKey') != attempt[1]:
+            _failed_renditions.add(attempt)
+            continue
+        # השיר אולי נערך בזמן ההפקה: שומרים רק את שדות הגרסה, ורק אם היא עדיין מתאימה
+        current = get_item_by_id(SONGS_FOLDER, song['id'])
+        if not current or rendition_key(current) != attempt[1]:
+            continue
+        current = dict(current)
+        for field in RENDITION_FIELDS:
+            current[field] = song[field]
+        save_json_file(SONGS_FOLDER, current, current['id'])
+
+def run_rendition_worker():
+    """לולאת המוביל: מפיק גרסאות לכל שינוי בקטלוג השירים."""
+    songs_catalog = get_catalog(SONGS_FOLDER)
+    seen_version = None
+    while True:
+        songs_catalog.refresh()
+        if songs_catalog.version != seen_version:
+            seen_version = songs_catalog.version
+            try:
+                backfill_local_renditions()
+            except Exception as e:
+                logging.error(f"שגיאה בהפקת גרסאות ניגון: {e}")
+        _rendition_wakeup.wait(RENDITION_POLL_SECONDS)
+        _rendition_wakeup.clear()
 
 @app.route('/api/songs', methods=['POST'])
 def api_save_song():
     try:
-        metadata_str = request.form.get('metadata')
-        if not metadata_str: return jsonify({'error': 'Missing song metadata'}), 400
-        metadata = json.loads(metadata_str)
-        file = request.files.get('file')
+        if (request.content_length or 0) > MAX_SONG_BYTES + MULTIPART_OVERHEAD_BYTES:
+            return jsonify({'error': f'File too large (limit {MAX_SONG_BYTES} bytes)'}), 413
+        # JSON: הקובץ כבר הועלה בחלקים (uploadId); טופס: העלאה ישנה ב-multipart
+        if request.is_json:
+            metadata = request.get_json(silent=True) or {}
+            file = None
+        else:
+            metadata_str = request.form.get('metadata')
+            if not metadata_str: return jsonify({'error': 'Missing song metadata'}), 400
+            metadata = json.loads(metadata_str)
+            file = request.files.get('file')
+        upload_id = metadata.pop('uploadId', None)
         is_edit_mode = 'id' in metadata
         existing_song = get_item_by_id(SONGS_FOLDER, metadata['id']) if is_edit_mode else None
 
-        if file and file.filename and file.filename != 'no_change.txt':
-            if is_edit_mode and existing_song and existing_song.get('filename'):
-                 old_file_path = os.path.join(SONGS_FOLDER, existing_song['filename'])
-                 if os.path.exists(old_file_path): os.remove(old_file_path)
-                     
-            unique_filename = upload_and_save_file(file, SONGS_FOLDER, file.filename)
-            metadata['filename'] = unique_filename
-            metadata['url'] = f'/api/song_file/{unique_filename}'
+        # קובץ קודם שהוחלף לא נמחק כאן: הוא עשוי להיות משותף, ו-media_gc אוסף אותו כשאין אליו הפניה
+        if upload_id:
+            upload = upload_store.consume(upload_id, 'song')
+            metadata['filename'] = upload['filename']
+            metadata['url'] = f"/api/song_file/{upload['filename']}"
+            metadata['contentHash'] = upload['contentHash']
+        elif file and file.filename and file.filename != 'no_change.txt':
+            check_multipart_upload(file, MAX_SONG_BYTES)
+            song_filename, content_hash = save_song_file(file, file.filename)
+            metadata['filename'] = song_filename
+            metadata['url'] = f'/api/song_file/{song_filename}'
+            metadata['contentHash'] = content_hash
         elif is_edit_mode and existing_song:
             metadata['filename'] = existing_song.get('filename')
             metadata['url'] = existing_song.get('url')
+            metadata['contentHash'] = existing_song.get('contentHash')
         elif not is_edit_mode and not file:
              return jsonify({'error': 'New song requires a file'}), 400
 
+        # גרסת הניגון (חיתוך לפי clipStart/clipEnd) מופקת ברקע; גרסה קיימת נשמרת רק אם עדיין מתאימה
+        if existing_song:
+            for field in RENDITION_FIELDS:
+                if field in existing_song:
+                    metadata.setdefault(field, existing_song[field])
+        clear_stale_rendition(metadata)
+
+        metadata['origin'] = LOCAL_ORIGIN
         song_data = save_json_file(SONGS_FOLDER, metadata, metadata.get('id'))
+        _rendition_wakeup.set()
         return jsonify(song_data), 200
-        
+
+    except UploadError as e:
+        return jsonify({'error': e.message}), e.status
     except Exception as e:
         logging.error(f"שגיאה בשמירת שיר: {e}")
         return jsonify({'error': f'Server error: {str(e)}'}), 500
@@ -265,53 +1042,135 @@ def api_delete_song(song_id):
     song_to_delete = get_item_by_id(SONGS_FOLDER, song_id)
     if song_to_delete:
         delete_json_file(SONGS_FOLDER, song_id)
-        audio_filename = song_to_delete.get('filename')
-        if audio_filename:
-            audio_filepath = os.path.join(SONGS_FOLDER, audio_filename)
-            if os.path.exists(audio_filepath): os.remove(audio_filepath)
+        # הקבצים עשויים להיות משותפים לשירים אחרים; media_gc מוחק אותם כשאין אליהם הפניה
+        media_gc.wake()
         return jsonify({'message': 'Song deleted'}), 200
     return jsonify({'error': 'Song not found'}), 404
     
 @app.route('/api/song_file/<filename>', methods=['GET'])
 def api_get_song_file(filename):
     filepath = os.path.join(SONGS_FOLDER, filename)
-    if os.path.exists(filepath): return send_file(filepath)
+    if os.path.exists(filepath): return send_file(os.path.abspath(filepath))
     return jsonify({'error': 'File not found'}), 404
 
 @app.route('/api/panic', methods=['POST'])
 def api_handle_panic():
     try:
+        if (request.content_length or 0) > MAX_PANIC_BYTES + MULTIPART_OVERHEAD_BYTES:
+            return jsonify({'error': f'File too large (limit {MAX_PANIC_BYTES} bytes)'}), 413
         file = request.files.get('file')
         if not file or not file.filename: return jsonify({'error': 'No audio file provided'}), 400
-        
+        if not leader.is_leader:
+            return jsonify({'error': 'Not the playback process', 'leader': leader.holder_pid()}), 503
+        check_multipart_upload(file, MAX_PANIC_BYTES)
+
         unique_filename = upload_and_save_file(file, PANIC_FOLDER, file.filename)
-        
-        logging.info(f"קריאת פאניקה נשמרה בנתיב: {os.path.join(PANIC_FOLDER, unique_filename)}")
-        
+        queue_local_panic_file(unique_filename, time.time())
+
         return jsonify({
-            'message': 'Panic recording saved, listener will play soon',
+            'message': 'Panic recording saved and queued for playback',
             'filename': unique_filename
         }), 200
 
+    except UploadError as e:
+        return jsonify({'error': e.message}), e.status
     except Exception as e:
         logging.error(f"שגיאה בטיפול בקריאת פאניקה: {e}")
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
+def queue_local_panic_file(filename, created_at):
+    logging.info(f"קריאת פאניקה נשמרה בנתיב: {os.path.join(PANIC_FOLDER, filename)}")
+    _panic_origins[filename] = created_at
+    enqueue_panic_file(filename)
+
+# --- העלאות בחלקים שאפשר לחדש (ראה uploads.py; אותו פרוטוקול כמו בשרת) ---
+UPLOADS_STATE_FOLDER = os.path.join(app.config['UPLOAD_FOLDER'], 'uploads')
+upload_store = UploadStore(UPLOADS_STATE_FOLDER, {
+    'song': (SONGS_FOLDER, MAX_SONG_BYTES),
+    'panic': (PANIC_FOLDER, MAX_PANIC_BYTES),
+}, content_kinds=('song',))
+
+def upload_response(state, status_code=200):
+    status = upload_store.status(state)
+    response = jsonify(status)
+    response.status_code = status_code
+    response.headers['Upload-Offset'] = str(status['offset'])
+    response.headers['Upload-Length'] = str(state['size'])
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/api/uploads', methods=['POST'])
+def api_create_upload():
+    """פותח העלאה: {"kind": "song"|"panic", "filename", "size"}. גודל וסוג נבדקים כאן."""
+    data = request.get_json(silent=True) or {}
+    if data.get('kind') == 'panic' and not leader.is_leader:
+        return jsonify({'error': 'Not the playback process', 'leader': leader.holder_pid()}), 503
+    try:
+        state = upload_store.create(data.get('kind'), data.get('filename'), data.get('size'))
+    except UploadError as e:
+        return jsonify({'error': e.message}), e.status
+    response = upload_response(state, 201)
+    response.headers['Location'] = f"/api/uploads/{state['id']}"
+    return response
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def api_get_upload(upload_id):
+    """מצב ההעלאה (גם ב-HEAD): Upload-Offset הוא הבית הבא שהרסיבר מצפה לו."""
+    try:
+        return upload_response(upload_store.get(upload_id))
+    except UploadError as e:
+        return jsonify({'error': e.message}), e.status
+
+@app.route('/api/uploads/<upload_id>', methods=['PATCH'])
+def api_append_upload(upload_id):
+    """כותב חלק בהיסט Upload-Offset ישר לקובץ היעד; הקלטת פאניק שהושלמה נכנסת לתור מיד."""
+    offset = request.headers.get('Upload-Offset', type=int)
+    if offset is None:
+        return jsonify({'error': 'Upload-Offset header is required'}), 400
+    try:
+        state = upload_store.append(upload_id, offset, request.stream, request.content_length)
+        if state.get('complete') and state['kind'] == 'panic':
+            upload_store.consume(upload_id, 'panic')
+            queue_local_panic_file(state['filename'], state['completedAt'])
+    except UploadError as e:
+        return jsonify({'error': e.message}), e.status
+    return upload_response(state)
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def api_cancel_upload(upload_id):
+    try:
+        upload_store.cancel(upload_id)
+    except UploadError as e:
+        return jsonify({'error': e.message}), e.status
+    return jsonify({'message': 'Upload cancelled'}), 200
+
+# --- איסוף קבצי שירים מקומיים שאין אליהם הפניה (ראה content_store.py) ---
+def referenced_song_files():
+    return (set(reference_counts(list_json_files(SONGS_FOLDER)))
+            | quarantined_references(os.path.join(SONGS_FOLDER, QUARANTINE_FOLDER))
+            | upload_store.pending_files('song'))
+
+media_gc = GarbageCollector(SONGS_FOLDER, referenced_song_files)
+
 @app.route('/api/event', methods=['POST'])
 def api_create_event():
     data = request.json
-    if not data.get('name') or not data.get('time') or not data.get('songId'):
-        return jsonify({'error': 'Missing required fields'}), 400
+    error = validate_event(data)
+    if error:
+        return jsonify({'error': error}), 400
+    data['origin'] = LOCAL_ORIGIN
     event = save_json_file(EVENTS_FOLDER, data)
     return jsonify(event), 201
 
 @app.route('/api/event/<event_id>', methods=['PUT'])
 def api_update_event(event_id):
     data = request.json
-    if not data.get('name') or not data.get('time') or not data.get('songId'):
-        return jsonify({'error': 'Missing required fields'}), 400
+    error = validate_event(data)
+    if error:
+        return jsonify({'error': error}), 400
         
     data['id'] = event_id
+    data['origin'] = LOCAL_ORIGIN
     event = save_json_file(EVENTS_FOLDER, data, event_id)
     return jsonify(event), 200
 
@@ -321,17 +1180,60 @@ def api_delete_event(event_id):
         return jsonify({'message': 'Event deleted'}), 200
     return jsonify({'error': 'Event not found'}), 404
 
+@app.route('/api/calendar', methods=['GET'])
+def api_list_calendar():
+    return jsonify(list_json_files(CALENDAR_FOLDER)), 200
+
+@app.route('/api/schedule', methods=['GET'])
+def api_get_schedule():
+    """הצלצולים הבאים לפי הלוח שהרסיבר מנגן כרגע, והאם הוא מהשרת או מקומפל כאן."""
+    timetable = get_timetable()
+    start = bisect.bisect_right(timetable['times'], time.time())
+    entries = [{key: value for key, value in entry.items() if key != 'file_path'}
+               for entry in timetable['entries'][start:]]
+    return jsonify({'source': timetable['source'], 'until': timetable['until'], 'entries': entries}), 200
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
 
-if __name__ == '__main__':
+# --- הפעלה ---
+# תזמון הצלצולים, הניגון והסנכרון חייבים לרוץ בתהליך אחד בלבד, גם תחת gunicorn
+# עם כמה workers: התהליך שמחזיק ב-storage/leader.lock מפעיל אותם (ראה leader.py).
+# מומלץ להריץ את הרסיבר עם worker אחד (WEB_CONCURRENCY=1, ראה gunicorn.conf.py).
+leader = LeaderLock(os.path.join(app.config['UPLOAD_FOLDER'], 'leader.lock'))
+
+def start_receiver_services():
+    """מפעיל את הנגן, תור הפאניק, תזמון הצלצולים, הסנכרון מול השרת ואיסוף הקבצים."""
     logging.info('מפעיל את מנהל הלו"ז והליסנרים בחוט נפרד...')
-    
-    t = threading.Thread(target=run_schedule_continuously)
+
+    playback.start()
+
+    t = threading.Thread(target=run_panic_worker, name='panic-player')
     t.daemon = True
     t.start()
-    
-port = int(os.environ.get("PORT", 8000))
-app.run(host='0.0.0.0', port=port, debug=True, use_reloader=False)
+    recover_pending_panic_files()
+
+    bells_thread = threading.Thread(target=bell_scheduler.run, name='bell-scheduler')
+    bells_thread.daemon = True
+    bells_thread.start()
+
+    sync_thread = threading.Thread(target=run_sync_loop, name='server-sync')
+    sync_thread.daemon = True
+    sync_thread.start()
+
+    media_gc.start()
+
+    renditions_thread = threading.Thread(target=run_rendition_worker, name='song-renditions')
+    renditions_thread.daemon = True
+    renditions_thread.start()
+
+def create_app():
+    """נקודת הכניסה ל-gunicorn: gunicorn -c gunicorn.conf.py 'app1:create_app()'"""
+    leader.start(start_receiver_services)
+    return app
+
+if __name__ == '__main__':
+    port = int(os.environ.get("PORT", 8000))
+    create_app().run(host='0.0.0.0', port=port, debug=True, use_reloader=False)
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+מטמון קבצי אודיו מקומי לרסיבר (Raspberry Pi).
+
+הקבצים נשמרים לפי טביעת האצבע (sha256) של התוכן, כך ששיר ששמו שונה
+או שהועלה מחדש עם אותו תוכן לא יורד פעמיים. המטמון מוגבל בגודל,
+ומפנה קודם את הקבצים שלא נוגנו הכי הרבה זמן (LRU), חוץ מקבצים
+שאירועים עתידיים עדיין צריכים.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import requests
+
+# גודל מקסימלי למטמון בכרטיס ה-SD (ניתן לשנות דרך משתנה סביבה)
+CACHE_MAX_BYTES = int(os.environ.get('RINGER_CACHE_MAX_MB', '512')) * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# כמה זמן קריאה שנייה לאותו תוכן מחכה להורדה שכבר רצה
+FETCH_WAIT_SECONDS = 120
+
+
+def file_sha256(path):
+    """sha256 של קובץ (hex), בקריאה בחלקים."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def download(urls, dest_path, expected_hash=None, timeout=(3, 60)):
+    """
+    מוריד ל-dest_path מהכתובת הראשונה ב-urls שמצליחה (דרך קובץ .part, כך שאף אחד
+    לא רואה קובץ חלקי). אם expected_hash נתון, תוכן עם sha256 אחר נדחה והמקור הבא
+    נוסה. מחזיר את הכתובת שממנה הקובץ הגיע; אם כל המקורות נכשלו - זורק את השגיאה האחרונה.
+    """
+    if isinstance(urls, str):
+        urls = [urls]
+    tmp_path = dest_path + '.part'
+    error = ValueError('No download sources')
+    for url in urls:
+        digest = hashlib.sha256()
+        try:
+            with requests.get(url, stream=True, timeout=timeout) as response:
+                response.raise_for_status()
+                with open(tmp_path, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        digest.update(chunk)
+                        f.write(chunk)
+            if expected_hash and digest.hexdigest() != expected_hash:
+                raise ValueError(f"sha256 mismatch for {url}")
+            os.replace(tmp_path, dest_path)
+            return url
+        except Exception as e:
+            error = e
+            if len(urls) > 1:
+                logging.warning(f"הורדה מ-{url} נכשלה ({e}); מנסה את המקור הבא.")
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    raise error
+
+
+class AudioCache:
+    """מטמון מבוסס תוכן: קובץ <hash><סיומת> לכל תוכן, עם אינדקס LRU ב-index.json."""
+
+    def __init__(self, folder, max_bytes=CACHE_MAX_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.version = 0
+        self._index_path = os.path.join(folder, 'index.json')
+        self._entries = {}   # hash -> {'filename', 'size', 'last_used'}
+        self._inflight = {}  # hash -> Event של הורדה שרצה כרגע
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+        self._load()
+
+    # --- אינדקס ---
+    def _load(self):
+        try:
+            with open(self._index_path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except (FileNotFoundError, ValueError):
+            saved = {}
+
+        for entry in os.scandir(self.folder):
+            if entry.name.endswith('.part'):
+                os.remove(entry.path)
+                continue
+            if entry.name == 'index.json' or not entry.is_file():
+                continue
+            content_hash = os.path.splitext(entry.name)[0]
+            last_used = saved.get(content_hash, {}).get('last_used', entry.stat().st_mtime)
+            self._entries[content_hash] = {
+                'filename': entry.name,
+                'size': entry.stat().st_size,
+                'last_used': last_used,
+            }
+
+    def _save_index(self):
+        tmp_path = self._index_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_path, self._index_path)
+
+    def total_bytes(self):
+        with self._lock:
+            return sum(e['size'] for e in self._entries.values())
+
+    # --- קריאה ---
+    def has(self, content_hash):
+        with self._lock:
+            return content_hash in self._entries
+
+    def path_for(self, content_hash, touch=False):
+        """הנתיב המקומי של התוכן, או None אם הוא לא במטמון."""
+        with self._lock:
+            entry = self._entries.get(content_hash)
+            if entry is None:
+                return None
+            if touch:
+                entry['last_used'] = time.time()
+            return os.path.join(self.folder, entry['filename'])
+
+    def touch(self, path):
+        """מעדכן את זמן השימוש האחרון של קובץ מהמטמון (נקרא בזמן ניגון)."""
+        content_hash = os.path.splitext(os.path.basename(path))[0]
+        with self._lock:
+            if content_hash in self._entries:
+                self._entries[content_hash]['last_used'] = time.time()
+                self._save_index()
+
+    # --- הורדה ---
+    def fetch(self, content_hash, urls, extension='.mp3', timeout=(3, 60), on_download=None):
+        """
+        מוריד את התוכן מהמקור הראשון ב-urls (כתובת או רשימה לפי סדר עדיפות) שמצליח,
+        מוודא את ה-sha256 שלו ומכניס למטמון. מחזיר את הנתיב. קריאה נוספת לאותו תוכן
+        בזמן שההורדה רצה מחכה לה במקום להוריד שוב. on_download(url) נקרא אחרי הורדה.
+        """
+        existing = self.path_for(content_hash)
+        if existing:
+            return existing
+
+        with self._lock:
+            pending = self._inflight.get(content_hash)
+            if pending is None:
+                self._inflight[content_hash] = threading.Event()
+        if pending is not None:
+            pending.wait(FETCH_WAIT_SECONDS)
+            existing = self.path_for(content_hash)
+            if existing:
+                return existing
+            raise LookupError(f"Concurrent download of {content_hash[:12]} did not complete")
+
+        filename = f"{content_hash}{extension}"
+        file_path = os.path.join(self.folder, filename)
+        try:
+            source = download(urls, file_path, content_hash, timeout)
+            self._add(content_hash, filename, file_path)
+        finally:
+            with self._lock:
+                self._inflight.pop(content_hash).set()
+        if on_download:
+            on_download(source)
+        return file_path
+
+    def _add(self, content_hash, filename, file_path):
+        with self._lock:
+            self._entries[content_hash] = {
+                'filename': filename,
+                'size': os.path.getsize(file_path),
+                'last_used': time.time(),
+            }
+            self.version += 1
+            self._save_index()
+
+    # --- פינוי ---
+    def evict(self, protected=()):
+        """מפנה קבצים לפי LRU עד שהמטמון בגבול הגודל. קבצים ב-protected לא מפונים."""
+        protected = set(protected)
+        removed = 0
+        with self._lock:
+            total = sum(e['size'] for e in self._entries.values())
+            candidates = sorted(
+                (h for h in self._entries if h not in protected),
+                key=lambda h: self._entries[h]['last_used'])
+            for content_hash in candidates:
+                if total <= self.max_bytes:
+                    break
+                entry = self._entries.pop(content_hash)
+                try:
+                    os.remove(os.path.join(self.folder, entry['filename']))
+                except FileNotFoundError:
+                    pass
+                total -= entry['size']
+                removed += 1
+            if removed:
+                self.version += 1
+                self._save_index()
+        if total > self.max_bytes:
+            logging.warning(f"מטמון האודיו ({total // (1024 * 1024)}MB) חורג מהגבול גם אחרי פינוי: כל הקבצים נדרשים לאירועים.")
+        return removed
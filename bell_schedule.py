@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""
+לוח צלצולים מחושב מראש: כללי חזרה, טווחי תאריכים, תאריכי חריגה ופרופילים.
+
+אירוע (קטלוג events) - כל השדות מעבר ל-name/time/songId אופציונליים, כך
+שאירוע ישן {day, time, songId} ממשיך לצלצל כל שבוע כמו קודם:
+    day / days        - יום או רשימת ימים בשבוע (שמות עבריים, DAYS_MAP)
+    time              - HH:MM
+    every             - כל כמה שבועות (ברירת מחדל 1), נספר מהשבוע של startDate
+    startDate/endDate - טווח התאריכים (YYYY-MM-DD, כולל) שבו האירוע בתוקף
+    exceptDates       - תאריכים שבהם האירוע לא מצלצל
+    profile           - מערכת השעות שהאירוע שייך לה (ברירת מחדל DEFAULT_PROFILE)
+
+לוח שנה (קטלוג calendar) - רשומות שקובעות איזה פרופיל פעיל בתאריכים מסוימים:
+    profile           - שם הפרופיל, או null ליום בלי צלצולים (חג, חופשה)
+    date              - תאריך בודד, או startDate/endDate לטווח (בלי תאריכים = תמיד)
+    days              - אופציונלי: רק בימים האלה בשבוע (למשל שישי קצר)
+    name              - תיאור לתצוגה
+בכל תאריך קובעת הרשומה המתאימה עם הטווח הקצר ביותר (יום בודד גובר על טווח,
+טווח גובר על רשומה בלי תאריכים); תאריך בלי רשומה מתאימה - DEFAULT_PROFILE.
+
+השרת מקמפל את הכללים לרשימה שטוחה וממוינת של זמני צלצול ל-SCHEDULE_DAYS
+הימים הקרובים (compile_schedule) ושולח אותה לרסיברים, שרק הולכים עליה לפי
+הסדר. הזמנים הם לפי השעון המקומי, כמו קודם: ה-at שהשרת מחשב הוא לפי אזור
+הזמן שלו (שיכול להיות UTC, למשל ב-docker), ולכן הרסיבר מחשב אותו מחדש
+מ-date ו-time לפי אזור הזמן שלו (localize_schedule).
+
+(השם bell_schedule ולא schedule: מודול בשם schedule מסתיר את חבילת schedule מ-PyPI.)
+"""
+import logging
+import os
+from datetime import date, datetime, timedelta
+
+# יום שני הוא 0, ראשון הוא 6 (כמו datetime.weekday()).
+# [0:שני, 1:שלישי, 2:רביעי, 3:חמישי, 4:שישי, 5:שבת, 6:ראשון]
+DAYS_MAP = ['שני', 'שלישי', 'רביעי', 'חמישי', 'שישי', 'שבת', 'ראשון']
+DEFAULT_PROFILE = 'רגיל'
+SCHEDULE_DAYS = int(os.environ.get('RINGER_SCHEDULE_DAYS', '14'))
+MAX_SCHEDULE_DAYS = 60
+# רשומת לוח שנה בלי תאריכים מפסידה לכל רשומה עם טווח
+_UNBOUNDED_SPAN = 10 ** 6
+
+
+def parse_date(value):
+    """date מ-YYYY-MM-DD, או None אם אין ערך. ValueError אם הערך לא תקין."""
+    if value in (None, ''):
+        return None
+    return date.fromisoformat(str(value))
+
+
+def parse_time(value):
+    """(שעה, דקה) מ-HH:MM. ValueError אם הערך לא תקין."""
+    hour, minute = (int(part) for part in str(value or '').split(':'))
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        raise ValueError(f'Invalid time: {value}')
+    return hour, minute
+
+
+def local_timestamp(day, time_of_day):
+    """epoch של YYYY-MM-DD ו-HH:MM לפי אזור הזמן המקומי."""
+    value = parse_date(day) if isinstance(day, str) else day
+    hour, minute = parse_time(time_of_day) if isinstance(time_of_day, str) else time_of_day
+    return datetime(value.year, value.month, value.day, hour, minute).timestamp()
+
+
+def parse_weekdays(record):
+    """
+    קבוצת מספרי הימים מ-days (רשימה) או day (יום בודד). ValueError על שם לא
+    מוכר, או על days שאינו מחרוזת או רשימת מחרוזות (למשל רשומה שנערכה ידנית).
+    """
+    days = record.get('days')
+    if days is None:
+        days = [record['day']] if record.get('day') else []
+    if isinstance(days, str):
+        days = [days]
+    if not isinstance(days, list) or not all(isinstance(day, str) for day in days):
+        raise ValueError(f'Invalid days: {days!r}')
+    return {DAYS_MAP.index(day) for day in days}
+
+
+def _date_range(record):
+    """(התחלה, סוף) של רשומה עם date או startDate/endDate; כל צד יכול להיות None."""
+    if record.get('date'):
+        single = parse_date(record['date'])
+        return single, single
+    return parse_date(record.get('startDate')), parse_date(record.get('endDate'))
+
+
+def _check_range(record):
+    start, end = _date_range(record)
+    if start and end and end < start:
+        return 'endDate is before startDate'
+    return None
+
+
+def validate_event_rule(event):
+    """בודק את שדות התזמון של אירוע. מחזיר הודעת שגיאה או None."""
+    try:
+        parse_time(event.get('time'))
+    except ValueError:
+        return 'Invalid day or time'
+    if event.get('days') is None and not event.get('day'):
+        return 'Missing day or days'
+    try:
+        if not parse_weekdays(event):
+            return 'Invalid day or time'
+    except ValueError:
+        return 'Invalid day or time'
+    try:
+        error = _check_range(event)
+        excepted = event.get('exceptDates') or []
+        if not isinstance(excepted, list):
+            return 'exceptDates must be a list of YYYY-MM-DD dates'
+        for value in excepted:
+            parse_date(value)
+    except ValueError:
+        return 'Dates must be YYYY-MM-DD'
+    if error:
+        return error
+    every = event.get('every', 1)
+    if not isinstance(every, int) or isinstance(every, bool) or every < 1:
+        return 'every must be a positive number of weeks'
+    if every > 1 and not event.get('startDate'):
+        return 'every requires startDate'
+    if event.get('profile') is not None and not isinstance(event.get('profile'), str):
+        return 'profile must be a string'
+    return None
+
+
+def validate_calendar_entry(entry):
+    """בודק רשומת לוח שנה. מחזיר הודעת שגיאה או None."""
+    if not entry:
+        return 'Missing required fields'
+    if 'profile' not in entry:
+        return 'Missing profile (use null for a day without bells)'
+    if entry['profile'] is not None and not isinstance(entry['profile'], str):
+        return 'profile must be a string or null'
+    try:
+        error = _check_range(entry)
+    except ValueError:
+        return 'Dates must be YYYY-MM-DD'
+    if error:
+        return error
+    try:
+        if entry.get('days') is not None and not parse_weekdays(entry):
+            return 'days must not be empty'
+    except ValueError:
+        return 'Invalid day'
+    return None
+
+
+class _CompiledCalendar:
+    """רשומות לוח השנה אחרי פענוח, מהספציפית (טווח קצר) לכללית."""
+
+    def __init__(self, calendar):
+        self.entries = []
+        for entry in calendar:
+            if validate_calendar_entry(entry):
+                continue
+            start, end = _date_range(entry)
+            span = (end - start).days if start and end else _UNBOUNDED_SPAN
+            weekdays = parse_weekdays(entry) if entry.get('days') is not None else None
+            self.entries.append((span, str(entry.get('id', '')), start, end, weekdays, entry['profile']))
+        self.entries.sort(key=lambda item: (item[0], item[1]))
+
+    def profile_for(self, day):
+        for _, _, start, end, weekdays, profile in self.entries:
+            if start and day < start or end and day > end:
+                continue
+            if weekdays is not None and day.weekday() not in weekdays:
+                continue
+            return profile
+        return DEFAULT_PROFILE
+
+
+class _CompiledEvent:
+    def __init__(self, event):
+        self.event = event
+        self.hour, self.minute = parse_time(event.get('time'))
+        self.weekdays = parse_weekdays(event)
+        self.start, self.end = _date_range({'startDate': event.get('startDate'), 'endDate': event.get('endDate')})
+        self.every = event.get('every') or 1
+        self.excepted = {parse_date(value) for value in event.get('exceptDates') or []}
+        self.profile = event.get('profile') or DEFAULT_PROFILE
+
+    def fires_on(self, day, profile):
+        if profile != self.profile or day.weekday() not in self.weekdays or day in self.excepted:
+            return False
+        if self.start and day < self.start or self.end and day > self.end:
+            return False
+        if self.every > 1:
+            anchor = self.start - timedelta(days=self.start.weekday())
+            if ((day - anchor).days // 7) % self.every:
+                return False
+        return True
+
+
+def compile_schedule(events, calendar, start_date, days=SCHEDULE_DAYS):
+    """
+    רשימת הצלצולים מ-start_date (כולל) ל-days ימים, ממוינת לפי זמן:
+    [{at (epoch), date, time, profile, eventId, songId, name}].
+    אירועים לא תקינים מדולגים ונרשמים ביומן עם הסיבה (למשל אירוע בלי day ובלי
+    days). מחזיר (רשימה, מזהים שדולגו).
+    """
+    compiled, invalid = [], []
+    for event in events:
+        error = validate_event_rule(event)
+        if error:
+            invalid.append((str(event.get('id')), error))
+            continue
+        compiled.append(_CompiledEvent(event))
+    if invalid:
+        logging.warning("אירועים לא תקינים דולגו בלוח הצלצולים: "
+                        + ', '.join(f"{event_id} ({error})" for event_id, error in invalid))
+    profiles = _CompiledCalendar(calendar)
+
+    entries = []
+    for offset in range(days):
+        day = start_date + timedelta(days=offset)
+        profile = profiles.profile_for(day)
+        if profile is None:
+            continue
+        for rule in compiled:
+            if not rule.fires_on(day, profile):
+                continue
+            entries.append({
+                'at': local_timestamp(day, (rule.hour, rule.minute)),
+                'date': day.isoformat(),
+                'time': f"{rule.hour:02d}:{rule.minute:02d}",
+                'profile': profile,
+                'eventId': str(rule.event.get('id')),
+                'songId': str(rule.event.get('songId')),
+                'name': rule.event.get('name', 'לא ידוע'),
+            })
+    entries.sort(key=lambda entry: (entry['at'], entry['eventId']))
+    return entries, [event_id for event_id, _ in invalid]
+
+
+def schedule_until(start_date, days):
+    """epoch של סוף החלון שקומפל (חצות שאחרי היום האחרון)."""
+    end = start_date + timedelta(days=days)
+    return datetime(end.year, end.month, end.day).timestamp()
+
+
+def localize_schedule(schedule):
+    """
+    לוח שקומפל במקום אחר, עם at ו-until מחושבים מחדש לפי אזור הזמן המקומי
+    (ראה תיאור המודול). צלצולים לא תקינים מדולגים; ValueError אם הלוח עצמו לא תקין.
+    """
+    try:
+        start_date, days = parse_date(schedule['from']), int(schedule['days'])
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f'Invalid schedule: {e}')
+    entries, invalid = [], 0
+    for entry in schedule.get('entries') or []:
+        try:
+            entries.append(dict(entry, at=local_timestamp(entry['date'], entry['time'])))
+        except (KeyError, TypeError, ValueError):
+            invalid += 1
+    if invalid:
+        logging.warning(f"{invalid} צלצולים לא תקינים דולגו בלוח שהתקבל.")
+    entries.sort(key=lambda entry: (entry['at'], str(entry.get('eventId'))))
+    return dict(schedule, entries=entries, until=schedule_until(start_date, days))
@@ -0,0 +1,447 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks למסלולים החמים של השרת והרסיבר, עם רסיברים ונגן מדומים.
+
+    python benchmarks/run.py                       # כל הסוויטה
+    python benchmarks/run.py --quick               # גרסה מקוצרת (דקה-שתיים)
+    python benchmarks/run.py --only data,fanout    # רק חלק מה-benchmarks
+    python benchmarks/run.py --output new.jsonl --baseline old.jsonl
+
+data      - זמן תגובה של /api/data (מלא ו-304) מול גודל הקטלוג
+fanout    - notify_receivers: זמן הרישום ביומן, סבב שליחה ראשון לכל הרסיברים
+            ומסירה מלאה, מול מספר רסיברים ושיעור כשלונות
+song_file - תפוקת /api/song_file תחת הורדות מקבילות
+scheduler - איחור (jitter) של BellScheduler ב-app1.py וזמן ההתחלה של הנגן,
+            עם ובלי עומס CPU ברקע
+
+כל מקרה רץ בתהליך נפרד עם תיקיית storage זמנית משלו; השרת רץ תחת gunicorn
+עם gunicorn.conf.py כמו בייצור. התוצאות נכתבות כ-JSON lines (שורה לכל
+מקרה, ערכים במילישניות/MB לשנייה). עם --baseline מושווים מול הרצה קודמת,
+ויציאה בקוד 1 אם מדד החמיר ביותר מ---tolerance.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+STUB_PLAYER = os.path.join(BENCH_DIR, 'stub_player.py')
+STUB_RECEIVER = os.path.join(BENCH_DIR, 'stub_receiver.py')
+CASE_TIMEOUT_SECONDS = 900
+SERVER_START_TIMEOUT_SECONDS = 60
+
+SUITES = {
+    'full': {
+        'data': [{'size': size, 'count': 200} for size in (100, 1000, 10000)],
+        'fanout': [{'receivers': n, 'failure_rate': f, 'rounds': 30}
+                   for n in (1, 4, 16, 64) for f in (0.0, 0.2)],
+        'song_file': [{'size_mb': 5, 'concurrency': c, 'downloads': 48} for c in (1, 4, 16)],
+        'scheduler': [{'events': 20, 'period_ms': 100, 'fires': 100, 'busy_threads': b} for b in (0, 4)],
+    },
+    'quick': {
+        'data': [{'size': size, 'count': 50} for size in (100, 1000)],
+        'fanout': [{'receivers': n, 'failure_rate': f, 'rounds': 10} for n in (1, 8) for f in (0.0, 0.2)],
+        'song_file': [{'size_mb': 2, 'concurrency': c, 'downloads': 16} for c in (1, 8)],
+        'scheduler': [{'events': 10, 'period_ms': 100, 'fires': 40, 'busy_threads': b} for b in (0, 4)],
+    },
+}
+
+
+# --- עזרים ---
+def summarize(prefix, samples_ms):
+    """p50/p95/max/mean של רשימת זמנים, כמילון שטוח עם שמות כמו full_p95_ms."""
+    if not samples_ms:
+        return {f'{prefix}_count': 0}
+    ordered = sorted(samples_ms)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    return {
+        f'{prefix}_count': len(ordered),
+        f'{prefix}_p50_ms': round(percentile(50), 3),
+        f'{prefix}_p95_ms': round(percentile(95), 3),
+        f'{prefix}_max_ms': round(ordered[-1], 3),
+        f'{prefix}_mean_ms': round(sum(ordered) / len(ordered), 3),
+    }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f'nothing listening on port {port} after {timeout}s')
+
+
+def stop_process(proc):
+    if proc.poll() is None:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+
+def start_server(workers=2):
+    """מפעיל את app.py תחת gunicorn בתיקייה הנוכחית. מחזיר (תהליך, כתובת בסיס)."""
+    port = free_port()
+    env = dict(os.environ, RINGER_BIND=f'127.0.0.1:{port}', WEB_CONCURRENCY=str(workers),
+               PYTHONPATH=REPO_DIR + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', os.path.join(REPO_DIR, 'gunicorn.conf.py'),
+         '--access-logfile', '/dev/null', '--log-level', 'warning', 'app:create_app()'],
+        env=env, stdout=subprocess.DEVNULL, stderr=open('server.log', 'wb'))
+    try:
+        wait_for_port(port, SERVER_START_TIMEOUT_SECONDS)
+    except RuntimeError:
+        stop_process(proc)
+        raise
+    return proc, f'http://127.0.0.1:{port}'
+
+
+def populate_catalog(songs, events):
+    """כותב שירים ואירועים ישירות לקטלוג (לפני שהשרת עולה)."""
+    from catalog import get_catalog
+    days = ['שני', 'שלישי', 'רביעי', 'חמישי', 'שישי', 'שבת', 'ראשון']
+    song_ids = [str(uuid.uuid4()) for _ in range(songs)]
+    for kind in ('songs', 'events'):
+        os.makedirs(os.path.join('storage', kind), exist_ok=True)
+    get_catalog(os.path.join('storage', 'songs')).put_many([
+        {'id': song_id, 'name': f'song {i}', 'filename': f'{song_id}.mp3', 'contentHash': uuid.uuid4().hex * 2}
+        for i, song_id in enumerate(song_ids)])
+    get_catalog(os.path.join('storage', 'events')).put_many([
+        {'id': str(uuid.uuid4()), 'name': f'event {i}', 'day': days[i % 7],
+         'time': f'{(i // 60) % 24:02d}:{i % 60:02d}', 'songId': song_ids[i % songs]}
+        for i in range(events)])
+
+
+# --- המקרים (כל אחד רץ בתהליך נפרד, בתיקייה זמנית) ---
+def bench_data(size, count=200):
+    import requests
+    populate_catalog(max(1, size // 10), size)
+    server, base = start_server()
+    try:
+        session = requests.Session()
+        for _ in range(5):
+            session.get(f'{base}/api/data').raise_for_status()
+        full, not_modified = [], []
+        body_bytes, etag = 0, None
+        for _ in range(count):
+            started = time.perf_counter()
+            response = session.get(f'{base}/api/data')
+            full.append((time.perf_counter() - started) * 1000)
+            response.raise_for_status()
+            body_bytes, etag = len(response.content), response.headers.get('ETag')
+        for _ in range(count):
+            started = time.perf_counter()
+            response = session.get(f'{base}/api/data', headers={'If-None-Match': etag})
+            not_modified.append((time.perf_counter() - started) * 1000)
+            if response.status_code != 304:
+                raise RuntimeError(f'expected 304, got {response.status_code}')
+    finally:
+        stop_process(server)
+    return dict(summarize('full', full), **summarize('not_modified', not_modified), body_bytes=body_bytes)
+
+
+def bench_fanout(receivers, failure_rate=0.0, rounds=30, delay_ms=0.0):
+    port = free_port()
+    stub = subprocess.Popen([sys.executable, STUB_RECEIVER, '--port', str(port),
+                             '--failure-rate', str(failure_rate), '--delay-ms', str(delay_ms)])
+    try:
+        wait_for_port(port, 10)
+        os.environ['RINGER_RECEIVER_URLS'] = ','.join(
+            f'http://127.0.0.1:{port}/r{i}/api/webhook_receive' for i in range(receivers))
+        import webhooks
+        # ההמתנה בין ניסיונות חוזרים מקוצרת: מודדים את מנגנון השליחה, לא את מדיניות ה-backoff
+        webhooks.RETRY_BASE_SECONDS = 0.05
+        import app as server_app
+        server_app.webhook_outbox.start()
+        urls = server_app.RECEIVER_URLS
+
+        enqueue, first_round, delivered = [], [], []
+        first_try_ok = 0
+        for round_number in range(rounds):
+            before = server_app.webhook_dispatcher.status()
+            started = time.perf_counter()
+            seq = server_app.notify_receivers('events_update', {'eventId': f'bench-{round_number}'})
+            enqueue.append((time.perf_counter() - started) * 1000)
+            first_round_done = False
+            deadline = time.monotonic() + 60
+            while time.monotonic() < deadline:
+                status = server_app.webhook_outbox.status()
+                if not first_round_done and all(
+                        status[url]['sent'] + status[url]['failed'] > before[url]['sent'] + before[url]['failed']
+                        for url in urls):
+                    first_round_done = True
+                    first_round.append((time.perf_counter() - started) * 1000)
+                    first_try_ok += sum(1 for url in urls if status[url]['sent'] > before[url]['sent'])
+                if first_round_done and all(status[url]['cursor'] >= seq for url in urls):
+                    delivered.append((time.perf_counter() - started) * 1000)
+                    break
+                time.sleep(0.001)
+            else:
+                raise RuntimeError(f'round {round_number} not delivered to all receivers within 60s')
+    finally:
+        stop_process(stub)
+    return dict(summarize('enqueue', enqueue), **summarize('first_round', first_round),
+                **summarize('delivered', delivered),
+                first_try_success_rate=round(first_try_ok / (rounds * receivers), 3))
+
+
+def bench_song_file(size_mb, concurrency, downloads=48):
+    import requests
+    folder = os.path.join('storage', 'songs')
+    os.makedirs(folder, exist_ok=True)
+    filenames = []
+    for _ in range(max(1, min(concurrency, 8))):
+        filename = f'{uuid.uuid4()}.mp3'
+        with open(os.path.join(folder, filename), 'wb') as f:
+            f.write(os.urandom(int(size_mb * 1024 * 1024)))
+        filenames.append(filename)
+
+    server, base = start_server(workers=2)
+    session_local = threading.local()
+
+    def download(i):
+        session = getattr(session_local, 'session', None)
+        if session is None:
+            session = session_local.session = requests.Session()
+        started = time.perf_counter()
+        first_byte, received = None, 0
+        with session.get(f'{base}/api/song_file/{filenames[i % len(filenames)]}', stream=True) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                if first_byte is None:
+                    first_byte = (time.perf_counter() - started) * 1000
+                received += len(chunk)
+        return (time.perf_counter() - started) * 1000, first_byte, received
+
+    try:
+        download(0)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(download, range(downloads)))
+        wall = time.perf_counter() - started
+    finally:
+        stop_process(server)
+    total_bytes = sum(r[2] for r in results)
+    return dict(summarize('download', [r[0] for r in results]),
+                **summarize('first_byte', [r[1] for r in results]),
+                throughput_mb_s=round(total_bytes / wall / (1024 * 1024), 2),
+                total_mb=round(total_bytes / (1024 * 1024), 1))
+
+
+def bench_scheduler(events=20, period_ms=100, fires=100, busy_threads=0):
+    """
+    מריץ את BellScheduler האמיתי (הליכה על הלוח הממוין, שינה, יקיצה) על ציר
+    זמן דחוס: הלוח המקומפל מקבל צלצול כל period_ms, לסירוגין בין האירועים.
+    """
+    os.environ['RINGER_PLAYER'] = f'{sys.executable} {STUB_PLAYER}'
+    os.makedirs(os.path.join('storage', 'songs'), exist_ok=True)
+    with open(os.path.join('storage', 'songs', 'bench.mp3'), 'wb') as f:
+        f.write(os.urandom(64 * 1024))
+    import app1 as receiver
+    receiver.save_json_file(receiver.SONGS_FOLDER, {'id': 'bench', 'name': 'bench', 'filename': 'bench.mp3'}, 'bench')
+
+    period = period_ms / 1000
+    origin = time.time() + 0.5
+    # מרווח ביטחון מעבר ל-fires, כדי שהלולאה לא תגיע לסוף הלוח לפני שנמדדו כולם
+    compressed = [{'at': origin + n * period, 'eventId': f'bench-{n % events}', 'songId': 'bench',
+                   'name': f'bench {n % events}'} for n in range(fires * 2)]
+
+    def compressed_schedule(start_date):
+        return {'entries': compressed, 'from': start_date.isoformat(), 'days': 1,
+                'until': compressed[-1]['at'], 'source': 'local'}
+
+    receiver.compile_local_schedule = compressed_schedule
+    scheduler = receiver.bell_scheduler
+    lateness, done = [], threading.Event()
+
+    def fire(entries):
+        lateness.append(scheduler.last_lateness * 1000)
+        receiver.play_timetable_entries(entries)
+        if len(lateness) >= fires:
+            done.set()
+
+    scheduler.fire_callback = fire
+    stop_busy = threading.Event()
+
+    def busy():
+        while not stop_busy.is_set():
+            sum(i * i for i in range(10000))
+
+    receiver.playback.start()
+    for _ in range(busy_threads):
+        threading.Thread(target=busy, daemon=True).start()
+    threading.Thread(target=scheduler.run, daemon=True).start()
+    finished = done.wait(fires * period + 30)
+    scheduler.stop()
+    stop_busy.set()
+    time.sleep(0.2)
+    receiver.playback.close()
+    if not finished:
+        raise RuntimeError(f'only {len(lateness)} of {fires} bells fired')
+    return dict(summarize('lateness', lateness[:fires]),
+                **summarize('player_start', list(receiver.playback.bells.latencies)),
+                player_failures=receiver.playback.bells.failures)
+
+
+BENCHMARKS = {
+    'data': bench_data,
+    'fanout': bench_fanout,
+    'song_file': bench_song_file,
+    'scheduler': bench_scheduler,
+}
+
+
+# --- הרצה ---
+def run_case(name, params):
+    """מריץ מקרה אחד בתהליך נפרד עם storage זמני. מחזיר שורת תוצאה."""
+    workdir = tempfile.mkdtemp(prefix=f'ringer-bench-{name}-')
+    env = dict(os.environ, PYTHONPATH=REPO_DIR + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    started = time.monotonic()
+    try:
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--case', json.dumps({'name': name, 'params': params})],
+            cwd=workdir, env=env, capture_output=True, text=True, timeout=CASE_TIMEOUT_SECONDS)
+        if proc.returncode != 0:
+            return {'benchmark': name, 'params': params, 'error': proc.stderr.strip().splitlines()[-5:]}
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+    except subprocess.TimeoutExpired:
+        result = {'benchmark': name, 'params': params, 'error': f'timed out after {CASE_TIMEOUT_SECONDS}s'}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    result['seconds'] = round(time.monotonic() - started, 1)
+    return result
+
+
+def case_main(spec):
+    """נקודת הכניסה של תהליך מקרה בודד: מדפיס את התוצאה כשורת JSON אחרונה."""
+    import logging
+    logging.disable(logging.CRITICAL)
+    random.seed(0)
+    metrics = BENCHMARKS[spec['name']](**spec['params'])
+    print(json.dumps({'benchmark': spec['name'], 'params': spec['params'], 'metrics': metrics}))
+
+
+def environment():
+    try:
+        rev = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                             capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        rev = None
+    return {
+        'benchmark': '_meta',
+        'git_rev': rev,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+
+def case_key(result):
+    return result['benchmark'], json.dumps(result['params'], sort_keys=True)
+
+
+def compare(results, baseline_path, tolerance, noise_floor_ms=1.0):
+    """
+    משווה מול הרצה קודמת לפי p50/p95 (נמוך יותר טוב) ותפוקה (גבוה יותר טוב);
+    max רועש מדי להשוואה. מחזיר רשימת רגרסיות (מדד שהחמיר ביותר מ-tolerance,
+    ובזמנים גם ביותר מ-noise_floor_ms).
+    """
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {case_key(r): r for r in map(json.loads, f) if r.get('metrics')}
+    regressions = []
+    for result in results:
+        old = baseline.get(case_key(result))
+        if not old or not result.get('metrics'):
+            continue
+        for metric, value in result['metrics'].items():
+            before = old['metrics'].get(metric)
+            if not isinstance(before, (int, float)) or not before:
+                continue
+            if metric.endswith(('_p50_ms', '_p95_ms')):
+                worse = value > before * (1 + tolerance) and value - before > noise_floor_ms
+            elif metric.endswith('_mb_s'):
+                worse = value < before * (1 - tolerance)
+            else:
+                continue
+            if worse:
+                regressions.append({'benchmark': result['benchmark'], 'params': result['params'],
+                                    'metric': metric, 'baseline': before, 'current': value})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Ringer server/receiver benchmarks')
+    parser.add_argument('--quick', action='store_true', help='smaller suite for a fast check')
+    parser.add_argument('--only', help=f'comma separated subset of: {",".join(BENCHMARKS)}')
+    parser.add_argument('--storage', choices=('json', 'sqlite'), help='catalog backend (RINGER_STORAGE)')
+    parser.add_argument('--output', help='write JSON lines here (default: stdout only)')
+    parser.add_argument('--baseline', help='previous --output file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown (0.25 = 25%%)')
+    parser.add_argument('--case', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        case_main(json.loads(args.case))
+        return 0
+
+    if args.storage:
+        os.environ['RINGER_STORAGE'] = args.storage
+    suite = SUITES['quick' if args.quick else 'full']
+    selected = args.only.split(',') if args.only else list(BENCHMARKS)
+    unknown = set(selected) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f'unknown benchmark(s): {", ".join(sorted(unknown))}')
+
+    meta = environment()
+    meta.update(suite='quick' if args.quick else 'full', storage=os.environ.get('RINGER_STORAGE', 'json'))
+    lines = [meta]
+    print(json.dumps(meta, ensure_ascii=False), flush=True)
+    for name in selected:
+        for params in suite[name]:
+            result = run_case(name, params)
+            lines.append(result)
+            print(json.dumps(result, ensure_ascii=False), flush=True)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps(line, ensure_ascii=False) + '\n' for line in lines)
+
+    failed = [r for r in lines[1:] if 'error' in r]
+    if args.baseline:
+        regressions = compare(lines[1:], args.baseline, args.tolerance)
+        for regression in regressions:
+            print(json.dumps(dict(regression, regression=True), ensure_ascii=False), file=sys.stderr)
+        if regressions:
+            return 1
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+נגן דמה במקום mpg123 -R: מדבר באותו פרוטוקול (LOAD/STOP/VOLUME/SILENCE/QUIT)
+ומחזיר @S מיד אחרי LOAD ו-@P 0 בסוף "הניגון", בלי כרטיס קול.
+
+RINGER_STUB_START_MS - השהיה מ-LOAD ועד @S (ברירת מחדל 0)
+RINGER_STUB_PLAY_MS  - אורך "הניגון" (ברירת מחדל 50)
+"""
+import os
+import sys
+import threading
+import time
+
+START_SECONDS = float(os.environ.get('RINGER_STUB_START_MS', '0')) / 1000
+PLAY_SECONDS = float(os.environ.get('RINGER_STUB_PLAY_MS', '50')) / 1000
+
+
+def emit(line):
+    sys.stdout.write(line + '\n')
+    sys.stdout.flush()
+
+
+def main():
+    emit('@R MPG123 (stub)')
+    finish = None
+    for line in sys.stdin:
+        command = line.strip()
+        if command.startswith('LOAD '):
+            if finish is not None:
+                finish.cancel()
+            if not os.path.exists(command[len('LOAD '):]):
+                emit('@E No such file')
+                continue
+            if START_SECONDS:
+                time.sleep(START_SECONDS)
+            emit('@S 1.0 3 44100 Stereo 0 417 2 0 0 0 128 0 1')
+            finish = threading.Timer(PLAY_SECONDS, emit, args=('@P 0',))
+            finish.start()
+        elif command == 'STOP':
+            if finish is not None:
+                finish.cancel()
+            emit('@P 0')
+        elif command == 'QUIT':
+            break
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+רסיברים מדומים ל-benchmark של שליחת ה-Webhooks: שרת HTTP אחד שמשחק
+כמה רסיברים (הנתיב /r<n>/api/webhook_receive), עונה 200 או 503 לפי שיעור
+כשלונות קבוע מראש, ואופציונלית מחכה לפני שהוא עונה.
+
+שימוש:
+    python benchmarks/stub_receiver.py --port 8799 --failure-rate 0.1 --delay-ms 5
+"""
+import argparse
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_handler(failure_rate, delay_seconds, seed):
+    rng = random.Random(seed)
+    rng_lock = threading.Lock()
+
+    class StubReceiver(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'   # keep-alive, כמו רסיבר אמיתי מאחורי gunicorn
+        # כותרות וגוף נשלחים בנפרד; בלי זה Nagle + delayed ACK מוסיפים ~40ms לכל תשובה
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            if delay_seconds:
+                time.sleep(delay_seconds)
+            with rng_lock:
+                failed = rng.random() < failure_rate
+            body = b'{"error": "stub failure"}' if failed else b'{"message": "Accepted"}'
+            self.send_response(503 if failed else 200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return StubReceiver
+
+
+def serve(port, failure_rate=0.0, delay_ms=0.0, seed=0):
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(failure_rate, delay_ms / 1000, seed))
+    server.daemon_threads = True
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Stub webhook receivers')
+    parser.add_argument('--port', type=int, required=True)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--delay-ms', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    serve(args.port, args.failure_rate, args.delay_ms, args.seed)
@@ -0,0 +1,430 @@
+# -*- coding: utf-8 -*-
+"""
+קטלוג בזיכרון לרשומות ה-JSON (שירים ואירועים).
+
+התיקייה נטענת פעם אחת בעלייה, כל קריאה מוגשת מהזיכרון,
+וכל כתיבה/מחיקה מעדכנת גם את הקובץ וגם את הזיכרון (write-through).
+קבצי ה-JSON נשארים מקור האמת: עריכות שנעשו מחוץ לתהליך
+מזוהות לפי mtime/גודל ונטענות מחדש רק עבור הקבצים שהשתנו.
+
+RINGER_STORAGE=sqlite מחליף את מנוע האחסון ל-SQLite (ראה sqlite_catalog.py)
+עם אותו ממשק; migrate_storage.py מעביר את הנתונים הקיימים.
+"""
+import os
+import json
+import logging
+import threading
+import time
+import uuid
+import zlib
+
+from leader import file_lock
+
+# כל כמה שניות לכל היותר נבדוק את התיקייה לשינויים חיצוניים
+REFRESH_INTERVAL_SECONDS = 2.0
+# מנוע האחסון: 'json' (קובץ לכל רשומה) או 'sqlite'
+STORAGE_BACKEND = os.environ.get('RINGER_STORAGE', 'json')
+# (mtime_ns, גודל, crc32) לכל רשומה כפי שנכתבה, לבדיקת שלמות בעלייה
+MANIFEST_FILENAME = 'catalog.manifest'
+# מוחלף בכל כתיבה, כדי שתהליכים אחרים (workers) יטענו מחדש מיד ולא אחרי REFRESH_INTERVAL
+GENERATION_FILENAME = 'catalog.generation'
+# יומן של אצווה (apply) שבאמצע החלה: קיים = האצווה נכנסה לתוקף, ונשלמת בעלייה הבאה
+BATCH_FILENAME = 'catalog.batch'
+# נעילה בין תהליכים על היומן: worker שעולה לא משלים אצווה ש-worker אחר עדיין מחיל
+BATCH_LOCK_FILENAME = 'catalog.batch.lock'
+QUARANTINE_FOLDER = 'quarantine'
+STALE_TMP_SECONDS = 60
+
+
+def encode_record(data):
+    """סריאליזציה קומפקטית של רשומה (בלי הזחה)."""
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def temp_path(path):
+    """
+    שם זמני ייחודי ליד path (rename אטומי למקום הסופי). ייחודי ולא קבוע, כי
+    כמה workers יכולים לכתוב את אותו קובץ באותו רגע.
+    """
+    return f"{path}.{uuid.uuid4().hex}.tmp"
+
+
+def fsync_folder(folder):
+    """fsync לתיקייה, כדי שה-rename עצמו ישרוד נפילת חשמל."""
+    fd = os.open(folder, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class JsonCatalog:
+    """קטלוג של תיקיית JSON אחת (קובץ לכל רשומה, שם הקובץ הוא המזהה)."""
+
+    def __init__(self, folder, refresh_interval=REFRESH_INTERVAL_SECONDS):
+        self.folder = folder
+        self.refresh_interval = refresh_interval
+        self.version = 0
+        self.quarantined = []   # קבצים פגומים שהועברו להסגר בעלייה
+        self._items = {}     # מזהה -> רשומה
+        self._stamps = {}    # מזהה -> (mtime_ns, size) של הקובץ כפי שנטען
+        self._checksums = {} # מזהה -> crc32 של תוכן הקובץ
+        self._listeners = []
+        self._lock = threading.RLock()
+        self._last_scan = 0.0
+        self._generation = None
+
+    # --- האזנה לשינויים ---
+    def add_listener(self, callback):
+        """רושם פונקציה שתיקרא כ-callback(catalog, op, item_id) אחרי כל שינוי ('put'/'delete')."""
+        self._listeners.append(callback)
+
+    def _notify(self, op, item_id):
+        self.version += 1
+        for callback in self._listeners:
+            try:
+                callback(self, op, item_id)
+            except Exception as e:
+                logging.error(f"שגיאה במאזין קטלוג ({self.folder}): {e}")
+
+    # --- טעינה וסנכרון מול הדיסק ---
+    def _filepath(self, item_id):
+        return os.path.join(self.folder, f"{item_id}.json")
+
+    def _read_file(self, path):
+        """מחזיר (רשומה, crc32). זורק ValueError אם התוכן אינו רשומה תקינה."""
+        with open(path, 'rb') as f:
+            raw = f.read()
+        data = json.loads(raw.decode('utf-8'))
+        if not isinstance(data, dict):
+            raise ValueError("record is not a JSON object")
+        return data, zlib.crc32(raw)
+
+    def _generation_stamp(self):
+        # התוכן ולא mtime/inode: שתי כתיבות באותו tick של השעון יכולות לקבל אותו stamp
+        try:
+            with open(os.path.join(self.folder, GENERATION_FILENAME), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _bump_generation(self):
+        """מסמן לתהליכים האחרים שהתיקייה השתנתה (תוכן ייחודי לכל כתיבה)."""
+        path = os.path.join(self.folder, GENERATION_FILENAME)
+        tmp_path = temp_path(path)
+        previous = self._generation_stamp()
+        token = f"{os.getpid()} {time.time_ns()}\n".encode()
+        with open(tmp_path, 'wb') as f:
+            f.write(token)
+        os.replace(tmp_path, path)
+        # אם תהליך אחר כתב מאז הסריקה האחרונה שלנו, נשאיר את ה-stamp הישן כדי לסרוק שוב
+        if previous == self._generation:
+            self._generation = token
+
+    def _manifest_path(self):
+        return os.path.join(self.folder, MANIFEST_FILENAME)
+
+    def _load_manifest(self):
+        try:
+            with open(self._manifest_path(), 'r', encoding='utf-8') as f:
+                return {item_id: tuple(entry) for item_id, entry in json.load(f).items()}
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save_manifest(self):
+        manifest = {item_id: [stamp[0], stamp[1], self._checksums.get(item_id)]
+                    for item_id, stamp in self._stamps.items()}
+        tmp_path = temp_path(self._manifest_path())
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, separators=(',', ':'))
+        os.replace(tmp_path, self._manifest_path())
+
+    def _quarantine(self, path, reason):
+        """מעביר קובץ פגום לתיקיית ההסגר (לא מוחק) ומתעד אותו."""
+        quarantine = os.path.join(self.folder, QUARANTINE_FOLDER)
+        os.makedirs(quarantine, exist_ok=True)
+        target = os.path.join(quarantine, f"{os.path.basename(path)}.{int(time.time())}")
+        os.replace(path, target)
+        self.quarantined.append(os.path.basename(path))
+        logging.error(f"רשומה פגומה הועברה להסגר: {path} -> {target} ({reason})")
+
+    def load(self):
+        """
+        טעינה בעלייה עם בדיקת שלמות: קבצי .tmp ישנים של כתיבה שנקטעה נמחקים, וכל קובץ
+        שאינו JSON תקין, או שה-crc32 שלו לא תואם ל-manifest למרות שה-mtime/גודל לא
+        השתנו (כלומר לא נערך אלא השתבש), מועבר להסגר.
+        """
+        with self._lock:
+            try:
+                entries = list(os.scandir(self.folder))
+            except FileNotFoundError:
+                entries = []
+            for entry in entries:
+                # .tmp חדש יכול להיות כתיבה פעילה של worker אחר שעלה לפנינו (וגם להיעלם תוך כדי)
+                if not entry.name.endswith('.tmp'):
+                    continue
+                try:
+                    if entry.is_file() and time.time() - entry.stat().st_mtime > STALE_TMP_SECONDS:
+                        os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+            if os.path.isdir(self.folder):
+                with file_lock(os.path.join(self.folder, BATCH_LOCK_FILENAME)):
+                    self._replay_batch()
+            self._generation = self._generation_stamp()
+            self._refresh(manifest=self._load_manifest())
+            self._save_manifest()
+        if self.quarantined:
+            logging.error(f"{len(self.quarantined)} רשומות פגומות הועברו להסגר ב-{self.folder}.")
+        return self
+
+    def refresh(self, force=False):
+        """
+        סורק את התיקייה (stat בלבד) וטוען מחדש רק קבצים שנוספו/השתנו/נמחקו.
+        כתיבה של תהליך אחר דרך הקטלוג נראית מיד; עריכה ידנית - תוך REFRESH_INTERVAL.
+        """
+        now = time.monotonic()
+        generation = self._generation_stamp()
+        if not force and generation == self._generation and now - self._last_scan < self.refresh_interval:
+            return
+        with self._lock:
+            self._generation = generation
+            if self._refresh():
+                self._save_manifest()
+
+    def _refresh(self, manifest=None):
+        self._last_scan = time.monotonic()
+        changed = False
+        seen = set()
+        try:
+            entries = list(os.scandir(self.folder))
+        except FileNotFoundError:
+            entries = []
+
+        for entry in entries:
+            if not entry.name.endswith('.json') or not entry.is_file():
+                continue
+            item_id = entry.name[:-len('.json')]
+            seen.add(item_id)
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            stamp = (st.st_mtime_ns, st.st_size)
+            if self._stamps.get(item_id) == stamp:
+                continue
+            try:
+                data, checksum = self._read_file(entry.path)
+            except FileNotFoundError:
+                # נמחקה ע"י worker אחר מאז הסריקה
+                seen.discard(item_id)
+                continue
+            except Exception as e:
+                if manifest is not None:
+                    seen.discard(item_id)
+                    self._quarantine(entry.path, e)
+                else:
+                    logging.warning(f"שגיאה בקריאת קובץ {entry.name}: {e}")
+                continue
+            expected = manifest.get(item_id) if manifest is not None else None
+            if expected and tuple(expected[:2]) == stamp and expected[2] not in (None, checksum):
+                seen.discard(item_id)
+                self._quarantine(entry.path, "checksum mismatch")
+                continue
+            self._items[item_id] = data
+            self._stamps[item_id] = stamp
+            self._checksums[item_id] = checksum
+            changed = True
+            self._notify('put', item_id)
+
+        for item_id in [i for i in self._items if i not in seen]:
+            self._items.pop(item_id, None)
+            self._stamps.pop(item_id, None)
+            self._checksums.pop(item_id, None)
+            changed = True
+            self._notify('delete', item_id)
+        return changed
+
+    # --- קריאה ---
+    def list(self):
+        """כל הרשומות (עותקים), מהזיכרון."""
+        self.refresh()
+        with self._lock:
+            return [dict(item) for item in self._items.values()]
+
+    def get(self, item_id):
+        """רשומה לפי מזהה או None."""
+        self.refresh()
+        with self._lock:
+            item = self._items.get(str(item_id))
+            return dict(item) if item is not None else None
+
+    def peek(self, item_id):
+        """רשומה מהזיכרון בלבד, בלי בדיקת שינויים בדיסק (למאזינים)."""
+        with self._lock:
+            item = self._items.get(str(item_id))
+            return dict(item) if item is not None else None
+
+    def find(self, **fields):
+        """רשומות ששדותיהן שווים לערכים הנתונים (למשל songId=...), מהזיכרון."""
+        self.refresh()
+        wanted = {field: str(value) for field, value in fields.items()}
+        with self._lock:
+            return [dict(item) for item in self._items.values()
+                    if all(str(item.get(field)) == value for field, value in wanted.items())]
+
+    # --- כתיבה ---
+    def put(self, data):
+        """כותב רשומה לדיסק ומעדכן את הזיכרון. data חייב להכיל 'id'."""
+        self.put_many([data])
+        return data
+
+    def put_many(self, items):
+        """
+        כותב רשומות רבות ב-group commit: כל הרשומות נכתבות לקבצי .tmp, עוברות
+        fsync ורק אז מוחלפות ב-rename, עם fsync אחד לתיקייה ועדכון manifest אחד.
+        קובץ רשומה הוא תמיד הגרסה הישנה או החדשה במלואה, גם בנפילת חשמל.
+        """
+        items = [dict(data, id=str(data['id'])) for data in items]
+        if not items:
+            return items
+        with self._lock:
+            self._write(items)
+            fsync_folder(self.folder)
+            self._save_manifest()
+            self._bump_generation()
+            for data in items:
+                self._notify('put', data['id'])
+        return items
+
+    def apply(self, items, deleted_ids):
+        """
+        כתיבות ומחיקות כאצווה אחת: קודם נכתב (עם fsync) יומן BATCH_FILENAME עם כל
+        הפעולות, ורק אז הן מוחלות. נפילה באמצע משאירה את היומן, והטעינה הבאה
+        משלימה אותו, כך שהתיקייה היא תמיד המצב הישן או החדש במלואו. הכתיבה
+        וההשלמה רצות תחת BATCH_LOCK_FILENAME, כך שרק אחת מהן נוגעת ביומן.
+        """
+        items = [dict(data, id=str(data['id'])) for data in items]
+        put_ids = {data['id'] for data in items}
+        deleted_ids = [str(item_id) for item_id in deleted_ids if str(item_id) not in put_ids]
+        if not items and not deleted_ids:
+            return items, deleted_ids
+        journal = os.path.join(self.folder, BATCH_FILENAME)
+        with self._lock, file_lock(os.path.join(self.folder, BATCH_LOCK_FILENAME)):
+            tmp_path = temp_path(journal)
+            with open(tmp_path, 'wb') as f:
+                f.write(encode_record({'put': items, 'delete': deleted_ids}))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, journal)
+            fsync_folder(self.folder)
+
+            self._write(items)
+            removed = [item_id for item_id in deleted_ids if self._remove(item_id)]
+            fsync_folder(self.folder)
+            os.remove(journal)
+            fsync_folder(self.folder)
+            self._save_manifest()
+            self._bump_generation()
+            for data in items:
+                self._notify('put', data['id'])
+            for item_id in removed:
+                self._notify('delete', item_id)
+        return items, removed
+
+    def _replay_batch(self):
+        """משלים אצווה שנקטעה (ראה apply). נקרא בטעינה, לפני סריקת התיקייה."""
+        journal = os.path.join(self.folder, BATCH_FILENAME)
+        try:
+            with open(journal, 'rb') as f:
+                batch = json.loads(f.read().decode('utf-8'))
+        except FileNotFoundError:
+            return
+        except ValueError as e:
+            logging.error(f"יומן אצווה פגום ב-{self.folder} לא הוחל: {e}")
+            os.remove(journal)
+            return
+        self._write(batch['put'])
+        for item_id in batch['delete']:
+            self._remove(item_id)
+        fsync_folder(self.folder)
+        os.remove(journal)
+        fsync_folder(self.folder)
+        logging.warning(f"אצווה שנקטעה הושלמה ב-{self.folder}: "
+                        f"{len(batch['put'])} נכתבו, {len(batch['delete'])} נמחקו.")
+
+    def _write(self, items):
+        """כותב רשומות (tmp + fsync + rename) ומעדכן את הזיכרון; בלי fsync לתיקייה ובלי הודעות."""
+        pending = []
+        try:
+            for data in items:
+                path = self._filepath(data['id'])
+                payload = encode_record(data)
+                tmp_path = temp_path(path)
+                pending.append([data, path, tmp_path, zlib.crc32(payload), None])
+                with open(tmp_path, 'wb') as f:
+                    f.write(payload)
+                    f.flush()
+                    os.fsync(f.fileno())
+                    # ה-stamp מהקובץ הפתוח: אחרי ה-rename worker אחר כבר יכול למחוק או להחליף אותו
+                    pending[-1][4] = os.fstat(f.fileno())
+        except Exception:
+            for _, _, tmp_path, _, _ in pending:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            raise
+
+        for data, path, tmp_path, checksum, st in pending:
+            os.replace(tmp_path, path)
+            self._items[data['id']] = data
+            self._stamps[data['id']] = (st.st_mtime_ns, st.st_size)
+            self._checksums[data['id']] = checksum
+
+    def _remove(self, item_id):
+        """מוחק קובץ רשומה ומהזיכרון; בלי fsync ובלי הודעות. מחזיר False אם לא הייתה קיימת."""
+        try:
+            os.remove(self._filepath(item_id))
+            existed = True
+        except FileNotFoundError:
+            existed = False
+        if self._items.pop(item_id, None) is not None:
+            existed = True
+        self._stamps.pop(item_id, None)
+        self._checksums.pop(item_id, None)
+        return existed
+
+    def delete(self, item_id):
+        """מוחק רשומה מהדיסק ומהזיכרון. מחזיר False אם לא הייתה קיימת."""
+        item_id = str(item_id)
+        with self._lock:
+            known = item_id in self._items
+            # worker אחר יכול למחוק את אותו קובץ באותו רגע; _remove לא נכשל על קובץ חסר
+            existed = self._remove(item_id)
+            if existed:
+                fsync_folder(self.folder)
+            if known:
+                self._save_manifest()
+                self._bump_generation()
+                self._notify('delete', item_id)
+            return existed
+
+
+# --- קטלוג אחד לכל תיקייה, משותף לכל התהליך ---
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_catalog(folder):
+    """מחזיר (ויוצר וטוען בפעם הראשונה) את הקטלוג של התיקייה, לפי מנוע האחסון שנבחר."""
+    key = os.path.abspath(folder)
+    with _catalogs_lock:
+        catalog = _catalogs.get(key)
+        if catalog is None:
+            if STORAGE_BACKEND == 'sqlite':
+                from sqlite_catalog import SqliteCatalog
+                catalog = SqliteCatalog(folder)
+            else:
+                catalog = JsonCatalog(folder)
+            catalog.load()
+            _catalogs[key] = catalog
+        return catalog
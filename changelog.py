@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+יומן שינויים עם מספר גרסה (revision) עולה, לסנכרון חלקי של הרסיברים.
+
+כל שינוי בקטלוג (הוספה/עדכון/מחיקה של שיר או אירוע) מקבל rev חדש
+ונרשם ב-storage/changes.jsonl. רסיבר ששמר את ה-rev האחרון שראה מבקש
+רק את מה שהשתנה מאז, במקום למשוך את כל הנתונים מחדש.
+
+כמה תהליכים (workers של gunicorn) יכולים לכתוב לאותו יומן: הכתיבה נעשית
+תחת נעילת קובץ, ולפניה כל תהליך קורא את מה שתהליכים אחרים הוסיפו.
+שינויים שנרשמים בתוך batch() נכנסים ליומן יחד, ב-rev אחד.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+from leader import file_lock
+
+# כתיבה מחדש של היומן (רשומה אחרונה לכל מזהה) כשהוא גדל מעבר לזה
+COMPACT_MIN_ENTRIES = 1000
+
+
+def record_digest(data):
+    """טביעת אצבע של רשומה, לזיהוי שינויים שנעשו כשהשרת היה כבוי."""
+    encoded = json.dumps(data, ensure_ascii=False, sort_keys=True).encode('utf-8')
+    return hashlib.sha1(encoded).hexdigest()
+
+
+class ChangeLog:
+    """יומן append-only של (rev, kind, id, op, digest) עם המצב האחרון לכל רשומה בזיכרון."""
+
+    def __init__(self, path):
+        self.path = path
+        self.rev = 0
+        self._latest = {}   # (kind, id) -> הרשומה האחרונה ביומן
+        self._count = 0
+        self._offset = 0    # עד איפה היומן נקרא
+        self._inode = None  # משתנה כשהיומן נכתב מחדש (compaction)
+        self._lock = threading.Lock()
+        self._lock_path = path + '.lock'
+        self._local = threading.local()  # השינויים של batch() פתוח ב-thread הנוכחי
+        with self._lock:
+            self._catch_up()
+
+    def _catch_up(self):
+        """קורא רשומות שנוספו ליומן (גם ע"י תהליכים אחרים) מאז הקריאה הקודמת."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if st.st_ino != self._inode:
+            self._latest, self._count, self._offset, self._inode = {}, 0, 0, st.st_ino
+        if st.st_size <= self._offset:
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read()
+        # שורה חלקית (כתיבה שעדיין לא הסתיימה) תיקרא בפעם הבאה
+        data = data[:data.rfind(b'\n') + 1]
+        self._offset += len(data)
+        for line in data.splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                logging.warning("שורה פגומה ביומן השינויים דולגה.")
+                continue
+            self._latest[(entry['kind'], entry['id'])] = entry
+            self.rev = max(self.rev, entry['rev'])
+            self._count += 1
+
+    def refresh(self):
+        """מעדכן את ה-rev לפי מה שתהליכים אחרים רשמו."""
+        with self._lock:
+            self._catch_up()
+            return self.rev
+
+    def _compact(self):
+        entries = sorted(self._latest.values(), key=lambda e: e['rev'])
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        st = os.stat(self.path)
+        self._count, self._offset, self._inode = len(entries), st.st_size, st.st_ino
+
+    def record(self, kind, op, item_id, data=None):
+        """רושם שינוי ומחזיר את ה-rev החדש. op הוא 'put' או 'delete'."""
+        item_id = str(item_id)
+        digest = record_digest(data) if op == 'put' and data is not None else None
+        pending = getattr(self._local, 'pending', None)
+        if pending is not None:
+            pending.append((kind, op, item_id, digest))
+            return self.rev
+        return self._append([(kind, op, item_id, digest)])
+
+    @contextmanager
+    def batch(self):
+        """כל השינויים שנרשמים בתוך הבלוק (באותו thread) נכתבים ליומן יחד, ב-rev אחד."""
+        if getattr(self._local, 'pending', None) is not None:
+            yield
+            return
+        self._local.pending = []
+        try:
+            yield
+        finally:
+            pending, self._local.pending = self._local.pending, None
+            if pending:
+                self._append(pending)
+
+    def _append(self, changes):
+        """כותב (kind, op, id, digest) ליומן בשורה לכל שינוי, כולם עם אותו rev חדש."""
+        with self._lock, file_lock(self._lock_path):
+            self._catch_up()
+            entries = []
+            for kind, op, item_id, digest in changes:
+                previous = self._latest.get((kind, item_id))
+                if previous and previous['op'] == op and previous.get('digest') == digest:
+                    continue
+                entry = {'rev': self.rev + 1, 'kind': kind, 'id': item_id, 'op': op, 'digest': digest}
+                self._latest[(kind, item_id)] = entry
+                entries.append(entry)
+            if not entries:
+                return self.rev
+            self.rev += 1
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(''.join(json.dumps(entry, ensure_ascii=False) + '\n' for entry in entries))
+            st = os.stat(self.path)
+            self._offset, self._inode = st.st_size, st.st_ino
+            self._count += len(entries)
+            if self._count > max(COMPACT_MIN_ENTRIES, 2 * len(self._latest)):
+                self._compact()
+            return self.rev
+
+    def reconcile(self, kind, catalog):
+        """משווה את הקטלוג למצב האחרון ביומן ורושם שינויים שנעשו בזמן שהשרת היה כבוי."""
+        current = {str(item['id']): item for item in catalog.list()}
+        with self._lock:
+            self._catch_up()
+            known = {item_id: entry for (k, item_id), entry in self._latest.items() if k == kind}
+        for item_id, item in current.items():
+            entry = known.get(item_id)
+            if not entry or entry['op'] != 'put' or entry.get('digest') != record_digest(item):
+                self.record(kind, 'put', item_id, item)
+        for item_id, entry in known.items():
+            if entry['op'] == 'put' and item_id not in current:
+                self.record(kind, 'delete', item_id)
+
+    def listener(self, kind):
+        """מאזין לקטלוג שרושם כל שינוי ביומן."""
+        def on_change(catalog, op, item_id):
+            self.record(kind, op, item_id, catalog.peek(item_id) if op == 'put' else None)
+        return on_change
+
+    def changes_since(self, since):
+        """מחזיר {kind: {'put': [ids], 'delete': [ids]}} של כל מה שהשתנה אחרי since."""
+        changes = {}
+        with self._lock:
+            self._catch_up()
+            for (kind, item_id), entry in self._latest.items():
+                if entry['rev'] > since:
+                    changes.setdefault(kind, {'put': [], 'delete': []})[entry['op']].append(item_id)
+            return self.rev, changes
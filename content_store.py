@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+אחסון קבצי השירים לפי תוכן (content-addressed), בשרת ובאחסון המקומי של הרסיבר.
+
+כל קובץ נשמר בשם <sha256><סיומת>, כך שאותו MP3 שהועלה לעשרה שירים נשמר
+(ומסונכרן) פעם אחת, ושם של קובץ מזהה את התוכן שלו לתמיד. גם גרסאות הניגון
+נשמרות כך, ולכן שני שירים עם אותו מקור ואותו חיתוך חולקים גרסה אחת.
+
+ספירת ההפניות נגזרת מרשומות השירים עצמן (filename, renditionFilename) ולא
+נשמרת בנפרד, כך שאין מונה שיכול לסטות מהקטלוג. שמירה ועריכה לא מוחקות
+קבצים; אוסף האשפה (GarbageCollector) רץ ברקע בתהליך המוביל ומוחק קובץ רק אם:
+  - אף רשומה (גם לא רשומה שהועברה להסגר) ואף העלאה פתוחה לא מפנים אליו,
+  - הוא לא נוצר ולא נלקח לשימוש ב-GC_GRACE_SECONDS האחרונות (שמירה שבאמצע,
+    אולי ב-worker אחר, כבר נגעה בקובץ אבל עוד לא שמרה את הרשומה),
+  - שמו נוצר על ידינו (hash או uuid); קובץ שהונח ידנית בתיקייה לא נמחק.
+שמירה, לקיחה לשימוש ומחיקה רצות תחת אותה נעילת קובץ, כך שהבדיקה והמחיקה
+לא יכולות להתערבב עם שמירה של אותו תוכן.
+"""
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+
+from audio_cache import file_sha256
+from leader import file_lock
+
+CONTENT_FILENAME_RE = re.compile(r'^[0-9a-f]{64}\.\w+$')
+# השמות שנוצרו לפני האחסון לפי תוכן (ועדיין משמשים לקבצי פאניק)
+UUID_FILENAME_RE = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\.\w+$')
+# שם קובץ שנוצר (לפי תוכן או uuid) בתוך טקסט חופשי, לרשומות שלא ניתן לפענח
+GENERATED_FILENAME_TOKEN_RE = re.compile(
+    rb'(?:[0-9a-f]{64}|[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})\.\w+')
+CONTENT_LOCK_FILENAME = 'content.lock'
+REFERENCE_FIELDS = ('filename', 'renditionFilename')
+GC_GRACE_SECONDS = 10 * 60
+GC_INTERVAL_SECONDS = int(os.environ.get('RINGER_GC_INTERVAL_MIN', '15')) * 60
+
+
+def content_filename(content_hash, extension):
+    return f"{content_hash}{(extension or '.mp3').lower()}"
+
+
+def is_generated_filename(filename):
+    """קובץ מדיה בשם שנוצר על ידי השרת/הרסיבר: התוכן שלו לא משתנה לעולם ומותר לאסוף אותו."""
+    if filename.endswith(('.json', '.tmp', '.part', '.lock')):
+        # רשומות הקטלוג (<uuid>.json) וקבצים באמצע כתיבה יושבים באותה תיקייה
+        return False
+    return bool(CONTENT_FILENAME_RE.match(filename) or UUID_FILENAME_RE.match(filename))
+
+
+def temp_path(folder, extension=''):
+    """נתיב זמני באותה תיקייה (rename אטומי למקום הסופי); לא נכלל באינדקס המדיה."""
+    return os.path.join(folder, f"{uuid.uuid4()}{extension}.tmp")
+
+
+def _lock(folder):
+    return file_lock(os.path.join(folder, CONTENT_LOCK_FILENAME))
+
+
+def store_file(path, folder, extension, content_hash=None):
+    """
+    מעביר קובץ שנכתב באותה מערכת קבצים למקומו לפי התוכן. אם התוכן כבר שמור -
+    הקובץ החדש נמחק והקיים מסומן כנלקח לשימוש. מחזיר (שם הקובץ, האם חדש).
+    """
+    content_hash = content_hash or file_sha256(path)
+    filename = content_filename(content_hash, extension)
+    dest_path = os.path.join(folder, filename)
+    with _lock(folder):
+        if os.path.exists(dest_path):
+            os.remove(path)
+            os.utime(dest_path)
+            return filename, False
+        os.replace(path, dest_path)
+    return filename, True
+
+
+def adopt_file(source_path, folder, extension, content_hash=None):
+    """
+    כמו store_file, אבל משאיר את המקור במקומו (hard link, או העתקה אם אי אפשר).
+    משמש להעברת קבצים בשמות ישנים: הרשומות עוברות לשם החדש, והישן נאסף אחר כך.
+    """
+    tmp_path = temp_path(folder, extension)
+    try:
+        os.link(source_path, tmp_path)
+    except OSError:
+        shutil.copyfile(source_path, tmp_path)
+    try:
+        return store_file(tmp_path, folder, extension, content_hash)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def claim_file(folder, filename):
+    """מסמן קובץ קיים כנלקח לשימוש (לפני שמירת רשומה שמפנה אליו). FileNotFoundError אם נאסף."""
+    with _lock(folder):
+        os.utime(os.path.join(folder, filename))
+
+
+def reference_counts(songs):
+    """{שם קובץ: מספר ההפניות} מתוך רשומות השירים."""
+    counts = {}
+    for song in songs:
+        for field in REFERENCE_FIELDS:
+            if song.get(field):
+                counts[song[field]] = counts.get(song[field], 0) + 1
+    return counts
+
+
+def quarantined_references(quarantine_folder):
+    """
+    שמות הקבצים שרשומות בהסגר (ראה catalog.py) מפנות אליהם, כדי שרשומה שתשוחזר
+    ידנית לא תאבד את הקובץ שלה. מרשומה שלא ניתן לפענח נלקח כל מה שנראה כשם קובץ.
+    """
+    names = set()
+    try:
+        entries = list(os.scandir(quarantine_folder))
+    except FileNotFoundError:
+        return names
+    for entry in entries:
+        if not entry.is_file():
+            continue
+        with open(entry.path, 'rb') as f:
+            raw = f.read()
+        try:
+            song = json.loads(raw.decode('utf-8'))
+        except ValueError:
+            song = None
+        if isinstance(song, dict):
+            names.update(reference_counts([song]))
+        else:
+            names.update(token.decode('ascii') for token in GENERATED_FILENAME_TOKEN_RE.findall(raw))
+    return names
+
+
+def collect_garbage(folder, referenced, grace_seconds=GC_GRACE_SECONDS):
+    """מוחק מהתיקייה קבצים שאין אליהם הפניה (ראה תיאור המודול). מחזיר (שמות שנמחקו, בתים)."""
+    removed, freed = [], 0
+    now = time.time()
+    with _lock(folder):
+        for entry in os.scandir(folder):
+            if not entry.is_file() or entry.name in referenced or not is_generated_filename(entry.name):
+                continue
+            st = entry.stat()
+            if now - st.st_mtime < grace_seconds:
+                continue
+            os.remove(entry.path)
+            removed.append(entry.name)
+            freed += st.st_size
+    return removed, freed
+
+
+def folder_usage(folder):
+    """(מספר קבצים, בתים) של הקבצים שנוצרו על ידינו בתיקייה."""
+    files = size = 0
+    for entry in os.scandir(folder):
+        if entry.is_file() and is_generated_filename(entry.name):
+            files += 1
+            size += entry.stat().st_size
+    return files, size
+
+
+class GarbageCollector:
+    """
+    מריץ collect_garbage בתיקייה כל interval שניות. referenced() מחזירה את
+    קבוצת השמות שבשימוש ונקראת מחדש בכל סבב; on_collect(removed, freed) אופציונלי.
+    """
+
+    def __init__(self, folder, referenced, interval=GC_INTERVAL_SECONDS, on_collect=None):
+        self.folder = folder
+        self.referenced = referenced
+        self.interval = interval
+        self.on_collect = on_collect
+        self._wake = threading.Event()
+
+    def run_once(self):
+        removed, freed = collect_garbage(self.folder, set(self.referenced()))
+        if removed:
+            logging.info(f"איסוף קבצים: נמחקו {len(removed)} קבצים ללא הפניה ({freed // 1024}KB) מ-{self.folder}")
+        if self.on_collect:
+            self.on_collect(removed, freed)
+        return removed, freed
+
+    def wake(self):
+        """מריץ סבב בהקדם (למשל אחרי מחיקת שיר) בלי לחכות ל-interval. עובד רק בתהליך שמריץ את run()."""
+        self._wake.set()
+
+    def run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.run_once()
+            except Exception as e:
+                logging.error(f"שגיאה באיסוף קבצים ב-{self.folder}: {e}")
+
+    def start(self):
+        threading.Thread(target=self.run, name='content-gc', daemon=True).start()
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+הפצת קבצי אודיו בין הרסיברים ברשת המקומית (P2P), כדי שקו היציאה של השרת
+לא יהיה צוואר הבקבוק כשכל הרסיברים מורידים שיר חדש או קריאת פאניק יחד.
+
+השרת מסדר את הרסיברים (לפי הסדר ב-RECEIVER_URLS) בעץ עם פיצול קבוע
+RINGER_P2P_FANOUT: k הרסיברים הראשונים מורידים מהשרת, וכל רסיבר אחר
+מוריד מההורה שלו. ב-Webhooks של songs_update ו-panic_alert כל רסיבר
+מקבל את רשימת המקורות שלו (sources): ההורה, ואחריו שאר האבות, והשרת תמיד
+אחרון. רסיבר שלא ענה ל-Webhook האחרון מוצא מהעץ עד שיחזור.
+
+הרסיבר חושף את הקבצים שלו ב-/api/peer/... ומוריד מהמקור הראשון שמצליח
+(התוכן מאומת לפי sha256, כך שקובץ פגום משכן פשוט נדחה). שיר שהרסיבר עוד
+לא הוריד נמשך דרכו מהמקורות שלו, כך שכל תת-עץ מוריד מהשרת פעם אחת;
+קריאת פאניק מוגשת רק אם היא כבר כאן או בהורדה (אחרת הילד עובר למקור הבא).
+זמן ההפצה גדל לפי עומק העץ (log_k של מספר הרסיברים) ולא לפי מספרם.
+
+RINGER_P2P_FANOUT=0 (ברירת המחדל) מכבה את המצב: כל הרסיברים מורידים מהשרת.
+"""
+import os
+from urllib.parse import urlsplit
+
+P2P_FANOUT = int(os.environ.get('RINGER_P2P_FANOUT', '0'))
+# הודעות שבעקבותיהן הרסיבר מוריד קבצים
+DISTRIBUTED_TYPES = ('songs_update', 'panic_alert')
+# (התחברות, קריאה) מול שכן: שכן כבוי נכשל מהר; הקריאה כוללת המתנה להורדה של השכן עצמו
+PEER_TIMEOUT = (1, 60)
+
+
+def receiver_base_url(webhook_url):
+    """http://host:port של רסיבר, מכתובת ה-Webhook שלו."""
+    parts = urlsplit(webhook_url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def distribution_tree(urls, fanout):
+    """
+    {כתובת Webhook: [כתובות בסיס של המקורות, מההורה ועד השורש]}. הרסיבר ה-i
+    (מ-0) נמצא במקום i+1 בעץ k-ארי שהשרת בשורשו, ולכן ההורה שלו הוא i // k - 1.
+    """
+    tree = {}
+    for index, url in enumerate(urls):
+        chain = []
+        node = index
+        while fanout > 0 and node >= fanout:
+            node = node // fanout - 1
+            chain.append(receiver_base_url(urls[node]))
+        tree[url] = chain
+    return tree
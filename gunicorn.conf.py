@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""
+הגדרות gunicorn להרצה בייצור.
+
+שרת:    gunicorn -c gunicorn.conf.py 'app:create_app()'
+רסיבר:  WEB_CONCURRENCY=1 RINGER_BIND=0.0.0.0:5000 gunicorn -c gunicorn.conf.py 'app1:create_app()'
+
+כל worker טוען את הקטלוג בעצמו; כתיבות של worker אחד נראות לשאר דרך
+הדיסק (catalog.generation / PRAGMA data_version), ויומני השינויים וה-Webhooks
+משותפים תחת נעילת קובץ. השירותים שרצים פעם אחת (שליחת Webhooks, תזמון
+צלצולים) עולים רק אצל ה-worker שנבחר למוביל (ראה leader.py).
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('RINGER_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+# threads: בקשות ארוכות (שידור פאניק חי) לא תופסות worker שלם
+worker_class = 'gthread'
+# תקציב ה-threads של כל worker: זרמים ארוכים תופסים thread לכל אורכם, ולכן
+# app.py מגביל אותם לכל worker - עדכונים חיים (/api/live, RINGER_MAX_LIVE_STREAMS)
+# ומשיכת שידורי פאניק (RINGER_MAX_PANIC_PULLS), כל אחד רבע מ-threads כברירת
+# מחדל - ומחזיר 503 מעבר לזה. כך לפחות חצי מה-threads נשארים לבקשות רגילות.
+# חיבור SSE נסגר אחרי RINGER_LIVE_MAX_SECONDS והדפדפן מתחבר מחדש (Last-Event-ID).
+# בהגדלת המכסות יש להגדיל גם את threads.
+threads = int(os.environ.get('RINGER_THREADS', '8'))
+timeout = 60
+graceful_timeout = 10
+# בלי preload: threads ברקע ונעילות קבצים חייבים להיווצר בכל worker אחרי ה-fork
+preload_app = False
+accesslog = '-'
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+בחירת מוביל (leader) בין תהליכי gunicorn באמצעות נעילת קובץ.
+
+רק התהליך שמחזיק בנעילה מפעיל את השירותים שחייבים לרוץ פעם אחת
+(תזמון הצלצולים, שליחת ה-Webhooks וכו'). שאר התהליכים מנסים לקחת
+את הנעילה מחדש מדי כמה שניות, כך שאם המוביל נופל (או ש-gunicorn
+מחליף אותו) תהליך אחר ממשיך במקומו. הנעילה משתחררת אוטומטית
+כשהתהליך מת, כולל kill -9.
+"""
+import fcntl
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+LEADER_RETRY_SECONDS = 5
+
+
+@contextmanager
+def file_lock(path):
+    """נעילה בלעדית (חוסמת) בין תהליכים, לכתיבה משותפת ליומן."""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+class LeaderLock:
+    """נעילה בלעדית על קובץ; start(on_elected) מריץ את on_elected פעם אחת כשנבחרים."""
+
+    def __init__(self, path, retry_seconds=LEADER_RETRY_SECONDS):
+        self.path = path
+        self.retry_seconds = retry_seconds
+        self.is_leader = False
+        self._fd = None
+        self._started = False
+        self._stop = threading.Event()
+
+    def try_acquire(self):
+        """מנסה לקחת את הנעילה בלי לחכות. מחזיר True אם התהליך הזה הוא המוביל."""
+        if self.is_leader:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, f"{os.getpid()}\n".encode())
+        self._fd = fd
+        self.is_leader = True
+        return True
+
+    def holder_pid(self):
+        """ה-pid של המוביל הנוכחי (לפי הקובץ), או None."""
+        try:
+            with open(self.path, 'r') as f:
+                return int(f.read().strip() or 0) or None
+        except (OSError, ValueError):
+            return None
+
+    def start(self, on_elected):
+        """מריץ את on_elected מיד אם נבחרנו, אחרת ממשיך לנסות ברקע."""
+        if self._started:
+            return self
+        self._started = True
+        if self.try_acquire():
+            self._elected(on_elected)
+            return self
+
+        def campaign():
+            while not self._stop.wait(self.retry_seconds):
+                if self.try_acquire():
+                    self._elected(on_elected)
+                    return
+
+        threading.Thread(target=campaign, name='leader-election', daemon=True).start()
+        return self
+
+    def _elected(self, on_elected):
+        logging.info(f"תהליך {os.getpid()} נבחר למוביל ({self.path}).")
+        on_elected()
+
+    def release(self):
+        self._stop.set()
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self.is_leader = False
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+מדדים בפורמט הטקסט של Prometheus, בלי תלות חיצונית.
+
+כל אפליקציה מחזיקה Registry אחד ומחזירה את render() מ-/api/metrics.
+מונים והיסטוגרמות מתעדכנים במקום שבו הדבר קורה (צלצול, ניגון, שליחה);
+ערכים שנקראים ממצב קיים (אורך תור, גודל מטמון) נאספים בזמן הקריאה
+דרך פונקציות collector. parse_metrics מאפשר לשרת לאסוף את המדדים של
+הרסיברים לתצוגת צי (fleet) אחת.
+"""
+import math
+import re
+import threading
+
+# שניות: מאיחור של מילישניות בודדות ועד דקה
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def format_value(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return 'NaN'
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in labels.values())
+    return '{' + ','.join(f'{k}="{v}"' for k, v in zip(labels.keys(), escaped)) + '}'
+
+
+class Metric:
+    type = 'untyped'
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}   # tuple של (שם תווית, ערך) -> ערך
+        self._lock = threading.Lock()
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, dict(key), value) for key, value in sorted(self._values.items())]
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value, **labels):
+        """משקף מונה שכבר נספר במקום אחר (למשל PlayerChannel.plays)."""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = value
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            if value is None:
+                self._values.pop(key, None)
+            else:
+                self._values[key] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            state = self._values.setdefault(key, {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['counts'][i] += 1
+            state['sum'] += value
+            state['count'] += 1
+
+    def samples(self):
+        result = []
+        with self._lock:
+            for key, state in sorted(self._values.items()):
+                labels = dict(key)
+                for bound, count in zip(self.buckets, state['counts']):
+                    result.append((f'{self.name}_bucket', dict(labels, le=format_value(bound)), count))
+                result.append((f'{self.name}_sum', labels, state['sum']))
+                result.append((f'{self.name}_count', labels, state['count']))
+        return result
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation):
+        return self._add(Counter(name, documentation))
+
+    def gauge(self, name, documentation):
+        return self._add(Gauge(name, documentation))
+
+    def histogram(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, documentation, buckets))
+
+    def add_collector(self, collect):
+        """collect() נקראת לפני כל render, לעדכון מדדים ממצב קיים."""
+        self._collectors.append(collect)
+
+    def render(self):
+        for collect in self._collectors:
+            collect()
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+# --- קריאת מדדים של רסיבר (לתצוגת הצי בשרת) ---
+_SAMPLE_RE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{(.*)\})?\s+(\S+)')
+_LABEL_RE = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+_META_RE = re.compile(r'^#\s+(HELP|TYPE)\s+([a-zA-Z_:][a-zA-Z0-9_:]*)\s?(.*)$')
+_FAMILY_SUFFIXES = ('_bucket', '_sum', '_count')
+FLEET_PREFIX = 'ringer_fleet_'
+
+
+def fleet_name(name):
+    """שם מדד של רסיבר בתצוגת הצי: ringer_x -> ringer_fleet_x, כדי שלא יתנגש במדדי השרת."""
+    return FLEET_PREFIX + (name[len('ringer_'):] if name.startswith('ringer_') else name)
+
+
+def family_of(name, families):
+    """המשפחה (השם שב-TYPE) שהדגימה שייכת לה; x_bucket/x_sum/x_count שייכות ל-x."""
+    if name not in families:
+        for suffix in _FAMILY_SUFFIXES:
+            if name.endswith(suffix) and name[:-len(suffix)] in families:
+                return name[:-len(suffix)]
+    return name
+
+
+def render_fleet(scrapes):
+    """מדדי הרסיברים לייצוא מחדש מהשרת.
+
+    scrapes: {רסיבר: (דגימות, families)}. כל משפחה מקבלת שם ringer_fleet_*,
+    שורות HELP/TYPE משלה, ואת הדגימות של כל הרסיברים ברצף אחד עם התווית receiver.
+    """
+    grouped = {}
+    for receiver, (samples, families) in scrapes.items():
+        for name, labels, value in samples:
+            family = family_of(name, families)
+            entry = grouped.setdefault(family, {'meta': families.get(family, {}), 'samples': []})
+            entry['samples'].append((fleet_name(name), dict(labels, receiver=receiver), value))
+    lines = []
+    for family, entry in grouped.items():
+        name = fleet_name(family)
+        lines.append(f"# HELP {name} {entry['meta'].get('help') or 'Receiver metric ' + family}")
+        lines.append(f"# TYPE {name} {entry['meta'].get('type', 'untyped')}")
+        for sample_name, labels, value in entry['samples']:
+            lines.append(f'{sample_name}{format_labels(labels)} {format_value(value)}')
+    return '\n'.join(lines) + '\n' if lines else ''
+
+
+def sample_value(samples, name, **labels):
+    """הערך של הדגימה הראשונה בשם name שהתוויות שלה כוללות את labels, או None."""
+    for sample_name, sample_labels, value in samples:
+        if sample_name == name and all(sample_labels.get(k) == v for k, v in labels.items()):
+            return value
+    return None
+
+
+def histogram_mean(samples, name, **labels):
+    """ממוצע היסטוגרמה (sum/count), או None אם אין תצפיות."""
+    count = sample_value(samples, f'{name}_count', **labels)
+    if not count:
+        return None
+    return sample_value(samples, f'{name}_sum', **labels) / count
+
+
+def parse_metrics(text):
+    """מחזיר רשימת (שם, תוויות, ערך) מטקסט בפורמט Prometheus."""
+    samples = []
+    for line in text.splitlines():
+        if not line or line.startswith('#'):
+            continue
+        match = _SAMPLE_RE.match(line)
+        if not match:
+            continue
+        labels = {k: v.replace('\\"', '"').replace('\\n', '\n').replace('\\\\', '\\')
+                  for k, v in _LABEL_RE.findall(match.group(3) or '')}
+        try:
+            value = float(match.group(4))
+        except ValueError:
+            continue
+        samples.append((match.group(1), labels, value))
+    return samples
+
+
+def parse_families(text):
+    """מחזיר {משפחה: {'type', 'help'}} משורות ה-HELP/TYPE של טקסט בפורמט Prometheus."""
+    families = {}
+    for line in text.splitlines():
+        match = _META_RE.match(line)
+        if match:
+            families.setdefault(match.group(2), {})[match.group(1).lower()] = match.group(3)
+    return families
+
+
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+מיגרציה חד-פעמית מקבצי ה-JSON (storage/songs, storage/events, storage/calendar) למסד SQLite.
+
+שימוש:
+    python migrate_storage.py [storage]
+
+הקבצים המקוריים לא נמחקים, וההרצה בטוחה לחזרה (רשומה קיימת נדרסת).
+קבצים פגומים מדווחים ולא מועברים. אחרי המיגרציה מפעילים את השרת
+(או הרסיבר) עם RINGER_STORAGE=sqlite.
+"""
+import json
+import logging
+import os
+import sys
+
+from sqlite_catalog import DB_FILENAME, connect, put_many
+
+KINDS = ('songs', 'events', 'calendar')
+
+
+def read_folder(folder):
+    """מחזיר (רשומות תקינות, שמות קבצים פגומים) מתיקיית JSON."""
+    items, broken = [], []
+    if not os.path.isdir(folder):
+        return items, broken
+    for entry in sorted(os.scandir(folder), key=lambda e: e.name):
+        if not entry.name.endswith('.json') or not entry.is_file():
+            continue
+        try:
+            with open(entry.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"קובץ פגום לא הועבר: {entry.path} ({e})")
+            broken.append(entry.name)
+            continue
+        data.setdefault('id', entry.name[:-len('.json')])
+        items.append(data)
+    return items, broken
+
+
+def migrate(storage_folder, db_path=None):
+    """מעביר את כל הסוגים למסד, כל סוג בטרנזקציה אחת. מחזיר {kind: (הועברו, פגומים)}."""
+    db_path = db_path or os.environ.get('RINGER_DB') or os.path.join(storage_folder, DB_FILENAME)
+    conn = connect(db_path)
+    summary = {}
+    try:
+        for kind in KINDS:
+            items, broken = read_folder(os.path.join(storage_folder, kind))
+            if items:
+                put_many(conn, kind, items)
+            summary[kind] = (len(items), broken)
+            logging.info(f"{kind}: הועברו {len(items)} רשומות, {len(broken)} קבצים פגומים.")
+    finally:
+        conn.close()
+    return summary
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - (Migrate) - %(message)s')
+    storage = sys.argv[1] if len(sys.argv) > 1 else 'storage'
+    result = migrate(storage)
+    if any(broken for _, broken in result.values()):
+        sys.exit(1)
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+מנוע הניגון של הרסיבר.
+
+במקום להפעיל mpg123 חדש לכל צלצול, כל ערוץ מחזיק תהליך mpg123 אחד
+שרץ כל הזמן במצב שליטה מרחוק (-R) ומקבל פקודות LOAD/STOP/VOLUME.
+יש שני ערוצים: צלצולים והכרזות (פאניק). הכרזה עוצרת צלצול שמתנגן
+ומנמיכה (ducking) צלצולים שמגיעים בזמן ההכרזה, כך שצלצול לעולם לא
+נחסם ולא מתפספס בגלל הכרזה ארוכה. זמן ההתחלה של כל ניגון (מ-LOAD
+ועד שהמפענח התחיל לנגן) נמדד ונשמר.
+
+כמה צלצולים באותו מופע מנוגנים אחד אחרי השני (play_sequence): הבא נטען
+כשהקודם הסתיים, כי LOAD מחליף את מה שמתנגן. mpg123 מפענח רק MPEG, ולכן
+הכרזה בפורמט אחר (הקלטת webm/ogg מהדפדפן) מנוגנת ב-FILE_PLAYER_CMD.
+"""
+import logging
+import os
+import subprocess
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+PLAYER_CMD = os.environ.get('RINGER_PLAYER', 'mpg123 -R').split()
+# נגן לקבצים ש-mpg123 לא מפענח; נתיב הקובץ מתווסף בסוף
+FILE_PLAYER_CMD = os.environ.get('RINGER_FILE_PLAYER', 'ffplay -nodisp -autoexit -loglevel error').split()
+MPEG_EXTENSIONS = ('.mp3', '.mp2', '.mpga')
+# עוצמת צלצול (באחוזים) כשהכרזה מתנגנת במקביל
+BELL_DUCK_VOLUME = int(os.environ.get('RINGER_BELL_DUCK_VOLUME', '20'))
+FULL_VOLUME = 100
+# הכרזה ארוכה מזה נחשבת תקועה
+ANNOUNCEMENT_TIMEOUT_SECONDS = 15 * 60
+LATENCY_SAMPLES = 100
+
+
+class PlayerChannel:
+    """ערוץ ניגון אחד: תהליך mpg123 -R ארוך חיים, עם thread שקורא את הפלט שלו."""
+
+    def __init__(self, name, cmd=PLAYER_CMD):
+        self.name = name
+        self.cmd = list(cmd)
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.plays = 0
+        self.failures = 0
+        self.restarts = 0
+        self._proc = None
+        self._lock = threading.Lock()
+        self._finished = threading.Event()
+        self._finished.set()
+        self._load_sent_at = None
+        # קבצים שממתינים לניגון אחרי הנוכחי (play_sequence), והעוצמה שלהם
+        self._pending = deque()
+        self._volume = FULL_VOLUME
+        # זמן (epoch) שבו הניגון האחרון התחיל בפועל, ומאזינים לזמן ההתחלה (מדדים)
+        self.last_started_at = None
+        self._start_listeners = []
+
+    # --- ניהול התהליך ---
+    def _ensure_process(self):
+        if self._proc is not None and self._proc.poll() is None:
+            return self._proc
+        if self._proc is not None:
+            self.restarts += 1
+            logging.warning(f"נגן הערוץ '{self.name}' נפל (קוד {self._proc.returncode}); מפעיל מחדש.")
+        self._proc = subprocess.Popen(
+            self.cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, text=True, bufsize=1)
+        # בלי הודעות התקדמות (@F) לכל פריים - רק אירועי התחלה/סיום
+        self._proc.stdin.write('SILENCE\n')
+        self._proc.stdin.flush()
+        threading.Thread(target=self._read_output, args=(self._proc,),
+                         name=f'player-{self.name}', daemon=True).start()
+        return self._proc
+
+    def _read_output(self, proc):
+        """קורא את הפלט של mpg123: @S = התחיל לפענח, @P 0/3 = הסתיים, @E = שגיאה."""
+        for line in proc.stdout:
+            if line.startswith('@S') and self._load_sent_at is not None:
+                latency_ms = (time.monotonic() - self._load_sent_at) * 1000
+                self.latencies.append(latency_ms)
+                self._load_sent_at = None
+                self.last_started_at = time.time()
+                logging.info(f"ערוץ '{self.name}': הניגון התחיל תוך {latency_ms:.1f} ms.")
+                for listener in self._start_listeners:
+                    try:
+                        listener(self.name, latency_ms / 1000)
+                    except Exception as e:
+                        logging.error(f"שגיאה במאזין לתחילת ניגון בערוץ '{self.name}': {e}")
+            elif (line.startswith('@P 0') or line.startswith('@P 3')) and self._load_sent_at is None:
+                # עצירה שמגיעה לפני @S שייכת לקובץ הקודם ולא לזה שנטען עכשיו
+                if not self._play_next():
+                    self._finished.set()
+            elif line.startswith('@E'):
+                self._load_sent_at = None
+                self.failures += 1
+                logging.error(f"ערוץ '{self.name}': שגיאת נגן: {line.strip()}")
+                if not self._play_next():
+                    self._finished.set()
+        # התהליך הסתיים: איסוף (reap) כדי שלא יישאר zombie
+        proc.wait()
+        self._finished.set()
+
+    def _send(self, command):
+        proc = self._ensure_process()
+        proc.stdin.write(command + '\n')
+        proc.stdin.flush()
+
+    def add_start_listener(self, callback):
+        """callback(שם הערוץ, זמן התחלה בשניות) נקרא בכל פעם שניגון מתחיל בפועל."""
+        self._start_listeners.append(callback)
+
+    # --- פקודות ---
+    def play(self, file_path, volume=FULL_VOLUME):
+        """מתחיל לנגן קובץ (לא חוסם), במקום מה שמתנגן ומה שממתין. מחזיר False אם הנגן לא זמין."""
+        return self.play_sequence([file_path], volume)
+
+    def play_sequence(self, file_paths, volume=FULL_VOLUME):
+        """מנגן את הקבצים אחד אחרי השני (לא חוסם); wait() מחכה לסוף האחרון."""
+        with self._lock:
+            self._pending.clear()
+            self._pending.extend(file_paths[1:])
+            return self._load(file_paths[0], volume)
+
+    def _play_next(self):
+        """טוען את הקובץ הבא בתור (נקרא כשהקודם הסתיים). מחזיר False אם אין."""
+        with self._lock:
+            while self._pending:
+                if self._load(self._pending.popleft(), self._volume):
+                    return True
+            return False
+
+    def _load(self, file_path, volume):
+        """שולח VOLUME ו-LOAD לנגן (תחת self._lock). מחזיר False אם הנגן לא זמין."""
+        try:
+            self._finished.clear()
+            self._volume = volume
+            self._send(f'VOLUME {volume}')
+            self._load_sent_at = time.monotonic()
+            self._send(f'LOAD {os.path.abspath(file_path)}')
+            self.plays += 1
+            return True
+        except FileNotFoundError:
+            logging.critical(f"פקודת {self.cmd[0]} לא נמצאה. ודא שהיא מותקנת.")
+        except (BrokenPipeError, OSError) as e:
+            logging.error(f"שגיאה בשליחת פקודה לנגן '{self.name}': {e}")
+        self.failures += 1
+        self._finished.set()
+        return False
+
+    def set_volume(self, volume):
+        with self._lock:
+            self._volume = volume
+            if self._proc is not None and self._proc.poll() is None:
+                self._send(f'VOLUME {volume}')
+
+    def stop(self):
+        """עוצר את הניגון ומבטל את מה שממתין בתור."""
+        with self._lock:
+            self._pending.clear()
+            if self._proc is not None and self._proc.poll() is None:
+                self._send('STOP')
+
+    def is_playing(self):
+        return not self._finished.is_set()
+
+    def wait(self, timeout=None):
+        """ממתין לסוף הניגון הנוכחי. מחזיר False אם עבר ה-timeout."""
+        return self._finished.wait(timeout)
+
+    def close(self):
+        with self._lock:
+            if self._proc is not None and self._proc.poll() is None:
+                try:
+                    self._proc.stdin.write('QUIT\n')
+                    self._proc.stdin.flush()
+                    self._proc.wait(timeout=2)
+                except (BrokenPipeError, OSError, subprocess.TimeoutExpired):
+                    self._proc.kill()
+                    self._proc.wait()
+
+    def stats(self):
+        samples = list(self.latencies)
+        return {
+            'plays': self.plays,
+            'failures': self.failures,
+            'restarts': self.restarts,
+            'playing': self.is_playing(),
+            'last_start_latency_ms': round(samples[-1], 1) if samples else None,
+            'avg_start_latency_ms': round(sum(samples) / len(samples), 1) if samples else None,
+            'max_start_latency_ms': round(max(samples), 1) if samples else None,
+        }
+
+
+class PlaybackEngine:
+    """שני ערוצים קבועים: צלצולים והכרזות. הכרזה קודמת לצלצול ומנמיכה אותו."""
+
+    def __init__(self, cmd=PLAYER_CMD):
+        self.bells = PlayerChannel('bells', cmd)
+        self.announcements = PlayerChannel('announcements', cmd)
+        self._active_announcements = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        """מפעיל מראש את תהליכי הנגן, כדי שהצלצול הראשון לא ישלם על ההפעלה."""
+        for channel in (self.bells, self.announcements):
+            try:
+                with channel._lock:
+                    channel._ensure_process()
+            except FileNotFoundError:
+                logging.critical(f"פקודת {channel.cmd[0]} לא נמצאה. ודא שהיא מותקנת.")
+        return self
+
+    def play_bell(self, file_path):
+        """צלצול: מתחיל מיד ולא חוסם; בזמן הכרזה מתנגן בעוצמה מונמכת."""
+        return self.play_bells([file_path])
+
+    def play_bells(self, file_paths):
+        """כמה צלצולים של אותו מופע: הראשון מיד, והשאר אחד אחרי השני."""
+        with self._lock:
+            volume = BELL_DUCK_VOLUME if self._active_announcements else FULL_VOLUME
+        return self.bells.play_sequence(file_paths, volume)
+
+    @contextmanager
+    def announcement(self):
+        """מסמן הכרזה פעילה: עוצר צלצול שמתנגן כרגע, וצלצולים חדשים יונמכו עד הסוף."""
+        with self._lock:
+            self._active_announcements += 1
+        if self.bells.is_playing():
+            self.bells.stop()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active_announcements -= 1
+                restore = self._active_announcements == 0
+            if restore:
+                self.bells.set_volume(FULL_VOLUME)
+
+    def play_announcement(self, file_path):
+        """מנגן הכרזה עד סופה (חוסם). מחזיר True אם הניגון הסתיים כסדרו."""
+        with self.announcement():
+            if not file_path.lower().endswith(MPEG_EXTENSIONS):
+                return self._play_with_file_player(file_path)
+            failures_before = self.announcements.failures
+            if not self.announcements.play(file_path):
+                return False
+            if not self.announcements.wait(ANNOUNCEMENT_TIMEOUT_SECONDS):
+                logging.error(f"הכרזה לא הסתיימה תוך {ANNOUNCEMENT_TIMEOUT_SECONDS} שניות; עוצר.")
+                self.announcements.stop()
+                return False
+            return self.announcements.failures == failures_before
+
+    def _play_with_file_player(self, file_path):
+        """מנגן בתהליך FILE_PLAYER_CMD נפרד עד הסוף (נספר במדדים של ערוץ ההכרזות)."""
+        channel = self.announcements
+        try:
+            proc = subprocess.Popen(FILE_PLAYER_CMD + [os.path.abspath(file_path)],
+                                    stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+        except FileNotFoundError:
+            logging.critical(f"פקודת {FILE_PLAYER_CMD[0]} לא נמצאה. ודא שהיא מותקנת.")
+            channel.failures += 1
+            return False
+        channel.plays += 1
+        # אין אירוע התחלה כמו ב-mpg123; זמן ההפעלה הוא הקירוב הטוב ביותר
+        channel.last_started_at = time.time()
+        try:
+            returncode = proc.wait(ANNOUNCEMENT_TIMEOUT_SECONDS)
+        except subprocess.TimeoutExpired:
+            logging.error(f"הכרזה לא הסתיימה תוך {ANNOUNCEMENT_TIMEOUT_SECONDS} שניות; עוצר.")
+            proc.kill()
+            proc.wait()
+            return False
+        if returncode != 0:
+            channel.failures += 1
+            logging.error(f"נגן הקבצים החזיר קוד {returncode} עבור {file_path}.")
+            return False
+        return True
+
+    def add_start_listener(self, callback):
+        for channel in (self.bells, self.announcements):
+            channel.add_start_listener(callback)
+
+    def stats(self):
+        return {'bells': self.bells.stats(), 'announcements': self.announcements.stats()}
+
+    def close(self):
+        self.bells.close()
+        self.announcements.close()
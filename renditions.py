@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+גרסת ניגון (rendition) מוכנה מראש לכל שיר.
+
+בזמן ההעלאה השרת מפיק מהקובץ המקורי קובץ ניגון קנוני: חתוך לפי
+clipStart/clipEnd, בלי שקט בהתחלה, עם עוצמה מנורמלת (loudnorm) וב-MP3
+CBR אחיד. mpg123 בנגן מפענח רק MPEG, ולכן הפורמט נשאר MP3; העבודה
+הכבדה (חיתוך, נרמול, שקט) נעשית פעם אחת בשרת ולא בכל צלצול. הרסיבר
+טוען את הקובץ מראש ל-page cache, כך שהצלצול מתחיל מיד.
+"""
+import logging
+import os
+import subprocess
+
+from audio_cache import file_sha256
+from content_store import store_file, temp_path
+
+FFMPEG_CMD = os.environ.get('RINGER_FFMPEG', 'ffmpeg').split()
+# יעד עוצמה (EBU R128) ושקט שנחתך מתחילת השיר
+LOUDNESS_TARGET_LUFS = -16
+SILENCE_THRESHOLD_DB = -50
+RENDITION_BITRATE = '192k'
+RENDITION_SAMPLE_RATE = 44100
+# יש להעלות כשמשנים את הפרמטרים, כדי שכל השירים יופקו מחדש
+RENDITION_VERSION = 1
+RENDER_TIMEOUT_SECONDS = 300
+RENDITION_FIELDS = ('renditionFilename', 'renditionUrl', 'renditionHash', 'renditionKey')
+
+
+def rendition_key(song):
+    """מה שקובע את תוכן גרסת הניגון: המקור, החיתוך וגרסת הפרמטרים."""
+    return f"v{RENDITION_VERSION}:{song.get('contentHash')}:{song.get('clipStart')}:{song.get('clipEnd')}"
+
+
+def _seconds(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if value > 0 else None
+
+
+def render_song(source_path, dest_path, clip_start=None, clip_end=None):
+    """מפיק גרסת ניגון מ-source_path ל-dest_path. זורק RuntimeError אם ffmpeg נכשל."""
+    clip_start, clip_end = _seconds(clip_start), _seconds(clip_end)
+    cmd = FFMPEG_CMD + ['-hide_banner', '-loglevel', 'error', '-nostdin', '-y']
+    if clip_start:
+        cmd += ['-ss', f'{clip_start:.3f}']
+    if clip_end and (not clip_start or clip_end > clip_start):
+        cmd += ['-to', f'{clip_end:.3f}']
+    cmd += [
+        '-i', source_path,
+        '-vn', '-af',
+        f'silenceremove=start_periods=1:start_threshold={SILENCE_THRESHOLD_DB}dB,'
+        f'loudnorm=I={LOUDNESS_TARGET_LUFS}:TP=-1.5:LRA=11',
+        '-ar', str(RENDITION_SAMPLE_RATE), '-ac', '2',
+        '-codec:a', 'libmp3lame', '-b:a', RENDITION_BITRATE, '-f', 'mp3',
+    ]
+    tmp_path = dest_path + '.part'
+    try:
+        result = subprocess.run(cmd + [tmp_path], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                text=True, timeout=RENDER_TIMEOUT_SECONDS)
+        if result.returncode != 0 or not os.path.getsize(tmp_path):
+            raise RuntimeError(f"ffmpeg failed ({result.returncode}): {result.stderr.strip()[-500:]}")
+        os.replace(tmp_path, dest_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return dest_path
+
+
+def update_song_rendition(song, folder):
+    """
+    מפיק לשיר גרסת ניגון אם המקור או החיתוך השתנו, ומעדכן את השדות
+    renditionFilename/renditionUrl/renditionHash/renditionKey.
+    מחזיר את שם קובץ הגרסה הקודמת שכבר לא בשימוש השיר, או None. הקובץ נשמר לפי
+    תוכן ועלול להיות משותף לשיר אחר, ולכן נמחק רק ע"י אוסף הקבצים (content_store).
+    אם ההפקה נכשלה (למשל ffmpeg לא מותקן) השיר נשאר בלי גרסה והרסיברים מנגנים את המקור.
+    """
+    if not song.get('filename') or not song.get('contentHash'):
+        return None
+    key = rendition_key(song)
+    previous = song.get('renditionFilename')
+    if song.get('renditionKey') == key and previous and os.path.exists(os.path.join(folder, previous)):
+        return None
+
+    dest_path = temp_path(folder, '.mp3')
+    try:
+        render_song(os.path.join(folder, song['filename']), dest_path,
+                    song.get('clipStart'), song.get('clipEnd'))
+    except Exception as e:
+        if isinstance(e, FileNotFoundError) and not os.path.exists(os.path.join(folder, song['filename'])):
+            logging.error(f"קובץ המקור של השיר '{song.get('name')}' חסר; אין גרסת ניגון.")
+        elif isinstance(e, FileNotFoundError):
+            logging.warning(f"פקודת {FFMPEG_CMD[0]} לא נמצאה; השיר '{song.get('name')}' יתנגן מהקובץ המקורי.")
+        else:
+            logging.error(f"שגיאה בהפקת גרסת ניגון לשיר '{song.get('name')}': {e}")
+        # גרסה ישנה כבר לא מתאימה לחיתוך/למקור הנוכחיים
+        for field in RENDITION_FIELDS:
+            song.pop(field, None)
+        return previous
+
+    rendition_hash = file_sha256(dest_path)
+    filename, _ = store_file(dest_path, folder, '.mp3', rendition_hash)
+    song['renditionFilename'] = filename
+    song['renditionUrl'] = f'/api/song_file/{filename}'
+    song['renditionHash'] = rendition_hash
+    song['renditionKey'] = key
+    logging.info(f"גרסת ניגון הופקה לשיר '{song.get('name')}': {filename}")
+    return previous
+
+
+def warm_file(path):
+    """מבקש מהקרנל לטעון את הקובץ ל-page cache מראש (בלי לחסום)."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return False
+    try:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        else:
+            while os.read(fd, 1024 * 1024):
+                pass
+        return True
+    finally:
+        os.close(fd)
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+מנוע אחסון SQLite לקטלוג (חלופה לקובץ JSON לכל רשומה).
+
+כל הרשומות של כל הסוגים (שירים, אירועים) נשמרות בטבלה אחת בקובץ
+storage/ringer.db, במצב WAL ובטרנזקציות, כך שנפילה באמצע כתיבה לא
+משאירה רשומה פגומה. העמודות songId/day/time מאונדקסות לשאילתות של
+לוח הזמנים ושל הפניות לשירים. הממשק זהה ל-JsonCatalog (ראה catalog.py),
+וכתיבות של תהליכים אחרים מזוהות לפי PRAGMA data_version.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+# PRAGMA data_version זול, ולכן נבדק בכל קריאה: כתיבה של worker אחר נראית מיד
+REFRESH_INTERVAL_SECONDS = 0
+DB_FILENAME = 'ringer.db'
+# עמודות מאונדקסות (שם שדה ברשומה -> שם עמודה)
+INDEXED_FIELDS = {'songId': 'song_id', 'day': 'day', 'time': 'time'}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    kind TEXT NOT NULL,
+    id TEXT NOT NULL,
+    data TEXT NOT NULL,
+    song_id TEXT,
+    day TEXT,
+    time TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (kind, id)
+);
+CREATE INDEX IF NOT EXISTS records_song_id ON records (kind, song_id);
+CREATE INDEX IF NOT EXISTS records_day_time ON records (kind, day, time);
+"""
+
+
+def default_db_path(folder):
+    """המסד יושב בתיקיית האחסון שמעל תיקיות השירים/האירועים."""
+    return os.environ.get('RINGER_DB') or os.path.join(os.path.dirname(os.path.abspath(folder)), DB_FILENAME)
+
+
+def connect(db_path):
+    conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=10)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _row_values(kind, data):
+    item_id = str(data['id'])
+    indexed = [None if data.get(field) is None else str(data.get(field)) for field in INDEXED_FIELDS]
+    return [kind, item_id, json.dumps(data, ensure_ascii=False, separators=(',', ':'))] + indexed + [time.time()]
+
+
+def put_many(conn, kind, items):
+    """כותב רשומות רבות בטרנזקציה אחת (משמש גם את המיגרציה)."""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.executemany(
+            'INSERT OR REPLACE INTO records (kind, id, data, song_id, day, time, updated_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [_row_values(kind, data) for data in items])
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+
+class SqliteCatalog:
+    """קטלוג של סוג רשומות אחד (kind) בתוך מסד SQLite משותף, עם עותק בזיכרון."""
+
+    def __init__(self, folder, db_path=None, refresh_interval=REFRESH_INTERVAL_SECONDS):
+        self.folder = folder
+        self.kind = os.path.basename(os.path.normpath(folder))
+        self.db_path = db_path or default_db_path(folder)
+        self.refresh_interval = refresh_interval
+        self.version = 0
+        self._items = {}     # מזהה -> רשומה
+        self._raw = {}       # מזהה -> ה-JSON כפי שנשמר (לזיהוי שינויים חיצוניים)
+        self._listeners = []
+        self._lock = threading.RLock()
+        self._last_scan = 0.0
+        self._data_version = None
+        self._conn = connect(self.db_path)
+
+    # --- האזנה לשינויים ---
+    def add_listener(self, callback):
+        """רושם פונקציה שתיקרא כ-callback(catalog, op, item_id) אחרי כל שינוי ('put'/'delete')."""
+        self._listeners.append(callback)
+
+    def _notify(self, op, item_id):
+        self.version += 1
+        for callback in self._listeners:
+            try:
+                callback(self, op, item_id)
+            except Exception as e:
+                logging.error(f"שגיאה במאזין קטלוג ({self.kind}): {e}")
+
+    # --- סנכרון מול המסד ---
+    def load(self):
+        """טעינה ראשונה בעלייה (שלמות הנתונים מובטחת ע"י הטרנזקציות של SQLite)."""
+        self.refresh(force=True)
+        return self
+
+    def refresh(self, force=False):
+        """טוען מחדש את הרשומות רק אם תהליך אחר כתב למסד מאז הבדיקה הקודמת."""
+        now = time.monotonic()
+        if not force and now - self._last_scan < self.refresh_interval:
+            return
+        with self._lock:
+            self._last_scan = now
+            data_version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+            if not force and data_version == self._data_version:
+                return
+            self._data_version = data_version
+
+            rows = self._conn.execute('SELECT id, data FROM records WHERE kind = ?', (self.kind,)).fetchall()
+            seen = set()
+            for item_id, raw in rows:
+                seen.add(item_id)
+                if self._raw.get(item_id) == raw:
+                    continue
+                try:
+                    data = json.loads(raw)
+                except ValueError as e:
+                    logging.warning(f"רשומה פגומה במסד ({self.kind}/{item_id}): {e}")
+                    continue
+                self._items[item_id] = data
+                self._raw[item_id] = raw
+                self._notify('put', item_id)
+
+            for item_id in [i for i in self._items if i not in seen]:
+                self._items.pop(item_id, None)
+                self._raw.pop(item_id, None)
+                self._notify('delete', item_id)
+
+    # --- קריאה ---
+    def list(self):
+        """כל הרשומות (עותקים), מהזיכרון."""
+        self.refresh()
+        with self._lock:
+            return [dict(item) for item in self._items.values()]
+
+    def get(self, item_id):
+        """רשומה לפי מזהה או None."""
+        self.refresh()
+        with self._lock:
+            item = self._items.get(str(item_id))
+            return dict(item) if item is not None else None
+
+    def peek(self, item_id):
+        """רשומה מהזיכרון בלבד, בלי בדיקת שינויים במסד (למאזינים)."""
+        with self._lock:
+            item = self._items.get(str(item_id))
+            return dict(item) if item is not None else None
+
+    def find(self, **fields):
+        """רשומות לפי שדות מאונדקסים (songId, day, time), בשאילתה על האינדקס."""
+        unknown = set(fields) - set(INDEXED_FIELDS)
+        if unknown:
+            raise ValueError(f"Not an indexed field: {', '.join(sorted(unknown))}")
+        where = ' AND '.join(f'{INDEXED_FIELDS[field]} = ?' for field in fields)
+        query = 'SELECT data FROM records WHERE kind = ?' + (f' AND {where}' if where else '')
+        with self._lock:
+            rows = self._conn.execute(query, [self.kind] + [str(v) for v in fields.values()]).fetchall()
+        return [json.loads(raw) for (raw,) in rows]
+
+    # --- כתיבה ---
+    def put(self, data):
+        """כותב רשומה למסד (בטרנזקציה) ומעדכן את הזיכרון. data חייב להכיל 'id'."""
+        self.put_many([data])
+        return data
+
+    def put_many(self, items):
+        """כותב רשומות רבות בטרנזקציה אחת ומעדכן את הזיכרון."""
+        items = [dict(data, id=str(data['id'])) for data in items]
+        if not items:
+            return items
+        with self._lock:
+            put_many(self._conn, self.kind, items)
+            for data in items:
+                self._items[data['id']] = data
+                self._raw[data['id']] = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+            for data in items:
+                self._notify('put', data['id'])
+        return items
+
+    def apply(self, items, deleted_ids):
+        """כתיבות ומחיקות בטרנזקציה אחת. מחזיר (רשומות שנכתבו, מזהים שנמחקו)."""
+        items = [dict(data, id=str(data['id'])) for data in items]
+        put_ids = {data['id'] for data in items}
+        deleted_ids = [str(item_id) for item_id in deleted_ids if str(item_id) not in put_ids]
+        if not items and not deleted_ids:
+            return items, deleted_ids
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._conn.executemany(
+                    'INSERT OR REPLACE INTO records (kind, id, data, song_id, day, time, updated_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    [_row_values(self.kind, data) for data in items])
+                removed = [item_id for item_id in deleted_ids if self._conn.execute(
+                    'DELETE FROM records WHERE kind = ? AND id = ?', (self.kind, item_id)).rowcount > 0]
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+            for data in items:
+                self._items[data['id']] = data
+                self._raw[data['id']] = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+            for item_id in deleted_ids:
+                if self._items.pop(item_id, None) is not None and item_id not in removed:
+                    removed.append(item_id)
+                self._raw.pop(item_id, None)
+            for data in items:
+                self._notify('put', data['id'])
+            for item_id in removed:
+                self._notify('delete', item_id)
+        return items, removed
+
+    def delete(self, item_id):
+        """מוחק רשומה מהמסד ומהזיכרון. מחזיר False אם לא הייתה קיימת."""
+        item_id = str(item_id)
+        with self._lock:
+            cursor = self._conn.execute('DELETE FROM records WHERE kind = ? AND id = ?', (self.kind, item_id))
+            existed = cursor.rowcount > 0
+            if item_id in self._items:
+                self._items.pop(item_id, None)
+                self._raw.pop(item_id, None)
+                self._notify('delete', item_id)
+                existed = True
+            return existed
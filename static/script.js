@@ -11,6 +11,7 @@ const DOM_ELEMENTS = {
     sendPanicBtn: document.getElementById('send-panic'),
     playback: document.getElementById('panic-playback'),
     recordStatus: document.getElementById('record-status'),
+    liveMode: document.getElementById('live-mode'),
     // שירים
     songList: document.getElementById('song-list'),
     addSongBtn: document.getElementById('add-song-btn'),
@@ -35,6 +36,10 @@ const DOM_ELEMENTS = {
     newEventTime: document.getElementById('new-event-time'),
     newEventDay: document.getElementById('new-event-day'),
     eventSongSelect: document.getElementById('event-song-select'),
+    newEventProfile: document.getElementById('new-event-profile'),
+    newEventStartDate: document.getElementById('new-event-start-date'),
+    newEventEndDate: document.getElementById('new-event-end-date'),
+    newEventExceptDates: document.getElementById('new-event-except-dates'),
     eventForm: document.getElementById('event-form')
 };
 
@@ -49,7 +54,14 @@ let currentSongId = -1; // ה-ID של השיר הנערך/נשמר כרגע
 let isSongEditMode = false;
 let isEditMode = false;
 let editingEventIndex = -1;
+let editingEvent = {};
 let panicAudioBlob = null;
+let liveStream = null; // שידור חי פעיל: { id, offset, queue }
+let dataRev = null; // ה-rev של יומן השינויים שהרשימות בזיכרון מעודכנות אליו
+let liveUpdates = null; // EventSource של /api/live
+const LIVE_RECONNECT_MS = 10000; // אחרי שהשרת סירב (503 - יותר מדי זרמים פתוחים)
+const LIVE_CHUNK_MS = 250; // אורך כל חלק שנשלח בזמן שידור חי
+const UPLOAD_MAX_RETRIES = 8; // ניסיונות חוזרים רצופים לחלק אחד לפני שההעלאה נכשלת
 
 document.addEventListener('DOMContentLoaded', () => {
     initTabs();
@@ -71,16 +83,69 @@ async function loadDataFromApi() {
         const data = await response.json();
         
         // ודא שהמזהים מעודכנים
-        songs = data.songs.map(s => ({...s, id: isNaN(s.id) ? s.id : parseInt(s.id)}) ) || [];
-        events = data.events.map(e => ({...e, id: isNaN(e.id) ? e.id : parseInt(e.id)}) ) || [];
+        songs = (data.songs || []).map(normalizeItem);
+        events = (data.events || []).map(normalizeItem);
         
         renderSongList();
         renderEvents();
+
+        if (data.rev !== undefined) {
+            dataRev = data.rev;
+            startLiveUpdates();
+        }
     } catch (err) {
         console.error("שגיאה בטעינת נתונים מהשרת:", err);
         alert('שגיאה בטעינת נתונים: ודא ששרת הפייתון פועל. ' + err.message);
     }
 }
+
+function normalizeItem(item) {
+    return {...item, id: isNaN(item.id) ? item.id : parseInt(item.id)};
+}
+
+// --- עדכונים חיים: שינויים של משתמשים אחרים מגיעים מהשרת ומוחלים על הרשימות ---
+function startLiveUpdates() {
+    if (liveUpdates || !window.EventSource) return;
+    // בהתחברות מחדש הדפדפן שולח Last-Event-ID, והשרת ממשיך מאותו rev
+    liveUpdates = new EventSource(`/api/live?since=${dataRev}`);
+    liveUpdates.addEventListener('changes', (e) => applyChanges(JSON.parse(e.data)));
+    liveUpdates.onerror = () => {
+        if (liveUpdates.readyState === EventSource.CLOSED) {
+            // הדפדפן לא מתחבר מחדש לבד אחרי תשובת שגיאה; ממשיכים מה-rev האחרון שהוחל
+            console.warn('ערוץ העדכונים החיים נסגר; מנסה להתחבר מחדש.');
+            liveUpdates = null;
+            setTimeout(startLiveUpdates, LIVE_RECONNECT_MS);
+        }
+    };
+}
+
+function upsertItem(list, item) {
+    const normalized = normalizeItem(item);
+    const index = list.findIndex(existing => String(existing.id) === String(normalized.id));
+    if (index === -1) list.push(normalized);
+    else list[index] = normalized;
+}
+
+function removeItem(list, id) {
+    const index = list.findIndex(existing => String(existing.id) === String(id));
+    if (index !== -1) list.splice(index, 1);
+}
+
+function applyChanges(changes) {
+    if (changes.full) {
+        songs = (changes.songs || []).map(normalizeItem);
+        events = (changes.events || []).map(normalizeItem);
+    } else {
+        (changes.songs || []).forEach(song => upsertItem(songs, song));
+        (changes.events || []).forEach(ev => upsertItem(events, ev));
+        const deleted = changes.deleted || {};
+        (deleted.songs || []).forEach(id => removeItem(songs, id));
+        (deleted.events || []).forEach(id => removeItem(events, id));
+    }
+    dataRev = changes.rev;
+    renderSongList();
+    renderEvents();
+}
 async function requestMicrophoneAccess() {
     try {
         const stream = await navigator.mediaDevices.getUserMedia({ audio: true });
@@ -115,6 +180,129 @@ function initTabs() {
     });
 }
 
+// --- העלאה בחלקים שאפשר לחדש (ראה uploads.py) ---
+// הקובץ נשלח בחלקים של chunkSize; אחרי ניתוק שואלים את השרת מאיזה בית להמשיך.
+// מזהה ההעלאה נשמר ב-localStorage, כך שבחירה מחדש של אותו קובץ (גם אחרי רענון) ממשיכה.
+function uploadResumeKey(kind, file) {
+    return `upload:${kind}:${file.name}:${file.size}:${file.lastModified || 0}`;
+}
+
+async function uploadErrorMessage(response) {
+    try {
+        return (await response.json()).error || response.statusText;
+    } catch (err) {
+        return response.statusText;
+    }
+}
+
+async function fetchUploadStatus(uploadId) {
+    try {
+        return await fetch(`/api/uploads/${uploadId}`, { cache: 'no-store' });
+    } catch (err) {
+        return null;
+    }
+}
+
+async function uploadResumable(file, kind, onProgress) {
+    const key = uploadResumeKey(kind, file);
+    let upload = null;
+    const savedId = localStorage.getItem(key);
+    if (savedId) {
+        const response = await fetchUploadStatus(savedId);
+        if (response && response.ok) {
+            upload = await response.json();
+            if (upload.consumed) upload = null;
+        }
+    }
+    if (!upload) {
+        const response = await fetch('/api/uploads', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ kind: kind, filename: file.name, size: file.size })
+        });
+        if (!response.ok) throw new Error(await uploadErrorMessage(response));
+        upload = await response.json();
+        localStorage.setItem(key, upload.uploadId);
+    }
+
+    let failures = 0;
+    while (!upload.complete) {
+        if (onProgress) onProgress(upload.offset / file.size);
+        let response = null;
+        try {
+            response = await fetch(`/api/uploads/${upload.uploadId}`, {
+                method: 'PATCH',
+                headers: {
+                    'Content-Type': 'application/offset+octet-stream',
+                    'Upload-Offset': String(upload.offset)
+                },
+                body: file.slice(upload.offset, upload.offset + upload.chunkSize)
+            });
+        } catch (err) {
+            console.warn("ניתוק בזמן העלאה, ממשיך מהמקום שנשמר:", err);
+        }
+        if (response && response.ok) {
+            upload = await response.json();
+            failures = 0;
+            continue;
+        }
+        // שגיאה קבועה (סוג/גודל לא נתמכים): אין טעם לנסות שוב
+        if (response && response.status !== 409 && response.status < 500) {
+            localStorage.removeItem(key);
+            throw new Error(await uploadErrorMessage(response));
+        }
+        if (++failures > UPLOAD_MAX_RETRIES) throw new Error('ההעלאה נכשלה אחרי כמה ניסיונות');
+        await new Promise(resolve => setTimeout(resolve, Math.min(30000, 1000 * 2 ** (failures - 1))));
+        const status = await fetchUploadStatus(upload.uploadId);
+        if (status && status.ok) {
+            upload = await status.json();
+        } else if (status && status.status === 404) {
+            localStorage.removeItem(key);
+            throw new Error('ההעלאה פגה בשרת; יש לנסות שוב');
+        }
+    }
+    if (onProgress) onProgress(1);
+    localStorage.removeItem(key);
+    return upload;
+}
+
+// --- שידור חי: שליחת ההקלטה בחלקים תוך כדי הקלטה ---
+async function startLiveStream() {
+    const response = await fetch('/api/panic/stream', { method: 'POST' });
+    if (!response.ok) throw new Error('שגיאה בפתיחת שידור חי');
+    const result = await response.json();
+    return { id: result.streamId, offset: 0, queue: Promise.resolve() };
+}
+
+// החלקים נשלחים אחד אחרי השני לפי הסדר; שליחה חוזרת של חלק בטוחה (השרת מזהה לפי offset)
+function sendLiveChunk(live, blob) {
+    live.queue = live.queue.then(async () => {
+        for (let attempt = 0; attempt < 3; attempt++) {
+            try {
+                const response = await fetch(`/api/panic/stream/${live.id}/chunk?offset=${live.offset}`, {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/octet-stream' },
+                    body: blob
+                });
+                if (response.ok) {
+                    live.offset += blob.size;
+                    return;
+                }
+            } catch (err) {
+                console.warn("שגיאה בשליחת חלק בשידור החי, מנסה שוב:", err);
+            }
+        }
+        throw new Error('שליחת חלק בשידור החי נכשלה');
+    });
+    return live.queue;
+}
+
+async function finishLiveStream(live) {
+    await live.queue;
+    const response = await fetch(`/api/panic/stream/${live.id}/end`, { method: 'POST' });
+    if (!response.ok) throw new Error('שגיאה בסגירת השידור החי');
+}
+
 // --- מימוש קריאה מיידית (פאניקה) ---
 function initPanicRecorder() {
     DOM_ELEMENTS.startBtn.addEventListener('click', async () => {
@@ -124,25 +312,51 @@ function initPanicRecorder() {
             const options = { mimeType: 'audio/webm' };
             mediaRecorder = new MediaRecorder(stream, options);
             audioChunks = [];
+            liveStream = DOM_ELEMENTS.liveMode.checked ? await startLiveStream() : null;
             
             mediaRecorder.ondataavailable = e => {
-                if (e.data.size > 0) audioChunks.push(e.data);
+                if (e.data.size > 0) {
+                    audioChunks.push(e.data);
+                    if (liveStream) {
+                        sendLiveChunk(liveStream, e.data).catch(err => {
+                            console.error("שגיאה בשידור החי:", err);
+                            DOM_ELEMENTS.recordStatus.textContent = "❌ השידור החי נקטע.";
+                        });
+                    }
+                }
             };
             
-            mediaRecorder.onstop = () => {
+            mediaRecorder.onstop = async () => {
                 const mimeType = mediaRecorder.mimeType.split(';')[0];
                 panicAudioBlob = new Blob(audioChunks, { type: mimeType });
                 DOM_ELEMENTS.playback.src = URL.createObjectURL(panicAudioBlob);
                 
                 DOM_ELEMENTS.stopBtn.disabled = true;
-                DOM_ELEMENTS.sendPanicBtn.disabled = false;
                 DOM_ELEMENTS.startBtn.disabled = false;
-                DOM_ELEMENTS.recordStatus.textContent = "הקלטה הושלמה. ניתן לשלוח או להקליט מחדש.";
                 stream.getTracks().forEach(track => track.stop());
+
+                if (liveStream) {
+                    // בשידור חי ההקלטה כבר נשלחה - אין צורך בשליחה נוספת
+                    const live = liveStream;
+                    liveStream = null;
+                    panicAudioBlob = null;
+                    DOM_ELEMENTS.sendPanicBtn.disabled = true;
+                    try {
+                        await finishLiveStream(live);
+                        DOM_ELEMENTS.recordStatus.textContent = "✅ השידור החי הסתיים.";
+                    } catch (err) {
+                        console.error("שגיאה בסיום השידור החי:", err);
+                        DOM_ELEMENTS.recordStatus.textContent = "❌ שגיאה בסיום השידור החי.";
+                    }
+                    return;
+                }
+
+                DOM_ELEMENTS.sendPanicBtn.disabled = false;
+                DOM_ELEMENTS.recordStatus.textContent = "הקלטה הושלמה. ניתן לשלוח או להקליט מחדש.";
             };
             
-            mediaRecorder.start();
-            DOM_ELEMENTS.recordStatus.textContent = "🔴 מקליט...";
+            mediaRecorder.start(liveStream ? LIVE_CHUNK_MS : undefined);
+            DOM_ELEMENTS.recordStatus.textContent = liveStream ? "🔴 משדר בשידור חי..." : "🔴 מקליט...";
             DOM_ELEMENTS.startBtn.disabled = true;
             DOM_ELEMENTS.stopBtn.disabled = false;
             DOM_ELEMENTS.sendPanicBtn.disabled = true;
@@ -167,20 +381,15 @@ function initPanicRecorder() {
         DOM_ELEMENTS.sendPanicBtn.disabled = true;
         DOM_ELEMENTS.recordStatus.textContent = "🚀 שולח ומפעיל קריאה...";
 
-        const formData = new FormData();
-        // שליחת הקובץ עם סיומת mp3 לצורך שמירה נכונה בשרת הפייתון
-        const filename = 'panic_message.mp3';
-        formData.append('file', panicAudioBlob, filename);
+        // הסיומת לפי הפורמט שהדפדפן הקליט בפועל (webm/ogg/mp4)
+        const subtype = (panicAudioBlob.type.split(';')[0].split('/')[1] || 'webm').replace('x-', '');
+        const extension = subtype === 'mp4' ? 'm4a' : subtype;
+        const recording = new File([panicAudioBlob], `panic_message.${extension}`, { type: panicAudioBlob.type });
 
         try {
-            const response = await fetch('/api/panic', {
-                method: 'POST',
-                body: formData
+            const result = await uploadResumable(recording, 'panic', progress => {
+                DOM_ELEMENTS.recordStatus.textContent = `🚀 שולח ומפעיל קריאה... ${Math.round(progress * 100)}%`;
             });
-
-            if (!response.ok) throw new Error('שגיאה בשליחת הקריאה לשרת');
-            
-            const result = await response.json();
             alert('✅ הקלטה נשלחה ונשמרה בתיקיית הפאניקה! שם הקובץ: ' + result.filename);
             DOM_ELEMENTS.recordStatus.textContent = "✅ קריאה מיידית נשלחה ונשמרה.";
             
@@ -377,7 +586,6 @@ async function saveSong(e) {
         return alert('⚠️ במצב יצירת שיר חדש חובה לצרף קובץ.');
     }
     
-    const formData = new FormData();
     const songMetadata = {
         name: name,
         clipStart: clipStart,
@@ -388,21 +596,21 @@ async function saveSong(e) {
         songMetadata.id = currentSongId;
     }
     
-    // טיפול בבחירת קובץ
-    if (file) {
-        formData.append('file', file, file.name);
-    } else if (isSongEditMode) {
-        // אם אין קובץ חדש במצב עריכה, שולחים קובץ ריק עם שם מיוחד.
-        const emptyBlob = new Blob([""], { type: 'application/octet-stream' });
-        formData.append('file', emptyBlob, 'no_change.txt');
-    }
-
-    formData.append('metadata', JSON.stringify(songMetadata));
-
+    const saveLabel = DOM_ELEMENTS.saveSongBtn.textContent;
+    DOM_ELEMENTS.saveSongBtn.disabled = true;
     try {
+        // קובץ חדש עולה קודם בחלקים; השיר נשמר עם מזהה ההעלאה (בלי קובץ = הקובץ הקיים נשאר)
+        if (file) {
+            const upload = await uploadResumable(file, 'song', progress => {
+                DOM_ELEMENTS.saveSongBtn.textContent = `מעלה... ${Math.round(progress * 100)}%`;
+            });
+            songMetadata.uploadId = upload.uploadId;
+        }
+
         const response = await fetch('/api/songs', {
             method: 'POST',
-            body: formData
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(songMetadata)
         });
 
         if (!response.ok) {
@@ -410,13 +618,18 @@ async function saveSong(e) {
             throw new Error('Failed to save song on server: ' + errorText);
         }
         
-        await loadDataFromApi();
+        upsertItem(songs, await response.json());
+        renderSongList();
+        renderEvents();
         DOM_ELEMENTS.addSongModal.style.display = 'none';
         alert('✅ השיר נשמר/עודכן בהצלחה!');
 
     } catch (err) {
         console.error("שגיאה בשמירת שיר:", err);
         alert('⚠️ שגיאה בשמירת שיר: ' + err.message);
+    } finally {
+        DOM_ELEMENTS.saveSongBtn.textContent = saveLabel;
+        DOM_ELEMENTS.saveSongBtn.disabled = false;
     }
 }
 
@@ -429,7 +642,9 @@ async function removeSong(id) {
             });
             if (!response.ok) throw new Error('שגיאה במחיקת השיר מהשרת');
             
-            await loadDataFromApi();
+            removeItem(songs, id);
+            renderSongList();
+            renderEvents();
             alert('🗑️ השיר נמחק בהצלחה!');
             
         } catch (err) {
@@ -478,11 +693,16 @@ function initEventsManager() {
 function openEventModal(isEdit, eventData = {}) {
     DOM_ELEMENTS.newEventName.value = eventData.name || '';
     DOM_ELEMENTS.newEventTime.value = eventData.time || '09:00';
-    DOM_ELEMENTS.newEventDay.value = eventData.day || 'ראשון';
+    DOM_ELEMENTS.newEventDay.value = eventDays(eventData)[0] || 'ראשון';
+    DOM_ELEMENTS.newEventProfile.value = eventData.profile || '';
+    DOM_ELEMENTS.newEventStartDate.value = eventData.startDate || '';
+    DOM_ELEMENTS.newEventEndDate.value = eventData.endDate || '';
+    DOM_ELEMENTS.newEventExceptDates.value = (eventData.exceptDates || []).join(', ');
     DOM_ELEMENTS.saveEventBtn.textContent = isEdit ? 'שמור שינויים' : 'שמור אירוע';
     
     isEditMode = isEdit;
     editingEventIndex = eventData.id || -1;
+    editingEvent = eventData;
     
     // מילוי סלקט השירים
     DOM_ELEMENTS.eventSongSelect.innerHTML = '<option value="">בחר שיר...</option>';
@@ -516,7 +736,20 @@ function handleSaveEvent(e) {
     if (!day) return alert('⚠️ יש לבחור יום בשבוע.');
     if (!songId) return alert('⚠️ יש לבחור שיר מתוך הרשימה.');
 
-    const eventData = { name, time, day, songId: songId };
+    const profile = DOM_ELEMENTS.newEventProfile.value.trim();
+    const startDate = DOM_ELEMENTS.newEventStartDate.value;
+    const endDate = DOM_ELEMENTS.newEventEndDate.value;
+    const exceptDates = DOM_ELEMENTS.newEventExceptDates.value.split(',').map(d => d.trim()).filter(Boolean);
+    if (exceptDates.some(d => !/^\d{4}-\d{2}-\d{2}$/.test(d))) return alert('⚠️ תאריכים בלי צלצול בפורמט YYYY-MM-DD.');
+    if (startDate && endDate && endDate < startDate) return alert('⚠️ תאריך הסיום לפני תאריך ההתחלה.');
+
+    // שדות שאין להם מקום בטופס (every, רשימת days) נשמרים כמו שהם
+    const eventData = { ...(isEditMode ? editingEvent : {}), name, time, day, songId: songId };
+    if (eventData.days && !eventData.days.includes(day)) delete eventData.days;
+    for (const [field, value] of Object.entries({ profile, startDate, endDate })) {
+        if (value) eventData[field] = value; else delete eventData[field];
+    }
+    if (exceptDates.length) eventData.exceptDates = exceptDates; else delete eventData.exceptDates;
     let apiPath = '/api/event';
     let method = 'POST';
 
@@ -532,12 +765,16 @@ function handleSaveEvent(e) {
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify(eventData)
     })
-    .then(response => {
-        if (!response.ok) throw new Error('Failed to save/update event on server');
+    .then(async response => {
+        if (!response.ok) {
+            const body = await response.json().catch(() => ({}));
+            throw new Error(body.error || 'Failed to save/update event on server');
+        }
         return response.json();
     })
-    .then(() => {
-        loadDataFromApi();
+    .then(savedEvent => {
+        upsertItem(events, savedEvent);
+        renderEvents();
         DOM_ELEMENTS.eventModal.style.display = 'none';
         alert(`✅ אירוע ${isEditMode ? 'עודכן' : 'נשמר'} בהצלחה!`);
     })
@@ -558,7 +795,8 @@ function handleDeleteEvent(id) {
             return response.json();
         })
         .then(() => {
-            loadDataFromApi();
+            removeItem(events, id);
+            renderEvents();
             alert('🗑️ האירוע נמחק בהצלחה!');
         })
         .catch(err => {
@@ -577,13 +815,28 @@ function handleEditEvent(id) {
 }
 
 // --- רינדור ---
+// אירוע יכול להגדיר day (יום בודד) או days (כמה ימים, ראה bell_schedule.py)
+function eventDays(ev) {
+    if (Array.isArray(ev.days)) return ev.days;
+    return ev.day ? [ev.day] : [];
+}
+
+function eventRuleDetails(ev) {
+    const details = [];
+    if (ev.profile) details.push(`מערכת: ${ev.profile}`);
+    if (ev.every > 1) details.push(`כל ${ev.every} שבועות`);
+    if (ev.startDate || ev.endDate) details.push(`${ev.startDate || '...'} – ${ev.endDate || '...'}`);
+    if ((ev.exceptDates || []).length) details.push(`חוץ מ-${ev.exceptDates.length} תאריכים`);
+    return details.join(' · ');
+}
+
 function renderEvents() {
     DOM_ELEMENTS.eventsList.innerHTML = '';
     const daysOrder = ['ראשון', 'שני', 'שלישי', 'רביעי', 'חמישי', 'שישי', 'שבת'];
     
     const sortedEvents = events.sort((a, b) => {
-        const dayA = daysOrder.indexOf(a.day);
-        const dayB = daysOrder.indexOf(b.day);
+        const dayA = daysOrder.indexOf(eventDays(a)[0]);
+        const dayB = daysOrder.indexOf(eventDays(b)[0]);
         if (dayA !== dayB) return dayA - dayB;
         return a.time.localeCompare(b.time);
     });
@@ -595,8 +848,9 @@ function renderEvents() {
         
         const li = document.createElement('li');
         li.innerHTML = `
-            <span>${ev.day}, ${ev.time}</span>
+            <span>${eventDays(ev).join('/')}, ${ev.time}</span>
             <strong>${ev.name}</strong>
+            <span class="event-rule">${eventRuleDetails(ev)}</span>
             <span class="song-link">${songName}</span>
             <div class="actions">
                 <button class="edit" data-id="${ev.id}">✏️</button>
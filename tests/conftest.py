@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+"""המודולים יושבים בשורש המאגר (בלי חבילה), ולכן הבדיקות מוסיפות אותו ל-sys.path."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
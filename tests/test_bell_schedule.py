@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+from datetime import date, datetime
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from bell_schedule import (DEFAULT_PROFILE, compile_schedule, localize_schedule, schedule_until,
+                           validate_calendar_entry, validate_event_rule)
+
+MONDAY = date(2026, 10, 19)
+
+
+def event(event_id, **fields):
+    record = {'id': event_id, 'name': f'אירוע {event_id}', 'day': 'שני', 'time': '08:00', 'songId': 's1'}
+    record.update(fields)
+    return record
+
+
+def fired_dates(entries, event_id):
+    return [entry['date'] for entry in entries if entry['eventId'] == event_id]
+
+
+def test_plain_weekly_event_fires_every_week():
+    entries, invalid = compile_schedule([event('a')], [], MONDAY, days=21)
+    assert invalid == []
+    assert fired_dates(entries, 'a') == ['2026-10-19', '2026-10-26', '2026-11-02']
+    assert entries[0]['profile'] == DEFAULT_PROFILE
+    assert entries[0]['time'] == '08:00'
+
+
+def test_every_counts_weeks_from_start_date():
+    # startDate באמצע השבוע: השבוע שלו הוא השבוע הראשון
+    rule = event('a', every=2, startDate='2026-10-21')
+    entries, _ = compile_schedule([rule], [], MONDAY, days=35)
+    assert fired_dates(entries, 'a') == ['2026-11-02', '2026-11-16']
+
+
+def test_every_requires_start_date():
+    assert validate_event_rule(event('a', every=2)) == 'every requires startDate'
+
+
+def test_except_dates_and_date_range():
+    rule = event('a', days=['שני', 'רביעי'], startDate='2026-10-20', endDate='2026-10-28',
+                 exceptDates=['2026-10-26'])
+    entries, _ = compile_schedule([rule], [], MONDAY, days=14)
+    assert fired_dates(entries, 'a') == ['2026-10-21', '2026-10-28']
+
+
+def test_entries_are_sorted_by_time():
+    rules = [event('late', time='12:00'), event('early', time='07:30'), event('tue', day='שלישי', time='06:00')]
+    entries, _ = compile_schedule(rules, [], MONDAY, days=2)
+    assert [entry['eventId'] for entry in entries] == ['early', 'late', 'tue']
+
+
+def test_shortest_calendar_entry_wins():
+    calendar = [
+        {'id': 'always', 'profile': 'קיץ'},
+        {'id': 'range', 'profile': 'מבחנים', 'startDate': '2026-10-19', 'endDate': '2026-10-30'},
+        {'id': 'day', 'profile': None, 'date': '2026-10-26'},
+    ]
+    rules = [event('summer', profile='קיץ'), event('exams', profile='מבחנים'), event('regular')]
+    entries, _ = compile_schedule(rules, calendar, MONDAY, days=21)
+    assert fired_dates(entries, 'exams') == ['2026-10-19']
+    # 26/10 הוא יום בלי צלצולים, ואחרי סוף הטווח חוזרת הרשומה בלי התאריכים
+    assert fired_dates(entries, 'summer') == ['2026-11-02']
+    assert fired_dates(entries, 'regular') == []
+
+
+def test_calendar_days_filter():
+    calendar = [{'id': 'friday', 'profile': 'קצר', 'days': ['שישי']}]
+    rules = [event('short', day='שישי', profile='קצר'), event('regular', day='שישי')]
+    entries, _ = compile_schedule(rules, calendar, MONDAY, days=7)
+    assert fired_dates(entries, 'short') == ['2026-10-23']
+    assert fired_dates(entries, 'regular') == []
+
+
+def test_invalid_events_are_skipped_and_reported(caplog):
+    rules = [event('ok'), {'id': 'no-day', 'time': '08:00', 'songId': 's1'}, event('bad-time', time='25:00')]
+    entries, invalid = compile_schedule(rules, [], MONDAY, days=7)
+    assert fired_dates(entries, 'ok') == ['2026-10-19']
+    assert invalid == ['no-day', 'bad-time']
+    assert 'no-day (Missing day or days)' in caplog.text
+
+
+@pytest.fixture
+def timezone():
+    """מחליף את אזור הזמן של התהליך (TZ) ומחזיר אותו בסוף הבדיקה."""
+    original = os.environ.get('TZ')
+
+    def switch(name):
+        os.environ['TZ'] = name
+        time.tzset()
+
+    yield switch
+    if original is None:
+        os.environ.pop('TZ', None)
+    else:
+        os.environ['TZ'] = original
+    time.tzset()
+
+
+def test_receiver_localizes_server_schedule_to_its_own_timezone(timezone):
+    # השרת רץ ב-UTC והרסיבר בשעון ישראל: הצלצול של 08:00 הוא 08:00 אצל הרסיבר
+    timezone('UTC')
+    entries, _ = compile_schedule([event('a')], [], MONDAY, days=7)
+    body = {'entries': entries, 'from': MONDAY.isoformat(), 'days': 7, 'until': schedule_until(MONDAY, 7)}
+
+    timezone('Asia/Jerusalem')
+    local = localize_schedule(body)
+    expected = datetime(2026, 10, 19, 8, 0, tzinfo=ZoneInfo('Asia/Jerusalem')).timestamp()
+    assert local['entries'][0]['at'] == expected != entries[0]['at']
+    assert local['until'] == datetime(2026, 10, 26, tzinfo=ZoneInfo('Asia/Jerusalem')).timestamp()
+
+
+def test_localize_skips_malformed_entries():
+    body = {'entries': [{'eventId': 'x', 'date': 'bad', 'time': '08:00'},
+                        {'eventId': 'y', 'date': '2026-10-19', 'time': '09:00'}],
+            'from': MONDAY.isoformat(), 'days': 1}
+    assert [entry['eventId'] for entry in localize_schedule(body)['entries']] == ['y']
+    with pytest.raises(ValueError):
+        localize_schedule({'entries': []})
+
+
+@pytest.mark.parametrize('days', [5, {'שני': 1}, ['שני', 3], [None]])
+def test_non_string_days_are_rejected_not_raised(days):
+    assert validate_event_rule(event('a', days=days)) == 'Invalid day or time'
+    assert validate_event_rule({'time': '08:00', 'day': 5}) == 'Invalid day or time'
+    assert validate_calendar_entry({'profile': None, 'days': days}) == 'Invalid day'
+
+
+def test_hand_edited_records_do_not_break_compile():
+    calendar = [{'id': 'bad', 'profile': None, 'days': 5}]
+    entries, invalid = compile_schedule([event('ok'), event('bad', days=5)], calendar, MONDAY, days=7)
+    assert fired_dates(entries, 'ok') == ['2026-10-19']
+    assert invalid == ['bad']
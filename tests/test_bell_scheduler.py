@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import importlib
+import os
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def receiver(tmp_path_factory):
+    """app1 נטען מתוך תיקייה זמנית: הוא יוצר את storage/ בתיקייה הנוכחית."""
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('receiver'))
+    try:
+        yield importlib.import_module('app1')
+    finally:
+        os.chdir(cwd)
+
+
+def timetable(*entries):
+    entries = sorted(entries, key=lambda entry: entry['at'])
+    return {'entries': entries, 'times': [entry['at'] for entry in entries]}
+
+
+def run_scheduler(receiver, on_fire):
+    scheduler = receiver.BellScheduler(on_fire)
+    thread = threading.Thread(target=scheduler.run, daemon=True)
+    thread.start()
+    return scheduler, thread
+
+
+def test_scheduler_keeps_running_after_errors(receiver, monkeypatch):
+    now = time.time()
+    table = timetable({'at': now + 0.2, 'name': 'פגום'},   # בלי file_path
+                      {'at': now + 0.4, 'name': 'תקין', 'file_path': 'bell.mp3'})
+    calls = []
+
+    def flaky_timetable():
+        calls.append(time.time())
+        if len(calls) == 1:
+            raise OSError('disk full')
+        return table
+
+    monkeypatch.setattr(receiver, 'get_timetable', flaky_timetable)
+    monkeypatch.setattr(receiver, 'SCHEDULER_ERROR_RETRY_SECONDS', 0.05)
+    fired = []
+    done = threading.Event()
+    scheduler, thread = run_scheduler(receiver, lambda entries: (fired.extend(entries), done.set()))
+    try:
+        assert done.wait(5)
+        assert [entry['name'] for entry in fired] == ['תקין']
+        assert thread.is_alive()
+    finally:
+        scheduler.stop()
+        thread.join(5)
+
+
+def test_cursor_starts_when_the_loop_starts(receiver, monkeypatch):
+    scheduler = receiver.BellScheduler(None)
+    now = time.time()
+    # צלצול שזמנו עבר בין יצירת המתזמן להפעלת הלולאה לא מנוגן באיחור
+    table = timetable({'at': now + 0.1, 'name': 'לפני', 'file_path': 'a.mp3'},
+                      {'at': now + 0.5, 'name': 'אחרי', 'file_path': 'b.mp3'})
+    monkeypatch.setattr(receiver, 'get_timetable', lambda: table)
+    time.sleep(0.2)
+
+    fired = []
+    done = threading.Event()
+    scheduler.fire_callback = lambda entries: (fired.extend(entries), done.set())
+    thread = threading.Thread(target=scheduler.run, daemon=True)
+    thread.start()
+    try:
+        assert done.wait(5)
+        assert [entry['name'] for entry in fired] == ['אחרי']
+    finally:
+        scheduler.stop()
+        thread.join(5)
+
+
+def test_song_save_does_not_wait_for_rendition(receiver, monkeypatch):
+    rendered = []
+
+    def slow_rendition(song, folder):
+        time.sleep(0.3)
+        rendered.append(song['id'])
+        song.update(renditionFilename='r.mp3', renditionUrl='/api/song_file/r.mp3',
+                    renditionHash='r', renditionKey=receiver.rendition_key(song))
+
+    monkeypatch.setattr(receiver, 'update_song_rendition', slow_rendition)
+    song = receiver.save_json_file(receiver.SONGS_FOLDER, {'name': 'שיר', 'filename': 'a.mp3',
+                                                           'contentHash': 'a', 'origin': 'local'})
+    client = receiver.app.test_client()
+    started = time.time()
+    response = client.post('/api/songs', json={'id': song['id'], 'name': 'שיר', 'clipStart': 5})
+    assert response.status_code == 200 and time.time() - started < 0.3
+    assert rendered == [] and 'renditionKey' not in response.get_json()
+
+    receiver.backfill_local_renditions()
+    saved = receiver.get_item_by_id(receiver.SONGS_FOLDER, song['id'])
+    assert rendered == [song['id']]
+    assert saved['renditionKey'] == receiver.rendition_key(saved) and saved['clipStart'] == 5
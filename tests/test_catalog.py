@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+import os
+import threading
+
+from catalog import BATCH_FILENAME, BATCH_LOCK_FILENAME, JsonCatalog, encode_record
+from changelog import ChangeLog
+from leader import file_lock
+
+
+def write_and_delete(folder, worker, rounds):
+    """כמו worker של gunicorn: קטלוג משלו על אותה תיקייה, כותב ומוחק את אותן רשומות."""
+    catalog = JsonCatalog(folder)
+    catalog.load()
+    for n in range(rounds):
+        catalog.put({'id': 'shared', 'worker': worker, 'n': n})
+        catalog.put_many([{'id': f'{worker}-{n}', 'n': n}, {'id': 'shared-batch', 'worker': worker}])
+        catalog.delete('shared-batch')
+
+
+def test_concurrent_writes_from_several_processes(tmp_path):
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=write_and_delete, args=(str(tmp_path), worker, 40)) for worker in range(4)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join(60)
+    assert [process.exitcode for process in workers] == [0, 0, 0, 0]
+
+    catalog = JsonCatalog(str(tmp_path))
+    catalog.load()
+    assert catalog.get('shared')['n'] == 39
+    assert len(catalog.list()) == 1 + 4 * 40
+    assert not list(tmp_path.glob('*.tmp'))
+
+
+def test_records_survive_reload(tmp_path):
+    catalog = JsonCatalog(str(tmp_path))
+    catalog.load()
+    catalog.put_many([{'id': 1, 'name': 'א'}, {'id': 2, 'name': 'ב'}])
+    catalog.delete(1)
+
+    reloaded = JsonCatalog(str(tmp_path))
+    reloaded.load()
+    assert reloaded.list() == [{'id': '2', 'name': 'ב'}]
+    assert reloaded.quarantined == []
+
+
+def test_apply_is_recorded_as_one_revision(tmp_path):
+    (tmp_path / 'events').mkdir()
+    catalog = JsonCatalog(str(tmp_path / 'events'))
+    catalog.load()
+    catalog.put_many([{'id': 'old', 'n': 0}, {'id': 'kept', 'n': 0}])
+    changelog = ChangeLog(str(tmp_path / 'changes.jsonl'))
+    catalog.add_listener(changelog.listener('events'))
+
+    with changelog.batch():
+        catalog.apply([{'id': 'kept', 'n': 1}, {'id': 'new', 'n': 1}], ['old', 'missing'])
+    assert sorted(item['id'] for item in catalog.list()) == ['kept', 'new']
+    assert changelog.rev == 1
+    assert changelog.changes_since(0) == (1, {'events': {'put': ['kept', 'new'], 'delete': ['old']}})
+
+
+def test_interrupted_batch_is_completed_on_load(tmp_path):
+    catalog = JsonCatalog(str(tmp_path))
+    catalog.load()
+    catalog.put({'id': 'old'})
+    # נפילה אחרי כתיבת היומן ולפני ההחלה
+    with open(os.path.join(str(tmp_path), BATCH_FILENAME), 'wb') as f:
+        f.write(encode_record({'put': [{'id': 'new'}], 'delete': ['old']}))
+
+    reloaded = JsonCatalog(str(tmp_path))
+    reloaded.load()
+    assert [item['id'] for item in reloaded.list()] == ['new']
+    assert not os.path.exists(os.path.join(str(tmp_path), BATCH_FILENAME))
+
+
+def test_loading_worker_waits_for_batch_in_progress(tmp_path):
+    with open(os.path.join(str(tmp_path), BATCH_FILENAME), 'wb') as f:
+        f.write(encode_record({'put': [{'id': 'new'}], 'delete': []}))
+    loader = JsonCatalog(str(tmp_path))
+    with file_lock(os.path.join(str(tmp_path), BATCH_LOCK_FILENAME)):
+        # worker אחר מחזיק את הנעילה באמצע apply: היומן שלו, לא להשלים ולא למחוק
+        thread = threading.Thread(target=loader.load)
+        thread.start()
+        thread.join(0.3)
+        assert thread.is_alive()
+        assert os.path.exists(os.path.join(str(tmp_path), BATCH_FILENAME))
+    thread.join(5)
+    assert [item['id'] for item in loader.list()] == ['new']
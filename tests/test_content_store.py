@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import time
+
+from content_store import GC_GRACE_SECONDS, collect_garbage, quarantined_references, reference_counts
+
+OLD = time.time() - GC_GRACE_SECONDS - 60
+
+
+def make_file(folder, name, mtime=OLD, data=b'audio'):
+    path = os.path.join(folder, name)
+    with open(path, 'wb') as f:
+        f.write(data)
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_collects_only_old_unreferenced_generated_files(tmp_path):
+    folder = str(tmp_path)
+    kept = make_file(folder, 'a' * 64 + '.mp3')
+    orphan = make_file(folder, 'b' * 64 + '.mp3')
+    recent = make_file(folder, 'c' * 64 + '.mp3', mtime=time.time())
+    legacy = make_file(folder, '12345678-1234-1234-1234-123456789abc.mp3')
+    manual = make_file(folder, 'my song.mp3')
+    record = make_file(folder, '12345678-1234-1234-1234-123456789abc.json')
+
+    removed, freed = collect_garbage(folder, {os.path.basename(kept)})
+    assert sorted(removed) == sorted([os.path.basename(orphan), os.path.basename(legacy)])
+    assert freed == 2 * len(b'audio')
+    for path in (kept, recent, manual, record):
+        assert os.path.exists(path)
+
+
+def test_grace_period_is_configurable(tmp_path):
+    path = make_file(str(tmp_path), 'd' * 64 + '.mp3', mtime=time.time() - 5)
+    assert collect_garbage(str(tmp_path), set(), grace_seconds=60) == ([], 0)
+    assert collect_garbage(str(tmp_path), set(), grace_seconds=1)[0] == [os.path.basename(path)]
+
+
+def test_reference_counts_cover_renditions():
+    songs = [
+        {'filename': 'a.mp3', 'renditionFilename': 'r.mp3'},
+        {'filename': 'a.mp3'},
+        {'filename': None},
+    ]
+    assert reference_counts(songs) == {'a.mp3': 2, 'r.mp3': 1}
+
+
+def test_quarantined_records_keep_their_files(tmp_path):
+    quarantine = tmp_path / 'quarantine'
+    quarantine.mkdir()
+    (quarantine / 'x.json.1').write_text(json.dumps({'filename': 'a' * 64 + '.mp3'}))
+    # רשומה קטועה: כל מה שנראה כשם קובץ שנוצר נשמר
+    (quarantine / 'y.json.2').write_bytes(b'{"filename": "' + b'b' * 64 + b'.mp3", "na')
+    assert quarantined_references(str(quarantine)) == {'a' * 64 + '.mp3', 'b' * 64 + '.mp3'}
+    assert quarantined_references(str(tmp_path / 'missing')) == set()
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from distribution import distribution_tree, receiver_base_url
+
+URLS = [f'http://10.0.0.{i}:5000/api/webhook_receive' for i in range(7)]
+
+
+def base(i):
+    return f'http://10.0.0.{i}:5000'
+
+
+def test_receiver_base_url():
+    assert receiver_base_url(URLS[3]) == base(3)
+
+
+def test_fanout_zero_downloads_from_server():
+    assert distribution_tree(URLS, 0) == {url: [] for url in URLS}
+
+
+def test_binary_tree_chains_reach_the_root():
+    tree = distribution_tree(URLS, 2)
+    assert tree[URLS[0]] == [] and tree[URLS[1]] == []
+    assert tree[URLS[2]] == [base(0)] and tree[URLS[3]] == [base(0)]
+    assert tree[URLS[4]] == [base(1)] and tree[URLS[5]] == [base(1)]
+    assert tree[URLS[6]] == [base(2), base(0)]
+
+
+def test_fanout_wider_than_receivers_is_flat():
+    assert all(chain == [] for chain in distribution_tree(URLS, 10).values())
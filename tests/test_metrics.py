@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from metrics import Registry, parse_families, parse_metrics, render_fleet
+
+R1 = 'http://r1:5000/api/webhook_receive'
+R2 = 'http://r2:5000/api/webhook_receive'
+
+
+def receiver_scrape(fired):
+    registry = Registry()
+    registry.gauge('ringer_leader', 'Leader worker').set(1)
+    registry.counter('ringer_bells_fired_total', 'Bells fired').inc(fired)
+    registry.histogram('ringer_bell_lateness_seconds', 'Bell lateness', buckets=(0.1,)).observe(0.05)
+    text = registry.render()
+    return parse_metrics(text), parse_families(text)
+
+
+def families_in(text):
+    return [line.split()[2:4] for line in text.splitlines() if line.startswith('# TYPE')]
+
+
+def test_fleet_families_are_renamed_and_typed_once():
+    server = Registry()
+    server.gauge('ringer_leader', 'Server leader').set(1)
+    body = server.render() + render_fleet({R1: receiver_scrape(3), R2: receiver_scrape(5)})
+
+    assert families_in(body) == [['ringer_leader', 'gauge'], ['ringer_fleet_leader', 'gauge'],
+                                 ['ringer_fleet_bells_fired_total', 'counter'],
+                                 ['ringer_fleet_bell_lateness_seconds', 'histogram']]
+    assert '# HELP ringer_fleet_bells_fired_total Bells fired' in body
+    samples = parse_metrics(body)
+    assert [labels for name, labels, _ in samples if name == 'ringer_leader'] == [{}]
+    assert [(labels['receiver'], value) for name, labels, value in samples
+            if name == 'ringer_fleet_bells_fired_total'] == [(R1, 3), (R2, 5)]
+    # כל הדגימות של משפחה ברצף אחד, גם כשהן מכמה רסיברים
+    names = [name for name, _, _ in samples]
+    lateness = [i for i, name in enumerate(names) if name.startswith('ringer_fleet_bell_lateness_seconds')]
+    assert lateness == list(range(lateness[0], lateness[0] + 8))
+
+
+def test_untyped_receiver_samples_get_an_untyped_family():
+    body = render_fleet({R1: ([('custom_value', {}, 1.0)], {}), R2: ([], {})})
+    assert families_in(body) == [['ringer_fleet_custom_value', 'untyped']]
+    assert render_fleet({R1: ([], {})}) == ''
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import io
+import os
+
+import pytest
+
+from uploads import UploadError, UploadStore
+
+AUDIO = b'ID3' + bytes(range(256)) * 40
+
+
+@pytest.fixture
+def folders(tmp_path):
+    songs, panic = tmp_path / 'songs', tmp_path / 'panic'
+    songs.mkdir()
+    panic.mkdir()
+    return tmp_path / 'uploads', str(songs), str(panic)
+
+
+def make_store(folders):
+    state, songs, panic = folders
+    return UploadStore(str(state), {'song': (songs, 10 ** 6), 'panic': (panic, 10 ** 6)}, content_kinds=('song',))
+
+
+def append(store, upload_id, offset, data):
+    return store.append(upload_id, offset, io.BytesIO(data), len(data))
+
+
+def test_chunks_complete_under_content_name(folders):
+    store = make_store(folders)
+    state = store.create('song', 'bell.mp3', len(AUDIO))
+    state = append(store, state['id'], 0, AUDIO[:1000])
+    assert store.status(state)['offset'] == 1000
+    assert not state.get('complete')
+
+    state = append(store, state['id'], 1000, AUDIO[1000:])
+    digest = hashlib.sha256(AUDIO).hexdigest()
+    assert state['complete'] and state['contentHash'] == digest
+    assert state['filename'] == f'{digest}.mp3'
+    with open(os.path.join(folders[1], state['filename']), 'rb') as f:
+        assert f.read() == AUDIO
+
+
+def test_offset_mismatch_reports_current_offset(folders):
+    store = make_store(folders)
+    upload_id = store.create('song', 'bell.mp3', len(AUDIO))['id']
+    append(store, upload_id, 0, AUDIO[:500])
+    with pytest.raises(UploadError) as error:
+        append(store, upload_id, 200, AUDIO[200:700])
+    assert error.value.status == 409
+    assert 'upload is at 500' in error.value.message
+
+
+def test_resume_in_another_process_rebuilds_hash_from_disk(folders):
+    upload_id = make_store(folders).create('panic', 'call.mp3', len(AUDIO))['id']
+    append(make_store(folders), upload_id, 0, AUDIO[:777])
+
+    # חיבור שנפל באמצע חלק: ההיסט הוא מה שנשמר בפועל בקובץ ה-.part
+    resumed = make_store(folders)
+    assert resumed.status(resumed.get(upload_id))['offset'] == 777
+    state = append(resumed, upload_id, 777, AUDIO[777:])
+    assert state['contentHash'] == hashlib.sha256(AUDIO).hexdigest()
+    with open(os.path.join(folders[2], state['filename']), 'rb') as f:
+        assert f.read() == AUDIO
+
+
+def test_chunk_past_declared_size_is_rejected(folders):
+    store = make_store(folders)
+    upload_id = store.create('song', 'bell.mp3', 100)['id']
+    with pytest.raises(UploadError) as error:
+        append(store, upload_id, 0, AUDIO[:101])
+    assert error.value.status == 413
+
+
+def test_non_audio_content_is_discarded(folders):
+    store = make_store(folders)
+    upload_id = store.create('song', 'bell.mp3', 100)['id']
+    with pytest.raises(UploadError) as error:
+        append(store, upload_id, 0, b'<html>' + b'x' * 50)
+    assert error.value.status == 415
+    with pytest.raises(UploadError):
+        store.get(upload_id)
+
+
+def test_duplicate_content_reuses_existing_file(folders):
+    store = make_store(folders)
+    first = store.create('song', 'a.mp3', len(AUDIO))
+    first = append(store, first['id'], 0, AUDIO)
+    second = store.create('song', 'b.mp3', len(AUDIO))
+    second = append(store, second['id'], 0, AUDIO)
+    assert second['duplicate'] and second['filename'] == first['filename']
+    assert store.pending_files('song') == {first['filename']}
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import threading
+import time
+
+from webhooks import WebhookOutbox
+
+URLS = ['http://r1:5000/api/webhook_receive', 'http://r2:5000/api/webhook_receive']
+
+
+class FakeDispatcher:
+    """במקום WebhookDispatcher: רושם את ההודעות ושולח בלי רשת."""
+
+    def __init__(self, urls, failing=()):
+        self.urls = list(urls)
+        self.failing = set(failing)
+        self.sent = []
+
+    def send(self, url, payload, queued_at=None):
+        if url in self.failing:
+            return False
+        self.sent.append((url, payload))
+        return True
+
+    def submit(self, fn, *args):
+        # כמו מאגר ה-threads: _run קורא ל-submit כשהוא מחזיק את הנעילה של התור
+        threading.Thread(target=fn, args=args, daemon=True).start()
+
+    def status(self):
+        return {}
+
+
+def test_pending_puts_panic_first_and_coalesces_catalog_updates(tmp_path):
+    outbox = WebhookOutbox(str(tmp_path), FakeDispatcher(URLS))
+    outbox.enqueue('events_update', {'eventId': '1'})
+    outbox.enqueue('songs_update', {'songId': 'a'})
+    outbox.enqueue('events_update', {'eventId': '2'})
+    outbox.enqueue('events_update', {'eventId': '3'})
+    outbox.enqueue('panic_alert', {'filename': 'call.mp3'})
+
+    upto, messages = outbox._pending(URLS[0])
+    assert upto == 5
+    payloads = [payload for _, payload, _ in messages]
+    assert [payload['type'] for payload in payloads] == ['panic_alert', 'songs_update', 'events_update']
+    assert payloads[2] == {'eventId': '3', 'type': 'events_update', 'coalesced': 3}
+    assert 'coalesced' not in payloads[1]
+
+
+def test_delivery_persists_cursor_per_receiver(tmp_path):
+    dispatcher = FakeDispatcher(URLS, failing=[URLS[1]])
+    outbox = WebhookOutbox(str(tmp_path), dispatcher)
+    outbox.enqueue('events_update', {'eventId': '1'})
+    outbox.enqueue('songs_update', {'songId': 'a'})
+    for url in URLS:
+        outbox._deliver(url)
+
+    with open(os.path.join(str(tmp_path), 'cursors.json'), encoding='utf-8') as f:
+        assert json.load(f) == {URLS[0]: 2}
+    status = outbox.status()
+    assert status[URLS[0]]['pending'] == 0
+    assert status[URLS[1]]['pending'] == 2 and status[URLS[1]]['attempts'] == 1
+
+    # אחרי הפעלה מחדש: רק הרסיבר שלא אישר מקבל את ההודעות, כהשלמה מרוכזת
+    restarted = WebhookOutbox(str(tmp_path), FakeDispatcher(URLS))
+    assert restarted._pending(URLS[0])[1] == []
+    assert [payload['type'] for _, payload, _ in restarted._pending(URLS[1])[1]] == ['songs_update', 'events_update']
+
+
+def test_enqueue_from_another_process_is_seen(tmp_path):
+    sender = WebhookOutbox(str(tmp_path), FakeDispatcher(URLS))
+    other = WebhookOutbox(str(tmp_path), FakeDispatcher(URLS))
+    other.enqueue('songs_update', {'songId': 'a'})
+    assert sender.enqueue('events_update', {'eventId': '1'}) == 2
+
+
+def test_new_leader_resumes_from_cursors_saved_by_previous_leader(tmp_path):
+    # שני workers עלו יחד; הראשון היה המוביל ושלח פאניק, ואז נפל
+    standby = WebhookOutbox(str(tmp_path), FakeDispatcher(URLS))
+    leader = WebhookOutbox(str(tmp_path), FakeDispatcher(URLS))
+    leader.enqueue('panic_alert', {'filename': 'call.mp3'})
+    for url in URLS:
+        leader._deliver(url)
+    assert len(leader.dispatcher.sent) == 2
+
+    standby.start()
+    time.sleep(0.2)
+    assert standby.dispatcher.sent == []
+    assert all(entry['cursor'] == 1 and entry['pending'] == 0 for entry in standby.status().values())
@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+"""
+העלאות בחלקים שאפשר לחדש (פרוטוקול בסגנון tus) לשירים ולהקלטות פאניק.
+
+    POST  /api/uploads             {"kind", "filename", "size"} -> uploadId, chunkSize
+    HEAD  /api/uploads/<id>        Upload-Offset: כמה בתים כבר נשמרו
+    PATCH /api/uploads/<id>        Upload-Offset + גוף החלק (application/offset+octet-stream)
+
+כל חלק נכתב ישר לקובץ <שם סופי>.part בתיקיית היעד (שירים/פאניק), בלי
+עותק ביניים בזיכרון או ב-/tmp, ומקבל את שמו הסופי ב-rename כשההעלאה הושלמה.
+ההיסט האמיתי הוא גודל קובץ ה-.part, כך שחיבור שנפל באמצע חלק ממשיך בדיוק
+מהבית האחרון שנשמר, גם מול worker אחר. ה-sha256 מחושב תוך כדי כתיבה
+(ומשוחזר מהדיסק אם ההמשך הגיע לתהליך אחר), ולכן סוגים שנשמרים לפי תוכן
+(שירים, ראה content_store.py) מקבלים את שמם הסופי בלי קריאה נוספת, וקובץ
+זהה לקיים לא נשמר פעמיים. הגודל המוצהר והסיומת נבדקים לפני שנכתב בית אחד, וסוג התוכן
+נבדק לפי חתימת הקובץ כבר בחלק הראשון.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from werkzeug.utils import secure_filename
+
+from content_store import claim_file, store_file
+from leader import file_lock
+
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+WRITE_BUFFER_SIZE = 256 * 1024
+MAX_SONG_BYTES = int(os.environ.get('RINGER_MAX_SONG_MB', '50')) * 1024 * 1024
+MAX_PANIC_BYTES = int(os.environ.get('RINGER_MAX_PANIC_MB', '20')) * 1024 * 1024
+# העלאה שלא התקדמה זמן כזה נמחקת
+UPLOAD_EXPIRY_SECONDS = 24 * 60 * 60
+AUDIO_EXTENSIONS = {'.mp3', '.wav', '.ogg', '.oga', '.opus', '.webm', '.m4a', '.aac', '.flac'}
+SNIFF_BYTES = 12
+
+
+class UploadError(Exception):
+    """שגיאה שמוחזרת ללקוח עם קוד HTTP (413 גדול מדי, 415 סוג לא נתמך, 409 היסט שגוי...)."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def looks_like_audio(head):
+    """בודק לפי חתימת תחילת הקובץ שזה מכל (container) של אודיו שאנחנו מכירים."""
+    if head.startswith((b'ID3', b'OggS', b'fLaC', b'\x1aE\xdf\xa3')):
+        return True
+    if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+        return True
+    if head[4:8] == b'ftyp':
+        return True
+    # פריים MPEG/ADTS בלי תגית ID3
+    return len(head) >= 2 and head[0] == 0xFF and (head[1] & 0xE0) == 0xE0
+
+
+def check_audio_file(filename, head, size, max_bytes):
+    """בדיקות שלפני שמירה (גם להעלאה הישנה ב-multipart). זורק UploadError."""
+    extension = os.path.splitext(secure_filename(filename or ''))[1].lower()
+    if extension not in AUDIO_EXTENSIONS:
+        raise UploadError(415, f'Unsupported file type: {extension or "no extension"}')
+    if size is not None and size > max_bytes:
+        raise UploadError(413, f'File too large ({size} bytes, limit {max_bytes})')
+    if head is not None and not looks_like_audio(head):
+        raise UploadError(415, 'File content is not a supported audio format')
+    return extension
+
+
+class UploadStore:
+    """
+    מצב ההעלאות הפתוחות: קובץ JSON קטן לכל העלאה תחת state_folder, והתוכן
+    עצמו בקובץ .part בתיקיית היעד. targets: {kind: (תיקייה, גודל מקסימלי)};
+    הסוגים ב-content_kinds נשמרים בשם לפי התוכן.
+    """
+
+    def __init__(self, state_folder, targets, content_kinds=()):
+        self.state_folder = state_folder
+        self.targets = targets
+        self.content_kinds = set(content_kinds)
+        self._hashers = {}   # upload id -> (sha256, עד איזה בית)
+        self._lock = threading.Lock()
+        os.makedirs(state_folder, exist_ok=True)
+
+    # --- מצב ---
+    def _state_path(self, upload_id):
+        if not upload_id or secure_filename(upload_id) != upload_id:
+            raise UploadError(404, 'Upload not found')
+        return os.path.join(self.state_folder, f'{upload_id}.json')
+
+    def _lock_path(self, upload_id):
+        return self._state_path(upload_id)[:-len('.json')] + '.lock'
+
+    def _part_path(self, state):
+        return os.path.join(self.targets[state['kind']][0], state['filename'] + '.part')
+
+    def _final_path(self, state):
+        return os.path.join(self.targets[state['kind']][0], state['filename'])
+
+    def _save(self, state):
+        path = self._state_path(state['id'])
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _load(self, upload_id):
+        try:
+            with open(self._state_path(upload_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            raise UploadError(404, 'Upload not found')
+
+    def _offset(self, state):
+        if state.get('complete'):
+            return state['size']
+        try:
+            return os.path.getsize(self._part_path(state))
+        except FileNotFoundError:
+            return 0
+
+    def _discard(self, state):
+        for path in (self._part_path(state), self._state_path(state['id']), self._lock_path(state['id'])):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self._hashers.pop(state['id'], None)
+
+    def status(self, state):
+        """מה שמוחזר ללקוח על העלאה."""
+        result = {
+            'uploadId': state['id'],
+            'kind': state['kind'],
+            'size': state['size'],
+            'offset': self._offset(state),
+            'complete': bool(state.get('complete')),
+            'chunkSize': UPLOAD_CHUNK_SIZE,
+        }
+        if state.get('complete'):
+            result.update(filename=state['filename'], contentHash=state['contentHash'])
+            if state.get('duplicate'):
+                result['duplicate'] = True
+            if state.get('consumed'):
+                result['consumed'] = True
+        return result
+
+    # --- פעולות ---
+    def create(self, kind, filename, size):
+        """פותח העלאה חדשה אחרי בדיקת סוג וגודל. מחזיר את המצב."""
+        if kind not in self.targets:
+            raise UploadError(400, f'Unknown upload kind: {kind}')
+        try:
+            size = int(size)
+        except (TypeError, ValueError):
+            raise UploadError(400, 'Upload size is required')
+        if size <= 0:
+            raise UploadError(400, 'Upload size must be positive')
+        extension = check_audio_file(filename, None, size, self.targets[kind][1])
+        self.sweep()
+        state = {
+            'id': uuid.uuid4().hex,
+            'kind': kind,
+            'originalName': filename,
+            'filename': str(uuid.uuid4()) + extension,
+            'size': size,
+            'createdAt': time.time(),
+        }
+        open(self._part_path(state), 'wb').close()
+        self._save(state)
+        return state
+
+    def get(self, upload_id):
+        return self._load(upload_id)
+
+    def append(self, upload_id, offset, stream, length):
+        """
+        כותב חלק מ-stream בהיסט offset. אם זה החלק האחרון - מאמת, נותן לקובץ את
+        שמו הסופי ומחזיר מצב complete (עם duplicate אם התוכן כבר היה שמור).
+        """
+        with file_lock(self._lock_path(upload_id)):
+            state = self._load(upload_id)
+            if state.get('complete'):
+                raise UploadError(409, 'Upload already complete')
+            current = self._offset(state)
+            if offset != current:
+                raise UploadError(409, f'Offset mismatch: upload is at {current}')
+            if length is None:
+                raise UploadError(411, 'Content-Length is required')
+            if offset + length > state['size']:
+                raise UploadError(413, f'Chunk exceeds declared upload size ({state["size"]} bytes)')
+
+            hasher = self._hasher(state, current)
+            part_path = self._part_path(state)
+            written = 0
+            try:
+                with open(part_path, 'r+b') as f:
+                    f.seek(offset)
+                    while written < length:
+                        data = stream.read(min(WRITE_BUFFER_SIZE, length - written))
+                        if not data:
+                            break
+                        f.write(data)
+                        hasher.update(data)
+                        written += len(data)
+            finally:
+                with self._lock:
+                    self._hashers[state['id']] = (hasher, offset + written)
+
+            state['updatedAt'] = time.time()
+            end = offset + written
+            if not state.get('sniffed') and end >= min(SNIFF_BYTES, state['size']):
+                with open(part_path, 'rb') as f:
+                    head = f.read(SNIFF_BYTES)
+                if not looks_like_audio(head):
+                    self._discard(state)
+                    raise UploadError(415, 'File content is not a supported audio format')
+                state['sniffed'] = True
+            if end < state['size']:
+                self._save(state)
+                return state
+            return self._complete(state, hasher.hexdigest())
+
+    def _hasher(self, state, offset):
+        """ה-sha256 עד offset: מהזיכרון, או מחושב מחדש מהדיסק (המשך שהגיע לתהליך אחר)."""
+        with self._lock:
+            cached = self._hashers.get(state['id'])
+        if cached and cached[1] == offset:
+            return cached[0]
+        hasher = hashlib.sha256()
+        with open(self._part_path(state), 'rb') as f:
+            remaining = offset
+            while remaining:
+                data = f.read(min(WRITE_BUFFER_SIZE, remaining))
+                if not data:
+                    break
+                hasher.update(data)
+                remaining -= len(data)
+        return hasher
+
+    def _complete(self, state, content_hash):
+        part_path = self._part_path(state)
+        with open(part_path, 'rb') as f:
+            os.fsync(f.fileno())
+        if state['kind'] in self.content_kinds:
+            extension = os.path.splitext(state['filename'])[1]
+            filename, is_new = store_file(part_path, self.targets[state['kind']][0], extension, content_hash)
+            state['filename'] = filename
+            if not is_new:
+                state['duplicate'] = True
+                logging.info(f"העלאה {state['id']} זהה לקובץ קיים ({filename}); הקובץ החדש לא נשמר.")
+        else:
+            os.replace(part_path, self._final_path(state))
+        state.update(complete=True, contentHash=content_hash, completedAt=time.time(), updatedAt=time.time())
+        self._save(state)
+        with self._lock:
+            self._hashers.pop(state['id'], None)
+        return state
+
+    def consume(self, upload_id, kind):
+        """
+        לוקח העלאה שהושלמה (פעם אחת) כדי לשייך אותה לשיר או לשדר אותה. המצב נשאר
+        עד הניקוי, כך שלקוח שאיבד את התשובה האחרונה עדיין רואה שההעלאה הושלמה.
+        """
+        with file_lock(self._lock_path(upload_id)):
+            state = self._load(upload_id)
+            if state['kind'] != kind or not state.get('complete'):
+                raise UploadError(409, 'Upload is not complete')
+            if state.get('consumed'):
+                raise UploadError(409, 'Upload was already used')
+            if kind in self.content_kinds:
+                # מגן על הקובץ מאוסף הקבצים עד שהרשומה שמפנה אליו נשמרת
+                try:
+                    claim_file(self.targets[kind][0], state['filename'])
+                except FileNotFoundError:
+                    raise UploadError(409, 'Uploaded file is no longer available')
+            state['consumed'] = True
+            self._save(state)
+        return state
+
+    def pending_files(self, kind):
+        """שמות הקבצים של העלאות שהושלמו ועוד לא שויכו (שמורים מפני אוסף הקבצים)."""
+        names = set()
+        for entry in os.scandir(self.state_folder):
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                with open(entry.path, 'r', encoding='utf-8') as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if state.get('kind') == kind and state.get('complete') and not state.get('consumed'):
+                names.add(state['filename'])
+        return names
+
+    def cancel(self, upload_id):
+        """מבטל העלאה שלא הושלמה ומוחק את מה שכבר נכתב."""
+        with file_lock(self._lock_path(upload_id)):
+            state = self._load(upload_id)
+            if state.get('complete'):
+                raise UploadError(409, 'Upload already complete')
+            self._discard(state)
+
+    def sweep(self):
+        """מוחק העלאות שלא התקדמו UPLOAD_EXPIRY_SECONDS (כולל קובץ ה-.part)."""
+        now = time.time()
+        for entry in os.scandir(self.state_folder):
+            if entry.name.endswith('.lock') and not os.path.exists(entry.path[:-len('.lock')] + '.json'):
+                if now - entry.stat().st_mtime > UPLOAD_EXPIRY_SECONDS:
+                    os.remove(entry.path)
+                continue
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                with open(entry.path, 'r', encoding='utf-8') as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if now - state.get('updatedAt', state.get('createdAt', now)) > UPLOAD_EXPIRY_SECONDS:
+                if state.get('complete') and not state.get('consumed') and state['kind'] not in self.content_kinds:
+                    # הושלמה ולא שויכה: הקובץ הסופי יתום (קבצים לפי תוכן נאספים ב-content_store)
+                    try:
+                        os.remove(self._final_path(state))
+                    except FileNotFoundError:
+                        pass
+                logging.info(f"העלאה שפג תוקפה נמחקה: {state.get('originalName')} ({state['id']})")
+                self._discard(state)
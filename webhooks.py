@@ -0,0 +1,381 @@
+# -*- coding: utf-8 -*-
+"""
+שליחת Webhooks לרסיברים במקביל, עם תור עמיד לדיסק.
+
+כל הודעה נרשמת קודם ביומן (outbox) תחת storage/ ורק אחר כך נשלחת,
+לכל הרסיברים בו זמנית מתוך מאגר threads, דרך Session משותף שמחזיק
+חיבורי keep-alive פתוחים לכל רסיבר. לכל רסיבר נשמר סמן (cursor) של
+ההודעה האחרונה שאישר; רסיבר שלא זמין מקבל ניסיונות חוזרים עם המתנה
+אקספוננציאלית, וכשהוא חוזר הוא מקבל השלמה מרוכזת אחת.
+
+בהרצה עם כמה workers כל תהליך יכול להוסיף הודעות ליומן (תחת נעילת
+קובץ), אבל רק תהליך אחד - זה שקרא ל-start() - שולח, מקדם סמנים וכותב
+את היומן מחדש; הוא קורא מהיומן הודעות שתהליכים אחרים הוסיפו.
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from leader import file_lock
+
+# (התחברות, קריאה) - רסיבר כבוי נכשל מהר בהתחברות ולא תוקע thread
+WEBHOOK_TIMEOUT = (2, 5)
+MAX_WEBHOOK_WORKERS = 32
+
+
+class WebhookDispatcher:
+    """
+    שולח כל הודעה לכל הכתובות במקביל ושומר סטטוס לכל רסיבר.
+    personalize(url, payload), אם נתון, מחזיר את גרסת ההודעה לרסיבר מסוים
+    (למשל מקורות ההורדה שלו בעץ ההפצה, ראה distribution.py).
+    """
+
+    def __init__(self, urls, timeout=WEBHOOK_TIMEOUT, max_workers=MAX_WEBHOOK_WORKERS, personalize=None):
+        self.urls = list(urls)
+        self.timeout = timeout
+        self.personalize = personalize
+        workers = max(1, min(max_workers, len(self.urls)))
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max(1, len(self.urls)), pool_maxsize=workers)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='webhook')
+        self._lock = threading.Lock()
+        self._status = {url: {
+            'sent': 0,
+            'failed': 0,
+            'last_type': None,
+            'last_ok': None,
+            'last_status_code': None,
+            'last_error': None,
+            'last_latency_ms': None,
+            'last_delivered_after_ms': None,
+            'last_attempt_at': None,
+        } for url in self.urls}
+
+    def post(self, url, payload):
+        """שליחה בודדת (חוסמת) לרסיבר אחד. מחזירה (הצליח, קוד, שגיאה, זמן במילישניות)."""
+        started = time.monotonic()
+        try:
+            response = self._session.post(url, json=payload, timeout=self.timeout)
+            response.raise_for_status()
+            return True, response.status_code, None, (time.monotonic() - started) * 1000
+        except requests.exceptions.RequestException as e:
+            status_code = e.response.status_code if getattr(e, 'response', None) is not None else None
+            return False, status_code, str(e), (time.monotonic() - started) * 1000
+
+    def send(self, url, payload, queued_at=None):
+        """שליחה לרסיבר אחד ועדכון הסטטוס שלו. מחזיר True אם הצליח."""
+        event_type = payload.get('type')
+        if self.personalize:
+            payload = self.personalize(url, payload)
+        ok, status_code, error, latency_ms = self.post(url, payload)
+
+        with self._lock:
+            status = self._status.setdefault(url, {'sent': 0, 'failed': 0})
+            status['sent' if ok else 'failed'] += 1
+            status['last_type'] = event_type
+            status['last_ok'] = ok
+            status['last_status_code'] = status_code
+            status['last_error'] = error
+            status['last_latency_ms'] = round(latency_ms, 1)
+            if queued_at is not None:
+                status['last_delivered_after_ms'] = round((time.time() - queued_at) * 1000, 1)
+            status['last_attempt_at'] = time.time()
+
+        if ok:
+            logging.info(f"Webhook נשלח בהצלחה ל-{url} ({event_type}) תוך {latency_ms:.0f} ms.")
+        else:
+            logging.error(f"שגיאה בשליחת Webhook ל-{url} ({event_type}): {error}")
+        return ok
+
+    def submit(self, fn, *args):
+        """מריץ משימת שליחה במאגר ה-threads."""
+        return self._pool.submit(fn, *args)
+
+    def broadcast(self, payload):
+        """מכניס את ההודעה לתור השליחה לכל הרסיברים וחוזר מיד (ללא שמירה לדיסק)."""
+        queued_at = time.time()
+        logging.info(f"משדר Webhook ({payload.get('type')}) ל-{len(self.urls)} רסיברים...")
+        return [self.submit(self.send, url, payload, queued_at) for url in self.urls]
+
+    def status(self):
+        """סטטוס אחרון (תוצאה וזמנים) לכל רסיבר."""
+        with self._lock:
+            return {url: dict(status) for url, status in self._status.items()}
+
+
+# --- תור שליחה עמיד ---
+# הודעות קטלוג שמתמזגות להודעה אחת לכל רסיבר שפיגר, לפי סדר השליחה
+# (שירים לפני אירועים, כדי שהאירועים יפנו לשירים שכבר קיימים)
+COALESCED_TYPES = ('songs_update', 'events_update')
+# הודעות פאניק (קובץ מוקלט או שידור חי) עוקפות את כל השאר בתור
+PANIC_TYPES = ('panic_alert', 'panic_stream')
+# קריאת פאניק ישנה מזה לא תושמע לרסיבר שחזר לפעול
+PANIC_TTL_SECONDS = 300
+RETRY_BASE_SECONDS = 2
+RETRY_MAX_SECONDS = 300
+# כמה הודעות שכל הרסיברים כבר אישרו יצטברו לפני כתיבת היומן מחדש
+COMPACT_THRESHOLD = 200
+# כל כמה זמן השולח בודק אם תהליכים אחרים הוסיפו הודעות ליומן
+SHARED_POLL_SECONDS = 0.5
+
+
+class WebhookOutbox:
+    """
+    יומן הודעות יוצאות (append-only) עם סמן לכל רסיבר.
+
+    log.jsonl  - שורה לכל הודעה: seq, type, payload, created_at
+    cursors.json - לכל כתובת: ה-seq האחרון שהרסיבר אישר
+
+    קריאות פאניק נשלחות לפני עדכוני קטלוג, ועדכוני קטלוג שהצטברו
+    מתמזגים להודעה אחת לכל סוג.
+    """
+
+    def __init__(self, folder, dispatcher):
+        self.folder = folder
+        self.dispatcher = dispatcher
+        self._log_path = os.path.join(folder, 'log.jsonl')
+        self._cursors_path = os.path.join(folder, 'cursors.json')
+        self._lock_path = os.path.join(folder, 'log.lock')
+        self._offset = 0    # עד איפה היומן נקרא
+        self._inode = None  # משתנה כשהיומן נכתב מחדש
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._entries = []
+        self._seq = 0
+        self._cursors = {}
+        self._state = {url: {'attempts': 0, 'next_attempt': 0.0, 'in_flight': False, 'sent_panics': set()}
+                       for url in dispatcher.urls}
+        self._thread = None
+        os.makedirs(folder, exist_ok=True)
+        self._load()
+
+    # --- דיסק ---
+    def _load(self):
+        self._load_cursors()
+        self._catch_up()
+        self._seq = max([self._seq] + list(self._cursors.values()))
+        if self._entries:
+            logging.info(f"נטענו {len(self._entries)} הודעות ממתינות מיומן ה-Webhooks.")
+
+    def _load_cursors(self):
+        if os.path.exists(self._cursors_path):
+            try:
+                with open(self._cursors_path, 'r', encoding='utf-8') as f:
+                    self._cursors = json.load(f)
+            except ValueError:
+                logging.warning("קובץ הסמנים של ה-Webhooks פגום; כל הרסיברים יקבלו השלמה מלאה.")
+
+    def _catch_up(self):
+        """קורא הודעות שנוספו ליומן (גם ע"י תהליכים אחרים) מאז הקריאה הקודמת."""
+        try:
+            st = os.stat(self._log_path)
+        except FileNotFoundError:
+            return
+        if st.st_ino != self._inode:
+            self._entries, self._offset, self._inode = [], 0, st.st_ino
+        if st.st_size <= self._offset:
+            return
+        with open(self._log_path, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read()
+        # שורה חלקית (כתיבה שעדיין לא הסתיימה) תיקרא בפעם הבאה
+        data = data[:data.rfind(b'\n') + 1]
+        self._offset += len(data)
+        for line in data.splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                logging.warning("שורה פגומה ביומן ה-Webhooks דולגה.")
+                continue
+            self._entries.append(entry)
+            self._seq = max(self._seq, entry['seq'])
+
+    def _write_atomic(self, path, write):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _save_cursors(self):
+        self._write_atomic(self._cursors_path, lambda f: json.dump(self._cursors, f))
+
+    def _compact(self):
+        """
+        משליך מהיומן הודעות שאין בהן עוד צורך: כאלה שכל הרסיברים אישרו,
+        קריאות פאניק שפג תוקפן, ועדכוני קטלוג שיש אחריהם עדכון חדש יותר
+        מאותו סוג (ממילא רק האחרון נשלח). רק השולח כותב מחדש, תחת נעילת היומן.
+        """
+        if self._thread is None:
+            return
+        low = min((self._cursors.get(url, 0) for url in self._state), default=self._seq)
+        now = time.time()
+        latest = {}
+        for entry in self._entries:
+            if entry['type'] in COALESCED_TYPES:
+                latest[entry['type']] = entry['seq']
+        keep = []
+        for entry in self._entries:
+            if entry['seq'] <= low:
+                continue
+            if entry['type'] in PANIC_TYPES and now - entry['created_at'] > PANIC_TTL_SECONDS:
+                continue
+            if entry['type'] in COALESCED_TYPES and entry['seq'] != latest[entry['type']]:
+                continue
+            keep.append(entry)
+        if len(self._entries) - len(keep) < COMPACT_THRESHOLD:
+            return
+        self._entries = keep
+        self._write_atomic(self._log_path, lambda f: f.writelines(
+            json.dumps(e, ensure_ascii=False) + '\n' for e in keep))
+        st = os.stat(self._log_path)
+        self._offset, self._inode = st.st_size, st.st_ino
+
+    # --- הכנסה לתור ---
+    def enqueue(self, event_type, payload):
+        """רושם הודעה ביומן (עם fsync) ומעיר את מנגנון השליחה."""
+        with self._lock, file_lock(self._lock_path):
+            self._catch_up()
+            self._seq += 1
+            entry = {'seq': self._seq, 'type': event_type, 'payload': payload, 'created_at': time.time()}
+            with open(self._log_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+                self._offset = f.tell()
+            self._inode = os.stat(self._log_path).st_ino
+            self._entries.append(entry)
+            self._compact()
+            if event_type in PANIC_TYPES:
+                # קריאת פאניק עוקפת המתנה של ניסיונות חוזרים
+                for state in self._state.values():
+                    state['next_attempt'] = 0.0
+        self._wakeup.set()
+        return entry['seq']
+
+    def _pending(self, url):
+        """
+        ההודעות שיש לשלוח לרסיבר: קודם פאניקות בתוקף, ואז הודעה מרוכזת אחת
+        לכל סוג עדכון קטלוג. מחזיר גם את ה-seq שעד אליו הסמן יתקדם בהצלחה.
+        """
+        cursor = self._cursors.get(url, 0)
+        state = self._state[url]
+        now = time.time()
+        immediate, latest = [], {}
+        counts = dict.fromkeys(COALESCED_TYPES, 0)
+        for entry in self._entries:
+            if entry['seq'] <= cursor:
+                continue
+            if entry['type'] in COALESCED_TYPES:
+                latest[entry['type']] = entry
+                counts[entry['type']] += 1
+            elif entry['type'] not in PANIC_TYPES:
+                immediate.append(entry)
+            elif entry['seq'] not in state['sent_panics'] and now - entry['created_at'] <= PANIC_TTL_SECONDS:
+                immediate.append(entry)
+        immediate.sort(key=lambda e: e['type'] not in PANIC_TYPES)
+
+        messages = [(e['seq'], dict(e['payload'], type=e['type']), e['created_at']) for e in immediate]
+        for event_type in COALESCED_TYPES:
+            if event_type in latest:
+                payload = dict(latest[event_type]['payload'], type=event_type)
+                if counts[event_type] > 1:
+                    payload['coalesced'] = counts[event_type]
+                messages.append((None, payload, latest[event_type]['created_at']))
+        return self._seq, messages
+
+    # --- שליחה ---
+    def _deliver(self, url):
+        state = self._state[url]
+        with self._lock:
+            upto, messages = self._pending(url)
+        ok = True
+        try:
+            for seq, payload, created_at in messages:
+                if not self.dispatcher.send(url, payload, created_at):
+                    ok = False
+                    break
+                if seq is not None and payload['type'] in PANIC_TYPES:
+                    state['sent_panics'].add(seq)
+        except Exception as e:
+            logging.error(f"שגיאה בלתי צפויה בשליחה ל-{url}: {e}")
+            ok = False
+
+        with self._lock:
+            state['in_flight'] = False
+            if ok:
+                self._cursors[url] = max(upto, self._cursors.get(url, 0))
+                state['attempts'] = 0
+                state['sent_panics'] = {s for s in state['sent_panics'] if s > upto}
+                with file_lock(self._lock_path):
+                    self._save_cursors()
+                    self._catch_up()
+                    self._compact()
+            else:
+                state['attempts'] += 1
+                delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (state['attempts'] - 1))
+                state['next_attempt'] = time.time() + delay * random.uniform(0.8, 1.2)
+                logging.warning(f"רסיבר {url} לא זמין; ניסיון חוזר בעוד {delay:.0f} שניות (ניסיון {state['attempts']}).")
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            wait = SHARED_POLL_SECONDS
+            with self._lock:
+                self._catch_up()
+                for url, state in self._state.items():
+                    if state['in_flight'] or self._cursors.get(url, 0) >= self._seq:
+                        continue
+                    if state['next_attempt'] > now:
+                        wait = min(wait, state['next_attempt'] - now)
+                        continue
+                    state['in_flight'] = True
+                    self.dispatcher.submit(self._deliver, url)
+            self._wakeup.wait(wait)
+
+    def start(self):
+        """
+        מפעיל את ה-thread של מנגנון השליחה (פעם אחת לכל תהליך). הסמנים נקראים
+        מחדש מהדיסק: תהליך שנבחר למוביל אחרי נפילה של המוביל הקודם ממשיך מהמקום
+        שהקודם שמר, ולא מהסמנים שנטענו בעלייה (אחרת פאניקות שכבר נשלחו יושמעו שוב).
+        """
+        if self._thread is None:
+            with self._lock, file_lock(self._lock_path):
+                self._load_cursors()
+                self._catch_up()
+            self._thread = threading.Thread(target=self._run, name='webhook-outbox', daemon=True)
+            self._thread.start()
+        return self
+
+    def status(self):
+        """מצב התור לכל רסיבר, בנוסף לתוצאת השליחה האחרונה."""
+        statuses = self.dispatcher.status()
+        now = time.time()
+        with self._lock:
+            self._catch_up()
+            if self._thread is None:
+                # תהליך שאינו השולח: הסמנים העדכניים נמצאים בקובץ
+                self._load_cursors()
+            for url, state in self._state.items():
+                cursor = self._cursors.get(url, 0)
+                statuses.setdefault(url, {}).update({
+                    'cursor': cursor,
+                    'pending': sum(1 for e in self._entries if e['seq'] > cursor),
+                    'attempts': state['attempts'],
+                    'next_retry_in': round(max(0.0, state['next_attempt'] - now), 1),
+                })
+        return statuses